@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""
+Offline benchmark of onboarding domains end to end through `py_ses_auth.fleet`,
+against the local Cloudflare mock and a fake AWS SES backend.
+
+Each size runs in its own process and reports domains/sec, p50/p99 latency of
+Cloudflare requests and peak RSS:
+
+    python benchmarks/bench_onboarding.py --sizes 10 100 1000 10000 --workers 16
+"""
+
+from pathlib import Path
+import argparse
+import base64
+import contextlib
+import csv
+import io
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+path_benchmarks = Path(__file__).resolve().parent
+path_repo = path_benchmarks.parent
+sys.path.insert(0, str(path_repo))
+sys.path.insert(0, str(path_benchmarks))
+
+
+def _fake_key(label: str, n_bytes: int) -> str:
+    body = base64.b64encode(os.urandom(n_bytes)).decode()
+    lines = [body[i : i + 64] for i in range(0, len(body), 64)]
+    return "-----BEGIN {}-----\n{}\n-----END {}-----\n".format(
+        label, "\n".join(lines), label
+    )
+
+
+def generate_workspace(path: Path, n_domains: int, region="us-east-1") -> dict:
+    """
+    Create `n_domains` synthetic domain directories with key files, the config files
+    of `py_ses_auth` and `manifest.csv` in `path`. Return the zones.
+    """
+    zones = {}
+    with (path / "manifest.csv").open("w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            ("domain", "region", "selector", "token_name", "subdomain", "local_part")
+        )
+        for i in range(n_domains):
+            domain = "bench-{}.example".format(i)
+            zones[domain] = "{:032x}".format(i + 1)
+            path_src = path / domain
+            path_src.mkdir()
+            (path_src / "public.key").write_text(_fake_key("PUBLIC KEY", 162))
+            (path_src / "private.key").write_text(_fake_key("RSA PRIVATE KEY", 608))
+            writer.writerow((domain, region, "bench", "bench", "mail", "dmarc"))
+    with (path / "CLOUDFLARE_ZONE.json").open("w") as f:
+        json.dump(zones, f)
+    with (path / "CLOUDFLARE_API_TOKEN.json").open("w") as f:
+        json.dump({"bench": "bench-token"}, f)
+    path_bin = path / "bin"
+    path_bin.mkdir()
+    path_aws = path_bin / "aws"
+    path_aws.write_text("#!/bin/sh\nexit 0\n")
+    path_aws.chmod(0o755)
+    return zones
+
+
+def _percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    i = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[i]
+
+
+def run_once(path: Path, endpoint: str, args) -> dict:
+    """
+    Onboard the workspace at `path` in this process and return the measurements.
+    """
+    os.chdir(path)
+    os.environ["PATH"] = "{}{}{}".format(path / "bin", os.pathsep, os.environ["PATH"])
+    from py_ses_auth import rate_limit
+    from py_ses_auth.cloudflare_api import Cloudflare_API
+    from py_ses_auth.fleet import Fleet_Report, iter_onboard_fleet, read_manifest
+    from py_ses_auth.ses_backend import Fake_Backend
+
+    Cloudflare_API.endpoint = endpoint
+    rate_limit.bucket_config.update(limit=10**9, period=1, burst=10**6)
+    latencies = []
+    request = Cloudflare_API._request
+
+    def timed_request(self, method, url, **kwargs):
+        t = time.perf_counter()
+        try:
+            return request(self, method, url, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - t)
+
+    Cloudflare_API._request = timed_request
+    ses_backend = Fake_Backend() if args.ses == "fake" else "cli"
+
+    rows = read_manifest(path / "manifest.csv")
+    t = time.perf_counter()
+    with (
+        contextlib.redirect_stdout(io.StringIO())
+        if not args.verbose
+        else contextlib.nullcontext()
+    ):
+        with Fleet_Report(path / "report.jsonl") as report:
+            report.extend(
+                iter_onboard_fleet(path, rows, args.workers, args.batch, ses_backend)
+            )
+    elapsed = time.perf_counter() - t
+
+    latencies.sort()
+    domains = report.succeeded + report.failed
+    return dict(
+        domains=domains,
+        succeeded=report.succeeded,
+        seconds=elapsed,
+        domains_per_sec=domains / elapsed,
+        p50_ms=_percentile(latencies, 0.50) * 1000,
+        p99_ms=_percentile(latencies, 0.99) * 1000,
+        peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        **Cloudflare_API.counters.snapshot(),
+    )
+
+
+def run_size(n_domains: int, args) -> dict:
+    """
+    Generate a workspace, start the mock and onboard in a child process.
+    """
+    from mock_cloudflare import serve
+
+    path = Path(tempfile.mkdtemp(prefix="ses_auth_bench_"))
+    try:
+        zones = generate_workspace(path, n_domains)
+        process, endpoint = serve(zones, args.latency, args.throttle_rate)
+        try:
+            cmd = [sys.executable, __file__, "--child", str(path), endpoint]
+            cmd += ["--workers", str(args.workers), "--ses", args.ses]
+            if args.batch:
+                cmd += ["--batch", args.batch]
+            cp = subprocess.run(cmd, stdout=subprocess.PIPE, check=True)
+            return json.loads(cp.stdout.decode().splitlines()[-1])
+        finally:
+            process.terminate()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def print_report(reports: list):
+    header = (
+        "domains",
+        "ok",
+        "seconds",
+        "domains/s",
+        "requests",
+        "p50 ms",
+        "p99 ms",
+        "throttled",
+        "retried",
+        "peak RSS MB",
+    )
+    print(("{:>10}" * (len(header) - 1) + "{:>12}").format(*header))
+    for r in reports:
+        print(
+            "{:>10}{:>10}{:>10.2f}{:>10.1f}{:>10}{:>10.2f}{:>10.2f}{:>10}{:>10}{:>12.1f}".format(
+                r["domains"],
+                r["succeeded"],
+                r["seconds"],
+                r["domains_per_sec"],
+                r["requests"],
+                r["p50_ms"],
+                r["p99_ms"],
+                r["throttled"],
+                r["retried"],
+                r["peak_rss_mb"],
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--batch", choices=("records", "import"))
+    parser.add_argument(
+        "--ses",
+        choices=("fake", "cli"),
+        default="fake",
+        help="`fake` is the in-memory backend, `cli` runs a stub `aws` executable.",
+    )
+    parser.add_argument("--latency", type=float, default=0.01, help="Mock latency (s).")
+    parser.add_argument(
+        "--throttle_rate", type=float, default=0.0, help="Fraction of 429 responses."
+    )
+    parser.add_argument("--json", action="store_true", help="Print reports as JSONL.")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--child", nargs=2, metavar=("WORKSPACE", "ENDPOINT"))
+    args = parser.parse_args()
+
+    if args.child:
+        path, endpoint = args.child
+        print(json.dumps(run_once(Path(path), endpoint, args)))
+        return
+
+    reports = []
+    for n in args.sizes:
+        report = run_size(n, args)
+        reports.append(report)
+        if args.json:
+            print(json.dumps(report))
+    if not args.json:
+        print_report(reports)
+
+
+if __name__ == "__main__":
+    main()
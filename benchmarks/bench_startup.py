@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Cold-start time of `ses_auth.py`: wall time of `--version` and of a sub command's
+`--help`, and the cumulative import time of `py_ses_auth` by `-X importtime`.
+
+    python benchmarks/bench_startup.py --runs 20 --budget_ms 60
+
+Exit with status 1 if the median import time of `py_ses_auth` exceeds `--budget_ms`
+or if `requests` is imported at startup.
+"""
+
+from pathlib import Path
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+path_repo = Path(__file__).resolve().parent.parent
+path_cli = path_repo / "ses_auth.py"
+
+# default budget of the import time of `py_ses_auth`, also enforced by `tests/`
+budget_ms = 60.0
+# modules which must only be imported when a sub command needs them
+heavy_modules = ("requests", "urllib3", "aiohttp", "boto3")
+
+
+def wall_ms(args: list, runs: int) -> float:
+    samples = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        subprocess.run(
+            [sys.executable, str(path_cli)] + args,
+            cwd=path_repo,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        samples.append((time.perf_counter() - t) * 1000)
+    return statistics.median(samples)
+
+
+def import_times(runs: int):
+    """
+    Return the median cumulative import time (ms) of `py_ses_auth`, and the modules
+    imported by `ses_auth.py --version`.
+    """
+    samples = []
+    modules = set()
+    for _ in range(runs):
+        cp = subprocess.run(
+            [sys.executable, "-X", "importtime", str(path_cli), "--version"],
+            cwd=path_repo,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            check=True,
+        )
+        for line in cp.stderr.decode().splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line.split("|")
+            name = name.strip()
+            modules.add(name)
+            if name == "py_ses_auth":
+                samples.append(int(cumulative) / 1000)
+    return statistics.median(samples), modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget_ms", type=float, default=budget_ms)
+    args = parser.parse_args()
+
+    import_ms, modules = import_times(args.runs)
+    print("import py_ses_auth      {:>8.1f} ms".format(import_ms))
+    print("ses_auth.py --version   {:>8.1f} ms".format(wall_ms(["--version"], args.runs)))
+    print("ses_auth.py fleet -h    {:>8.1f} ms".format(wall_ms(["fleet", "-h"], args.runs)))
+
+    failures = []
+    if import_ms > args.budget_ms:
+        failures.append("import time exceeds {} ms".format(args.budget_ms))
+    eager = sorted(m for m in heavy_modules if m in modules)
+    if eager:
+        failures.append("imported at startup: {}".format(", ".join(eager)))
+    for failure in failures:
+        print("FAILED", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
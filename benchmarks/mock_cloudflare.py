@@ -0,0 +1,291 @@
+"""
+Local mock of the Cloudflare API endpoints used by `py_ses_auth`:
+`zones`, `zones/{id}/dns_records` (list, create, update, delete, `batch`, `import`).
+
+Each request sleeps `latency` seconds, and a `throttle_rate` fraction of requests
+is answered with 429 and `Retry-After`. `Mock_Cloudflare.fail` scripts the answers of
+matching requests, e.g. in tests.
+"""
+
+__all__ = ["Mock_Cloudflare", "serve", "start_in_process"]
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlparse
+import itertools
+import json
+import multiprocessing
+import random
+import time
+
+
+class Mock_Cloudflare:
+    """
+    In-memory state of the mock: zones and their DNS records.
+    """
+
+    def __init__(
+        self, zones: dict = None, latency: float = 0.0, throttle_rate: float = 0.0
+    ):
+        self.zones = dict(zones or {})
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.records = {}
+        self.counts = {}
+        self.failures = []
+        # set `capture` to keep (method, path, content type, body) of every request
+        self.capture = False
+        self.captured = []
+        self._ids = itertools.count(1)
+        self._lock = Lock()
+
+    def count(self, name: str):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def fail(
+        self,
+        status: int,
+        method: str = None,
+        token: str = None,
+        page: int = None,
+        times: int = None,
+        code: int = 10000,
+        headers=(),
+        skip: int = 0,
+    ):
+        """
+        Answer `times` requests (all of them if None) with `method`, API `token` and
+        listing `page` if given with `status` and the error `code`, after letting the
+        first `skip` of them through.
+        """
+        with self._lock:
+            self.failures.append(
+                dict(
+                    status=status,
+                    method=method,
+                    token=token,
+                    page=page,
+                    times=times,
+                    code=code,
+                    headers=tuple(headers),
+                    skip=skip,
+                )
+            )
+
+    def failure(self, method: str, token: str, page: int):
+        """
+        Return the scripted failure of a request, or None.
+        """
+        with self._lock:
+            for failure in self.failures:
+                if (
+                    failure["method"] in (None, method)
+                    and failure["token"] in (None, token)
+                    and failure["page"] in (None, page)
+                    and failure["times"] != 0
+                ):
+                    if failure["skip"] > 0:
+                        failure["skip"] -= 1
+                        return None
+                    if failure["times"] is not None:
+                        failure["times"] -= 1
+                    return failure
+        return None
+
+    def new_record(self, zone_id: str, payload: dict) -> dict:
+        record = dict(payload, id="{:032x}".format(next(self._ids)), zone_id=zone_id)
+        record["name"] = record["name"].rstrip(".")
+        record["modified_on"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        with self._lock:
+            self.records.setdefault(zone_id, {})[record["id"]] = record
+        return record
+
+
+def _handler_class(mock: Mock_Cloudflare):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, body: dict, headers=()):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in headers:
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _ok(self, result, result_info=None):
+            body = {"success": True, "errors": [], "messages": [], "result": result}
+            if result_info is not None:
+                body["result_info"] = result_info
+            self._send(200, body)
+
+        def _read_body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def _begin(self):
+            """
+            Return the path parts after `client/v4`, or None if the request is
+            throttled.
+            """
+            body = self._read_body()
+            mock.count(self.command)
+            if mock.capture:
+                with mock._lock:
+                    mock.captured.append(
+                        (self.command, self.path, self.headers.get("Content-Type"), body)
+                    )
+            if mock.latency:
+                time.sleep(mock.latency)
+            if mock.throttle_rate and random.random() < mock.throttle_rate:
+                mock.count("429")
+                self._send(
+                    429,
+                    {
+                        "success": False,
+                        "errors": [{"code": 10000, "message": "Rate limited"}],
+                    },
+                    [("Retry-After", "1")],
+                )
+                return None, None, None
+            url = urlparse(self.path)
+            parts = [p for p in url.path.split("/") if p]
+            if parts[:2] == ["client", "v4"]:
+                parts = parts[2:]
+            query = parse_qs(url.query)
+            if mock.failures:
+                authorization = self.headers.get("Authorization") or ""
+                failure = mock.failure(
+                    self.command,
+                    authorization[len("Bearer ") :],
+                    int(query.get("page", ["1"])[0]),
+                )
+                if failure is not None:
+                    mock.count(str(failure["status"]))
+                    self._send(
+                        failure["status"],
+                        {
+                            "success": False,
+                            "errors": [
+                                {"code": failure["code"], "message": "Scripted failure"}
+                            ],
+                        },
+                        failure["headers"],
+                    )
+                    return None, None, None
+            return parts, query, body
+
+        def _paginate(self, items: list, query: dict):
+            page = int(query.get("page", ["1"])[0])
+            per_page = int(query.get("per_page", ["100"])[0])
+            chunk = items[(page - 1) * per_page : page * per_page]
+            total_pages = max(1, -(-len(items) // per_page))
+            self._ok(
+                chunk,
+                dict(
+                    page=page,
+                    per_page=per_page,
+                    count=len(chunk),
+                    total_count=len(items),
+                    total_pages=total_pages,
+                ),
+            )
+
+        def do_GET(self):
+            parts, query, _ = self._begin()
+            if parts is None:
+                return
+            if parts == ["zones"]:
+                zones = [{"id": i, "name": n} for n, i in sorted(mock.zones.items())]
+                return self._paginate(zones, query)
+            if len(parts) == 3 and parts[0] == "zones" and parts[2] == "dns_records":
+                records = list(mock.records.get(parts[1], {}).values())
+                for key in ("type", "name", "content"):
+                    if key in query:
+                        records = [r for r in records if r.get(key) == query[key][0]]
+                if "order" in query:
+                    order = query["order"][0]
+                    records.sort(
+                        key=lambda r: r.get(order) or "",
+                        reverse=query.get("direction", ["asc"])[0] == "desc",
+                    )
+                return self._paginate(records, query)
+            self._send(
+                404, {"success": False, "errors": [{"code": 7003, "message": "No route"}]}
+            )
+
+        def do_POST(self):
+            parts, query, body = self._begin()
+            if parts is None:
+                return
+            zone_id = parts[1] if len(parts) > 1 else None
+            if parts[-1] == "batch":
+                payload = json.loads(body)
+                posts = [mock.new_record(zone_id, p) for p in payload.get("posts", ())]
+                return self._ok({"posts": posts, "patches": [], "puts": [], "deletes": []})
+            if parts[-1] == "import":
+                n = body.count(b"\tIN\t")
+                return self._ok({"recs_added": n, "total_records_parsed": n})
+            self._ok(mock.new_record(zone_id, json.loads(body)))
+
+        def do_PATCH(self):
+            parts, query, body = self._begin()
+            if parts is None:
+                return
+            record = mock.records.get(parts[1], {}).get(parts[3])
+            if record is None:
+                return self._send(
+                    404,
+                    {"success": False, "errors": [{"code": 81044, "message": "Not found"}]},
+                )
+            record.update(json.loads(body))
+            self._ok(record)
+
+        def do_DELETE(self):
+            parts, query, _ = self._begin()
+            if parts is None:
+                return
+            mock.records.get(parts[1], {}).pop(parts[3], None)
+            self._ok({"id": parts[3]})
+
+    return Handler
+
+
+def start_in_process(mock: Mock_Cloudflare, port: int = 0) -> ThreadingHTTPServer:
+    """
+    Serve `mock` in a daemon thread, return the server.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), _handler_class(mock))
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _serve(conn, zones: dict, latency: float, throttle_rate: float):
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), _handler_class(Mock_Cloudflare(zones, latency, throttle_rate))
+    )
+    server.daemon_threads = True
+    server.request_queue_size = 1024
+    conn.send(server.server_port)
+    server.serve_forever()
+
+
+def serve(zones: dict, latency: float = 0.0, throttle_rate: float = 0.0):
+    """
+    Serve a mock in a separate process so that it doesn't compete with the client
+    for the GIL. Return `(process, endpoint)`.
+    """
+    parent_conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(
+        target=_serve, args=(child_conn, zones, latency, throttle_rate), daemon=True
+    )
+    process.start()
+    port = parent_conn.recv()
+    return process, "http://127.0.0.1:{}/client/v4/".format(port)
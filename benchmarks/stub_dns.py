@@ -0,0 +1,86 @@
+"""
+Local stub DNS server answering over UDP from an in-memory table of records, it
+requires the module `dnspython`. Records can be published after a delay to mimic
+propagation:
+
+    stub = Stub_DNS()
+    stub.add("_dmarc.example.com", "TXT", '"v=DMARC1;p=quarantine"', delay=2)
+    server = start_in_process(stub)
+    # nameserver "127.0.0.1:{}".format(server.server_address[1])
+"""
+
+__all__ = ["Stub_DNS", "start_in_process"]
+
+from socketserver import BaseRequestHandler, ThreadingUDPServer
+from threading import Lock, Thread
+import time
+
+
+class Stub_DNS:
+    """
+    Records keyed by `(name, type)`, each one visible from its `published_at` time.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.queries = 0
+        self._lock = Lock()
+
+    def add(self, name: str, record_type: str, rdata: str, ttl: int = 60, delay=0.0):
+        key = (name.lower().rstrip("."), record_type.upper())
+        with self._lock:
+            self.records.setdefault(key, []).append((rdata, ttl, time.time() + delay))
+
+    def answer(self, name: str, record_type: str) -> list:
+        key = (name.lower().rstrip("."), record_type.upper())
+        now = time.time()
+        with self._lock:
+            self.queries += 1
+            return [(r, ttl) for r, ttl, at in self.records.get(key, ()) if at <= now]
+
+    def has_name(self, name: str) -> bool:
+        name = name.lower().rstrip(".")
+        with self._lock:
+            return any(n == name for n, _ in self.records)
+
+
+def _handler_class(stub: Stub_DNS):
+    import dns.message
+    import dns.rcode
+    import dns.rdataclass
+    import dns.rdatatype
+    import dns.rrset
+
+    class Handler(BaseRequestHandler):
+        def handle(self):
+            data, sock = self.request
+            query = dns.message.from_wire(data)
+            response = dns.message.make_response(query)
+            for question in query.question:
+                name = question.name.to_text()
+                record_type = dns.rdatatype.to_text(question.rdtype)
+                answers = stub.answer(name, record_type)
+                if answers:
+                    rrset = dns.rrset.from_text_list(
+                        question.name,
+                        min(ttl for _, ttl in answers),
+                        dns.rdataclass.IN,
+                        question.rdtype,
+                        [rdata for rdata, _ in answers],
+                    )
+                    response.answer.append(rrset)
+                elif not stub.has_name(name):
+                    response.set_rcode(dns.rcode.NXDOMAIN)
+            sock.sendto(response.to_wire(), self.client_address)
+
+    return Handler
+
+
+def start_in_process(stub: Stub_DNS, port: int = 0) -> ThreadingUDPServer:
+    """
+    Serve `stub` on 127.0.0.1 in a daemon thread, return the server.
+    """
+    server = ThreadingUDPServer(("127.0.0.1", port), _handler_class(stub))
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -6,23 +6,45 @@ __version__ = "0.1.0.dev"
 
 __all__ = [
     "create_byodkim_dns_record",
+    "delete_byodkim_dns_record",
     "aws_ses_create_email_identity",
     "aws_set_mail_from_domain",
     "create_mail_from_dns_record",
     "create_inbound_mx_dns_record",
-    " create_dmarc_dns_record",
+    "create_dmarc_dns_record",
+    "byodkim_dns_payloads",
+    "mail_from_dns_payloads",
+    "inbound_mx_dns_payloads",
+    "dmarc_dns_payloads",
+    "domain_dns_payloads",
+    "create_dns_records_in_batch",
+    "plan_dns_records",
+    "async_create_dns_records",
 ]
 
+from hashlib import sha256
 from pathlib import Path
 from string import Template
 import json
-import shlex
-import subprocess
+import time
 from .cloudflare_api import (
     Cloudflare_API,
+    DNS_Record_Batch,
     read_cloudflare_zone_id,
     read_dns_api_token,
 )
+from .journal import get_journal, journal_key, journaled
+from .metrics import metrics
+from .output import output
+from .rate_limit import get_token_bucket
+from .record_log import get_record_log
+from .ses_backend import get_ses_backend
+from .token_pool import (
+    get_cloudflare_api,
+    get_shared_cloudflare_api,
+    is_token_pool,
+    read_dns_api_tokens,
+)
 
 json_temp_for_create = Template(
     "{\n"
@@ -45,217 +67,554 @@ json_temp_for_update = Template(
 )
 
 
+@metrics.timed("read_key")
 def _read_key_from_file(path: Path):
     with path.open("r") as f:
         l = f.readlines()
         return "".join(map(lambda s: s.strip(), l[1:-1]))
 
 
-def _update_dns_record_info(path: Path, record: dict):
-    if not path.exists():
-        with path.open("w") as f:
-            json.dump({"Cloudflare": []}, f, indent=4)
-
-    with path.open("r+") as f:
-        d = json.load(f)
-        if not "Cloudflare" in d:
-            d["Cloudflare"] = []
-        d["Cloudflare"].append(record)
-        f.seek(0)
-        json.dump(d, f, indent=4)
+def _payloads_key(payloads) -> str:
+    """
+    Return the journal key of a set of DNS records.
+    """
+    return sha256(json.dumps(list(payloads), sort_keys=True).encode()).hexdigest()
 
 
-def _create_dns_record(fn, path_src: Path, domain: str, token_name: str):
+def _dns_record_success_fn(path_src: Path):
     def success_fn(response_json: dict):
-        path_dns_record = path_src / "dns_record_info.json"
-        _update_dns_record_info(path_dns_record, response_json["result"])
-        print("update `dns_record_info.json`")
+        with metrics.span("record_log"):
+            get_record_log(path_src).append(response_json["result"])
+        output.info(
+            "update `dns_record_info.jsonl`",
+            record_id=(response_json["result"] or {}).get("id"),
+        )
 
-    token = read_dns_api_token(token_name)
-    zone_id = read_cloudflare_zone_id(domain)
-    if token and zone_id:
-        if callable(fn):
-            return fn(Cloudflare_API(token, zone_id), success_fn)
+    return success_fn
+
+
+def _pending_dns_records(domain: str, payloads) -> list:
+    """
+    Return the payloads whose record isn't created in the journal of the current run.
+    Each record is journaled on its own, so that a step creating several records which
+    failed halfway only creates the others when it is resumed.
+    """
+    journal = get_journal()
+    if journal is None:
+        return list(payloads)
+    pending = []
+    for payload in payloads:
+        if journal.is_done(domain, "dns_record", _payloads_key((payload,))):
+            output.info(
+                "skip {} | {}, already created.".format(payload["type"], payload["name"])
+            )
+        else:
+            pending.append(payload)
+    return pending
 
 
-def create_byodkim_dns_record(path_src: Path, domain: str, token_name: str, selector: str):
-    path_public_key = path_src / "public.key"
-    assert path_public_key.exists(), "`{}` don't exist.".format(path_public_key.absolute())
+def _dns_record_created(domain: str, payload: dict):
+    journal = get_journal()
+    if journal is not None:
+        journal.mark_done(domain, "dns_record", _payloads_key((payload,)))
 
-    def success_fn(response_json: dict):
-        path_dns_record = path_src / "dns_record_info.json"
-        _update_dns_record_info(path_dns_record, response_json["result"])
-        print("update `dns_record_info.json`")
 
-    k = _read_key_from_file(path_public_key)
-    print("read public key")
+def _post_dns_records(domain: str, payloads):
+    """
+    Return a procedure for `_create_dns_record` which creates DNS records in order,
+    it stops at the first failure. Records already created are skipped, see
+    `_pending_dns_records`.
+    """
 
+    def procedure(dns_editor: Cloudflare_API, success_fn):
+        for payload in _pending_dns_records(domain, payloads):
+            status = Cloudflare_API.response_post_processsing(
+                dns_editor.create_dns_record(payload), success_fn
+            )
+            if not status:
+                return False
+            _dns_record_created(domain, payload)
+        return True
+
+    return procedure
+
+
+def _create_dns_record(
+    fn, path_src: Path, domain: str, token_name: str, cf_api: Cloudflare_API = None
+):
+    """
+    Call `fn(dns_editor, success_fn)` with a `Cloudflare_API` for the zone of `domain`.
+    If `cf_api` is given, or the running service keeps one open for `token_name`, its
+    session is shared instead of opening a new one.
+    """
+    if not callable(fn):
+        return
+    success_fn = _dns_record_success_fn(path_src)
+    if cf_api is None:
+        cf_api = get_shared_cloudflare_api(token_name)
+    if cf_api is not None:
+        zone_id = cf_api.resolve_zone_id(domain)
+        if zone_id:
+            return fn(cf_api.for_zone(zone_id), success_fn)
+        return
+
+    dns_editor = get_cloudflare_api(token_name, read_cloudflare_zone_id(domain))
+    if dns_editor is not None:
+        with dns_editor:
+            if dns_editor.zone_identifier is None:
+                zone_id = dns_editor.resolve_zone_id(domain)
+                if not zone_id:
+                    return
+                dns_editor.zone_identifier = zone_id
+            return fn(dns_editor, success_fn)
+
+
+def byodkim_dns_payloads(domain: str, selector: str, public_key: str) -> tuple:
     name = "{selector}._domainkey.{domain}".format(selector=selector, domain=domain)
-    value = "p={public_key}".format(public_key=k)
+    value = "p={public_key}".format(public_key=public_key)
+    return ({"type": "TXT", "name": name, "content": value, "ttl": 1},)
+
+
+def mail_from_dns_payloads(domain: str, region: str, subdomain_name: str) -> tuple:
+    name = "{}.{}".format(subdomain_name, domain)
+    return (
+        {
+            "type": "MX",
+            "name": name,
+            "content": "feedback-smtp.{}.amazonses.com".format(region),
+            "ttl": 1,
+            "priority": 10,
+        },
+        {
+            "type": "TXT",
+            "name": name,
+            "content": '"v=spf1 include:amazonses.com ~all"',
+            "ttl": 1,
+        },
+    )
+
+
+def inbound_mx_dns_payloads(domain: str, region: str, subdomain_name=None) -> tuple:
+    if type(subdomain_name) is str:
+        name = "{}.{}.".format(subdomain_name, domain)
+    else:
+        name = "{}.".format(domain)
+
+    return (
+        {
+            "type": "MX",
+            "name": name,
+            "content": "inbound-smtp.{}.amazonaws.com".format(region),
+            "ttl": 1,
+            "priority": 10,
+        },
+    )
+
+
+def dmarc_dns_payloads(domain: str, local_part: str, subdomain_name=None) -> tuple:
+    if type(subdomain_name) is str:
+        email_domain = "{}.{}".format(subdomain_name, domain)
+    else:
+        email_domain = domain
+
+    name = "_dmarc.{}".format(domain)
+    value = '"v=DMARC1;p=quarantine;pct=25;rua=mailto:{}@{}"'.format(
+        local_part, email_domain
+    )
+    return (
+        {
+            "type": "TXT",
+            "name": name,
+            "content": value,
+            "ttl": 1,
+        },
+    )
 
-    token = read_dns_api_token(token_name)
-    zone_id = read_cloudflare_zone_id(domain)
 
-    if token and zone_id:
-        dns_editor = Cloudflare_API(token, zone_id)
-        payload = {"type": "TXT", "name": name, "content": value, "ttl": 1}
+def create_byodkim_dns_record(
+    path_src: Path,
+    domain: str,
+    token_name: str,
+    selector: str,
+    cf_api: Cloudflare_API = None,
+    public_key: str = None,
+):
+    """
+    `public_key` is the base64 public key, e.g. returned by `keygen.keygen_domain`,
+    `public.key` is read if it is None.
+    """
+
+    def step():
+        k = public_key
+        if k is None:
+            path_public_key = path_src / "public.key"
+            assert path_public_key.exists(), "`{}` don't exist.".format(
+                path_public_key.absolute()
+            )
+            k = _read_key_from_file(path_public_key)
+            output.info("read public key")
 
-        return Cloudflare_API.response_post_processsing(
-            dns_editor.create_dns_record(payload), success_fn
+        payloads = byodkim_dns_payloads(domain, selector, k)
+        return _create_dns_record(
+            _post_dns_records(domain, payloads), path_src, domain, token_name, cf_api
         )
 
+    return journaled(domain, "byodkim_dns", journal_key(selector), step)
+
+
+def delete_byodkim_dns_record(
+    path_src: Path,
+    domain: str,
+    token_name: str,
+    selector: str,
+    cf_api: Cloudflare_API = None,
+):
+    """
+    Delete the TXT records of the DKIM public key of `selector`, e.g. a selector
+    retired by a key rotation.
+    """
+    name = "{selector}._domainkey.{domain}".format(selector=selector, domain=domain)
+
+    def procedure(dns_editor: Cloudflare_API, success_fn):
+        for record in dns_editor.find_dns_records("TXT", name):
+            status = Cloudflare_API.response_post_processsing(
+                dns_editor.delete_dns_record(record["id"]),
+                lambda _: output.info("delete `{}`".format(name), record_id=record["id"]),
+            )
+            if not status:
+                return False
+        return True
+
+    return journaled(
+        domain,
+        "byodkim_dns_delete",
+        journal_key(selector),
+        lambda: _create_dns_record(procedure, path_src, domain, token_name, cf_api),
+    )
+
+
+def _identity_json_body(path_json: Path, template: Template, selector, **kwargs) -> dict:
+    """
+    Build the request body from `template` if `selector` is given and dump it to
+    `path_json` for later use without `--selector`, otherwise load the dumped one.
+    """
+    if type(selector) is str:
+        out = template.substitute(selector=selector, **kwargs)
+        with path_json.open("w") as f:
+            f.write(out)
+            output.info("dump '{}'".format(path_json.name))
+        return json.loads(out)
+    assert path_json.exists(), "Please use `--selector` to specify `DomainSigningSelector`."
+    with path_json.open("r") as f:
+        return json.load(f)
+
 
 def aws_ses_create_email_identity(
-    path_src: Path, domain: str, region: str, selector=None, is_new=True
+    path_src: Path,
+    domain: str,
+    region: str,
+    selector=None,
+    is_new=True,
+    ses_backend=None,
+    path_key: Path = None,
 ):
-    path_private_key = path_src / "private.key"
+    """
+    `path_key` is the directory of `private.key`, default is `path_src`.
+    """
+    return journaled(
+        domain,
+        "ses_identity" if is_new else "ses_dkim_attributes",
+        journal_key(region, selector),
+        lambda: _aws_ses_email_identity(
+            path_src, domain, region, selector, is_new, ses_backend, path_key
+        ),
+    )
+
+
+def _aws_ses_email_identity(
+    path_src: Path, domain: str, region: str, selector, is_new, ses_backend, path_key
+):
+    path_private_key = (path_key or path_src) / "private.key"
     assert path_private_key.exists(), "`{}` don't exist.".format(
         path_private_key.absolute()
     )
     k = _read_key_from_file(path_private_key)
+    backend = get_ses_backend(ses_backend)
     if is_new:
-        path_create_identity_json = path_src / "create-identity.json"
-        if type(selector) is str:
-            with path_create_identity_json.open("w") as f:
-                out = json_temp_for_create.substitute(
-                    domain=domain, private_key=k, selector=selector
-                )
-                f.write(out)
-                print("dump 'create-identity.json'")
-        assert (
-            path_create_identity_json.exists()
-        ), "Please use `--selector` to specify `DomainSigningSelector`."
-        print("[AWS CLI]")
-        cmd = (
-            "aws sesv2 create-email-identity --cli-input-json file://{} --region {}".format(
-                path_create_identity_json, region
-            )
+        body = _identity_json_body(
+            path_src / "create-identity.json",
+            json_temp_for_create,
+            selector,
+            domain=domain,
+            private_key=k,
         )
-        args = shlex.split(cmd)
-        cp = subprocess.run(args)
+        with metrics.span("aws_ses", operation="create_email_identity"):
+            return backend.create_email_identity(region, body)
     else:
-        path_update_identity_json = path_src / "update-identity.json"
-        if type(selector) is str:
-            with path_update_identity_json.open("w") as f:
-                out = json_temp_for_update.substitute(private_key=k, selector=selector)
-                f.write(out)
-                print("dump 'update-identity.json'")
-        assert (
-            path_update_identity_json.exists()
-        ), "Please use `--selector` to specify `DomainSigningSelector`."
-        print("[AWS CLI]")
-        cmd = "aws sesv2 put-email-identity-dkim-signing-attributes --email-identity {} --cli-input-json file://{} --region {}".format(
-            domain, path_update_identity_json, region
+        body = _identity_json_body(
+            path_src / "update-identity.json",
+            json_temp_for_update,
+            selector,
+            private_key=k,
         )
-        args = shlex.split(cmd)
-        cp = subprocess.run(args)
+        with metrics.span(
+            "aws_ses", operation="put_email_identity_dkim_signing_attributes"
+        ):
+            return backend.put_email_identity_dkim_signing_attributes(region, domain, body)
 
 
 def aws_set_mail_from_domain(
-    domain: str, region: str, subdomain_name: str, on_mx_failure="USE_DEFAULT_VALUE"
+    domain: str,
+    region: str,
+    subdomain_name: str,
+    on_mx_failure="USE_DEFAULT_VALUE",
+    ses_backend=None,
 ):
     if not on_mx_failure in ("USE_DEFAULT_VALUE", "REJECT_MESSAGE"):
         on_mx_failure = "USE_DEFAULT_VALUE"
-    print("[AWS CLI]")
-    cmd = (
-        "aws sesv2 put-email-identity-mail-from-attributes "
-        "--email-identity {} --mail-from-domain {} --behavior-on-mx-failure {} --region {}"
-    ).format(domain, "{}.{}".format(subdomain_name, domain), on_mx_failure, region)
-    args = shlex.split(cmd)
-    cp = subprocess.run(args)
-    print("done.")
+
+    def step():
+        with metrics.span("aws_ses", operation="put_email_identity_mail_from_attributes"):
+            status = get_ses_backend(ses_backend).put_email_identity_mail_from_attributes(
+                region, domain, "{}.{}".format(subdomain_name, domain), on_mx_failure
+            )
+        output.info("done.")
+        return status
+
+    return journaled(
+        domain,
+        "mail_from_attributes",
+        journal_key(region, subdomain_name, on_mx_failure),
+        step,
+    )
 
 
 def create_mail_from_dns_record(
-    path_src: Path, domain: str, region: str, token_name: str, subdomain_name: str
+    path_src: Path,
+    domain: str,
+    region: str,
+    token_name: str,
+    subdomain_name: str,
+    cf_api: Cloudflare_API = None,
 ):
-    def success_fn(response_json: dict):
-        path_dns_record = path_src / "dns_record_info.json"
-        _update_dns_record_info(path_dns_record, response_json["result"])
-        print("update `dns_record_info.json`")
+    payloads = mail_from_dns_payloads(domain, region, subdomain_name)
+    return journaled(
+        domain,
+        "mail_from_dns",
+        journal_key(region, subdomain_name),
+        lambda: _create_dns_record(
+            _post_dns_records(domain, payloads), path_src, domain, token_name, cf_api
+        ),
+    )
 
-    token = read_dns_api_token(token_name)
-    zone_id = read_cloudflare_zone_id(domain)
 
-    if token and zone_id:
-        dns_editor = Cloudflare_API(token, zone_id)
-        name = "{}.{}".format(subdomain_name, domain)
-        payloads = (
-            {
-                "type": "MX",
-                "name": name,
-                "content": "feedback-smtp.{}.amazonses.com".format(region),
-                "ttl": 1,
-                "priority": 10,
-            },
-            {
-                "type": "TXT",
-                "name": name,
-                "content": '"v=spf1 include:amazonses.com ~all"',
-                "ttl": 1,
-            },
-        )
+def create_inbound_mx_dns_record(
+    path_src: Path,
+    domain: str,
+    region: str,
+    token_name: str,
+    subdomain_name=None,
+    cf_api: Cloudflare_API = None,
+):
+    payloads = inbound_mx_dns_payloads(domain, region, subdomain_name)
+    return journaled(
+        domain,
+        "inbound_mx_dns",
+        journal_key(region, subdomain_name),
+        lambda: _create_dns_record(
+            _post_dns_records(domain, payloads), path_src, domain, token_name, cf_api
+        ),
+    )
 
-        status = Cloudflare_API.response_post_processsing(
-            dns_editor.create_dns_record(payloads[0]), success_fn
-        )
-        if not status:
-            return status
-        status = Cloudflare_API.response_post_processsing(
-            dns_editor.create_dns_record(payloads[1]), success_fn
+
+def create_dmarc_dns_record(
+    path_src: Path,
+    domain: str,
+    token_name: str,
+    local_part: str,
+    subdomain_name=None,
+    cf_api: Cloudflare_API = None,
+):
+    payloads = dmarc_dns_payloads(domain, local_part, subdomain_name)
+
+    def step():
+        output.info(payloads[0]["content"])
+        return _create_dns_record(
+            _post_dns_records(domain, payloads), path_src, domain, token_name, cf_api
         )
-        return status
 
+    return journaled(domain, "dmarc_dns", journal_key(local_part, subdomain_name), step)
+
+
+def domain_dns_payloads(
+    path_src: Path,
+    domain: str,
+    region: str,
+    selector: str = None,
+    subdomain_name: str = None,
+    local_part: str = None,
+    public_key: str = None,
+) -> tuple:
+    """
+    Return payloads of all the DNS records of a domain. The DKIM record is included
+    if `selector` is given, so are MAIL FROM records with `subdomain_name` and the DMARC
+    record with `local_part`. `public.key` is read unless `public_key` is given.
+    """
+    payloads = ()
+    if selector:
+        if public_key is None:
+            path_public_key = path_src / "public.key"
+            assert path_public_key.exists(), "`{}` don't exist.".format(
+                path_public_key.absolute()
+            )
+            public_key = _read_key_from_file(path_public_key)
+        payloads += byodkim_dns_payloads(domain, selector, public_key)
+    if subdomain_name:
+        payloads += mail_from_dns_payloads(domain, region, subdomain_name)
+    payloads += inbound_mx_dns_payloads(domain, region)
+    if local_part:
+        payloads += dmarc_dns_payloads(domain, local_part)
+    return payloads
+
+
+def create_dns_records_in_batch(
+    path_src: Path,
+    domain: str,
+    token_name: str,
+    payloads,
+    cf_api: Cloudflare_API = None,
+    zone_import=False,
+):
+    """
+    Create DNS records of a domain in one request, through the batch endpoint or,
+    if `zone_import` is True, the zone import endpoint.
+    """
 
-def create_inbound_mx_dns_record(
-    path_src: Path, domain: str, region: str, token_name: str, subdomain_name=None
+    def procedure(dns_editor: Cloudflare_API, success_fn):
+        batch: DNS_Record_Batch = dns_editor.batch()
+        for payload in payloads:
+            batch.create_dns_record(payload)
+        if zone_import:
+            return batch.submit_import()
+        return batch.submit(success_fn)
+
+    step = "dns_import" if zone_import else "dns_batch"
+    return journaled(
+        domain,
+        step,
+        _payloads_key(payloads),
+        lambda: _create_dns_record(procedure, path_src, domain, token_name, cf_api),
+    )
+
+
+def plan_dns_records(
+    path_src: Path,
+    domain: str,
+    token_name: str,
+    payloads,
+    cf_api: Cloudflare_API = None,
+    apply=False,
+    zone_indexes=None,
 ):
+    """
+    Diff DNS records of a domain against its zone and print the plan.
+    If `apply` is True, only the records which differ are created or updated.
+    The live zone is the state here, so the journal is not consulted.
+    `zone_indexes` is a shared `Zone_Indexes` so that each zone is listed only once.
+    Return True if the plan is computed (and applied) successfully.
+    """
+    from .plan import Zone_Indexes, plan_records, print_plan, apply_plan
+
+    if zone_indexes is None:
+        zone_indexes = Zone_Indexes()
+
     def procedure(dns_editor: Cloudflare_API, success_fn):
-        if type(subdomain_name) is str:
-            name = "{}.{}.".format(subdomain_name, domain)
-        else:
-            name = "{}.".format(domain)
+        index = zone_indexes.get(dns_editor)
+        plan = plan_records(index, payloads)
+        print_plan(domain, plan)
+        if apply:
+            return apply_plan(dns_editor, index, plan, success_fn)
+        return True
 
-        payload = {
-            "type": "MX",
-            "name": name,
-            "content": "inbound-smtp.{}.amazonaws.com".format(region),
-            "ttl": 1,
-            "priority": 10,
-        }
+    return _create_dns_record(procedure, path_src, domain, token_name, cf_api)
 
-        return Cloudflare_API.response_post_processsing(
-            dns_editor.create_dns_record(payload), success_fn
-        )
 
-    _create_dns_record(procedure, path_src, domain, token_name)
+async def async_create_dns_records(
+    path_src: Path, domain: str, payloads, token_name: str = None, cf_api=None
+):
+    """
+    Create DNS records of `domain` concurrently through an `Async_Cloudflare_API`.
+    If `cf_api` is None, a new one is opened for `token_name` and closed afterwards.
+    Return True if all records are created.
+    """
+    payloads = tuple(payloads)
+    journal = get_journal()
+    key = _payloads_key(payloads)
+    with output.context(domain=domain, step="dns_records"):
+        if journal is not None and journal.is_done(domain, "dns_records", key):
+            output.info("skip `dns_records` of {}, already done.".format(domain))
+            output.event(status="skipped", duration=0.0)
+            return True
+        start = time.perf_counter()
+        status = False
+        try:
+            status = await _async_create_dns_records(
+                path_src, domain, payloads, token_name, cf_api
+            )
+        finally:
+            output.event(
+                status="ok" if status else "failed",
+                duration=round(time.perf_counter() - start, 6),
+            )
+    if status and journal is not None:
+        journal.mark_done(domain, "dns_records", key)
+    return status
 
 
-def create_dmarc_dns_record(
-    path_src: Path, domain: str, token_name: str, local_part: str, subdomain_name=None
+async def _async_create_dns_records(
+    path_src: Path, domain: str, payloads, token_name: str, cf_api
 ):
-    def procedure(dns_editor: Cloudflare_API, success_fn):
-        if type(subdomain_name) is str:
-            email_domain = "{}.{}".format(subdomain_name, domain)
+    from .cloudflare_async import Async_Cloudflare_API
+
+    zone_id = read_cloudflare_zone_id(domain)
+    if not zone_id:
+        return False
+    if cf_api is None:
+        if is_token_pool(token_name):
+            # the async client uses one token, the one with the most headroom
+            tokens = read_dns_api_tokens(token_name).values()
+            token = max(tokens, key=lambda t: get_token_bucket(t).headroom(), default=None)
         else:
-            email_domain = domain
+            token = read_dns_api_token(token_name)
+        if not token:
+            return False
+        async with Async_Cloudflare_API(token, zone_id) as dns_editor:
+            return await _async_post_dns_records(dns_editor, path_src, domain, payloads)
+    return await _async_post_dns_records(
+        cf_api.for_zone(zone_id), path_src, domain, payloads
+    )
 
-        name = "_dmarc.{}".format(domain)
-        value = '"v=DMARC1;p=quarantine;pct=25;rua=mailto:{}@{}"'.format(
-            local_part, email_domain
-        )
 
-        print(value)
+async def _async_post_dns_records(dns_editor, path_src: Path, domain: str, payloads):
+    """
+    Create the DNS records not created yet concurrently, each one is journaled as it
+    is created, see `_pending_dns_records`.
+    """
+    import asyncio
 
-        payload = {
-            "type": "TXT",
-            "name": name,
-            "content": value,
-            "ttl": 1,
-        }
+    log_record = _dns_record_success_fn(path_src)
 
-        return Cloudflare_API.response_post_processsing(
-            dns_editor.create_dns_record(payload), success_fn
-        )
+    def success_fn(payload: dict):
+        def created(response_json: dict):
+            log_record(response_json)
+            _dns_record_created(domain, payload)
 
-    _create_dns_record(procedure, path_src, domain, token_name)
+        return created
+
+    status = await asyncio.gather(
+        *(
+            dns_editor.create_dns_records((payload,), success_fn(payload))
+            for payload in _pending_dns_records(domain, payloads)
+        )
+    )
+    return all(status)
@@ -0,0 +1,278 @@
+"""
+Auditing the DNS records of domains against their live zones, to find drift between
+what the CLI would create, what it logged in `dns_record_info.json` and what is live.
+
+Each zone is listed once and its records are checked one by one against hashed indexes
+of the expected records, so memory doesn't grow with the size of the zone.
+"""
+
+__all__ = ["drift_kinds", "Zone_Audit", "audit_zone", "iter_audit_fleet", "audit_fleet"]
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock
+import json
+from . import domain_dns_payloads
+from .cloudflare_api import Cloudflare_API
+from .output import output
+from .plan import normalize_record, record_kind
+from .profiling import profiler
+from .record_index import get_record_index
+from .record_log import Record_Log
+
+# "missing": no live record of an expected record's kind
+# "mismatch": a live record of the same kind has another content
+# "deleted": a logged record which is still managed doesn't exist anymore
+# "modified": a logged record which is still managed was changed in the zone
+drift_kinds = ("missing", "mismatch", "deleted", "modified")
+
+
+def _brief(record: dict) -> dict:
+    brief = {k: record.get(k) for k in ("id", "type", "name", "content")}
+    if record.get("type") == "MX":
+        brief["priority"] = record.get("priority")
+    return brief
+
+
+class Zone_Audit:
+    """
+    Expected and logged records of the domains of one zone, indexed by content, kind
+    and id. Live records are fed to `check` one at a time, then `drifts` yields the
+    differences.
+    """
+
+    def __init__(self, zone_id: str):
+        self.zone_id = zone_id
+        self.domains = []
+        self._expected = {}
+        self._kinds = {}
+        self._logged = {}
+        self._found = set()
+        self._seen_ids = set()
+        self._conflicts = {}
+        self._modified = []
+        self.checked = 0
+
+    def add_domain(self, domain: str, payloads, logged_records=()):
+        self.domains.append(domain)
+        for payload in payloads:
+            digest = normalize_record(payload)
+            self._expected[digest] = (domain, payload)
+            self._kinds.setdefault(record_kind(payload), []).append(digest)
+        for record in logged_records:
+            # records of a kind which isn't expected anymore (e.g. a retired DKIM
+            # selector) are not managed anymore
+            if record.get("id") and record_kind(record) in self._kinds:
+                self._logged[record["id"]] = (domain, record)
+
+    def check(self, record: dict):
+        self.checked += 1
+        digest = normalize_record(record)
+        if digest in self._expected:
+            self._found.add(digest)
+        else:
+            kind = record_kind(record)
+            if kind in self._kinds:
+                self._conflicts.setdefault(kind, _brief(record))
+        logged = self._logged.get(record.get("id"))
+        if logged is not None:
+            self._seen_ids.add(record["id"])
+            if digest not in self._expected and normalize_record(logged[1]) != digest:
+                self._modified.append((logged[0], logged[1], _brief(record)))
+
+    def drifts(self):
+        """
+        Yield drift entries as dicts, once all the live records are checked.
+        """
+        deleted = [
+            (domain, record)
+            for record_id, (domain, record) in self._logged.items()
+            if record_id not in self._seen_ids and not self._superseded(record)
+        ]
+        deleted_digests = {normalize_record(record) for _, record in deleted}
+        mismatched = set()
+        for digest, (domain, payload) in self._expected.items():
+            if digest in self._found:
+                continue
+            live = self._conflicts.get(record_kind(payload))
+            if live is None:
+                # reported as deleted if the CLI created it
+                if digest not in deleted_digests:
+                    yield self._drift("missing", domain, payload, None)
+                continue
+            mismatched.add(live["id"])
+            yield self._drift("mismatch", domain, payload, live)
+        for domain, record in deleted:
+            yield self._drift("deleted", domain, _brief(record), None)
+        for domain, record, live in self._modified:
+            if live["id"] not in mismatched:
+                yield self._drift("modified", domain, _brief(record), live)
+
+    def _superseded(self, record: dict) -> bool:
+        # the log is append-only: a logged record whose expected records are live,
+        # e.g. re-created under a new id by `apply`, isn't a drift anymore
+        kind = record_kind(record)
+        return normalize_record(record) in self._found or all(
+            digest in self._found for digest in self._kinds[kind]
+        )
+
+    def _drift(self, kind: str, domain: str, expected: dict, live) -> dict:
+        return {
+            "drift": kind,
+            "domain": domain,
+            "zone_id": self.zone_id,
+            "type": expected["type"],
+            "name": expected["name"],
+            "expected": expected.get("content"),
+            "live": live,
+        }
+
+
+def audit_zone(dns_editor: Cloudflare_API, audit: Zone_Audit) -> list:
+    """
+    Check every live record of the zone of `dns_editor`, listed page by page or
+    synced into the record index of the current run, and return the drift entries.
+    """
+    output.info("Audit zone {} ({} domain(s))".format(audit.zone_id, len(audit.domains)))
+    record_index = get_record_index()
+    if record_index is not None:
+        # deleted records are only dropped by a full listing
+        record_index.sync(dns_editor, full=True)
+        records = record_index.records(audit.zone_id)
+    else:
+        records = dns_editor.list_dns_records()
+    for record in records:
+        audit.check(record)
+    return list(audit.drifts())
+
+
+def iter_audit_fleet(
+    path_cwd: Path, rows, drift_file, workers: int = 8, max_zone_domains: int = 1000
+):
+    """
+    Audit the domains of `rows` zone by zone, write the drift entries of each zone to
+    the text file `drift_file` as JSONL as soon as it completes, and yield a result per
+    domain like `iter_onboard_fleet`, with the number of `drifts`.
+
+    Rows are resolved through a bounded worker pool as the manifest is read. A zone is
+    audited, then released, once `max_zone_domains` of its domains are read or when it
+    is the least recently read of more than `workers` open zones, so memory doesn't grow
+    with the fleet. A zone whose domains are spread over the manifest may be listed
+    more than once, sorting the manifest by zone lists each zone once.
+    """
+    from collections import OrderedDict, deque
+    from .fleet import _Cloudflare_API_Pool, _check_row, _iter_bounded
+
+    apis = _Cloudflare_API_Pool(workers)
+    drift_lock = Lock()
+    # (token name, zone id) -> `Zone_Audit` of the domains read so far
+    open_zones = OrderedDict()
+    # futures of the zone audits, oldest first
+    running = deque()
+
+    def new_result(domain: str) -> dict:
+        return {
+            "domain": domain,
+            "success": True,
+            "failed_step": None,
+            "error": None,
+            "drifts": 0,
+        }
+
+    def fail(result: dict, step: str, err: Exception) -> dict:
+        result["success"] = False
+        result["failed_step"] = step
+        result["error"] = "{}: {}".format(type(err).__name__, err)
+        return result
+
+    def resolve(row: dict):
+        domain = row["domain"]
+        path_src = path_cwd / domain
+        try:
+            with profiler.step(domain):
+                _check_row(path_src, row)
+                cf_api = apis.get(row["token_name"])
+                assert cf_api is not None, "Unknown token name `{}`.".format(
+                    row["token_name"]
+                )
+                zone_id = cf_api.resolve_zone_id(domain)
+                assert zone_id, "No zone of `{}`.".format(domain)
+                payloads = domain_dns_payloads(
+                    path_src,
+                    domain,
+                    row.get("region"),
+                    row.get("selector"),
+                    row.get("subdomain"),
+                    row.get("local_part"),
+                )
+                logged_records = Record_Log(path_src).records()
+        except Exception as err:
+            return fail(new_result(domain), "audit_resolve", err), None
+        return None, ((row["token_name"], zone_id), domain, payloads, logged_records)
+
+    def run(token_name: str, zone_id: str, zone_audit: Zone_Audit) -> list:
+        results = {domain: new_result(domain) for domain in zone_audit.domains}
+        try:
+            # shared by the domains of the zone, so profiled under the zone identifier
+            with profiler.step(zone_id):
+                drifts = audit_zone(apis.get(token_name).for_zone(zone_id), zone_audit)
+        except Exception as err:
+            return [fail(result, "audit", err) for result in results.values()]
+        with drift_lock:
+            for drift in drifts:
+                drift_file.write(json.dumps(drift, separators=(",", ":")) + "\n")
+                result = results[drift["domain"]]
+                result["drifts"] += 1
+                result["success"] = False
+                result["failed_step"] = "drift"
+            drift_file.flush()
+        for result in results.values():
+            if result["drifts"]:
+                result["error"] = "{} drift(s)".format(result["drifts"])
+        return list(results.values())
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    def audit(key: tuple):
+        running.append(executor.submit(run, *key, open_zones.pop(key)))
+
+    def completed(wait=False):
+        # zone audits waiting for a worker hold their records, so at most `workers`
+        # of them are queued
+        while running and (wait or running[0].done() or len(running) > workers):
+            yield from running.popleft().result()
+
+    try:
+        resolved_rows = _iter_bounded(
+            rows, 2 * workers, lambda row: executor.submit(resolve, row)
+        )
+        for failed, resolved in resolved_rows:
+            if failed is not None:
+                yield failed
+                continue
+            key, domain, payloads, logged_records = resolved
+            zone_audit = open_zones.get(key)
+            if zone_audit is None:
+                zone_audit = open_zones[key] = Zone_Audit(key[1])
+            open_zones.move_to_end(key)
+            zone_audit.add_domain(domain, payloads, logged_records)
+            if len(zone_audit.domains) >= max_zone_domains:
+                audit(key)
+            if len(open_zones) > workers:
+                audit(next(iter(open_zones)))
+            yield from completed()
+        while open_zones:
+            audit(next(iter(open_zones)))
+        yield from completed(wait=True)
+    finally:
+        executor.shutdown()
+        apis.close()
+
+
+def audit_fleet(
+    path_cwd: Path, rows, drift_file, workers: int = 8, max_zone_domains: int = 1000
+) -> list:
+    """
+    Return the list of results of `iter_audit_fleet`.
+    """
+    return list(iter_audit_fleet(path_cwd, rows, drift_file, workers, max_zone_domains))
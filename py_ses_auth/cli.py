@@ -5,6 +5,10 @@ https://gist.github.com/ShenTengTu/5e40217db8f7a218b28f365a13a14c00
 __all__ = ["arg_meta", "CLI"]
 
 import argparse
+import contextlib
+import sys
+from .metrics import metrics
+from .output import output
 
 
 def arg_meta(*arg_flags, **arg_conf):
@@ -32,6 +36,10 @@ class CLI(argparse.ArgumentParser):
         self._sub_parser_handler_map = {}
         self._sub_parser_alias_map = {}
         self._argument_group_metadata_map = {}
+        # arguments & argument groups of sub parsers, added when the sub command is used
+        self._sub_parser_pending_map = {}
+        # context managers entered around every handler call
+        self._handler_contexts = []
 
         super().__init__(**main_params)
 
@@ -50,11 +58,59 @@ class CLI(argparse.ArgumentParser):
             help="Display the version of CLI.",
         )
 
+        # Add `metrics` argument
+        self.add_argument(
+            "--metrics",
+            metavar="PATH",
+            help="Write timings of every phase and request counts to PATH, "
+            "as Prometheus text if PATH ends with `.prom`, otherwise as a JSON trace.",
+        )
+
+        # Add profiling arguments
+        self.add_argument(
+            "--profile",
+            metavar="DIR",
+            help="Profile the sub command and write to DIR a profile merged across "
+            "domains and threads, and one per domain.",
+        )
+        self.add_argument(
+            "--profile_format",
+            choices=("pstats", "collapsed"),
+            default="pstats",
+            help="`pstats` (cProfile, default) or `collapsed` (sampled stacks for "
+            "flame graphs).",
+        )
+        self.add_argument(
+            "--profile_aggregate",
+            action="store_true",
+            help="Only write the profile merged across domains.",
+        )
+
+        # Add output arguments
+        self.add_argument(
+            "-q",
+            "--quiet",
+            action="store_true",
+            help="Only print errors and summaries.",
+        )
+        self.add_argument(
+            "--json",
+            action="store_true",
+            help="Write messages as JSON lines with the domain, step and status they "
+            "belong to, and an event with the duration of every step.",
+        )
+        self.add_argument(
+            "--log_file",
+            metavar="PATH",
+            help="Append messages to PATH instead of printing them.",
+        )
+
     def sub_command(self, **kwargs):
         """
         Decorator.
         - Add sub parser with the same name as the function.
         - Register the function as the handler of the sub parser
+        Arguments of the sub parser are only added when it is used, see `_build_sub_parser`.
         """
 
         def deco(fn):
@@ -64,6 +120,7 @@ class CLI(argparse.ArgumentParser):
                 for alias in kwargs["aliases"]:
                     self._sub_parser_alias_map[alias] = fn_name
             self._sub_parsers_action.add_parser(fn_name, **kwargs)
+            self._sub_parser_pending_map[fn_name] = []
 
             return fn
 
@@ -76,8 +133,7 @@ class CLI(argparse.ArgumentParser):
         """
 
         def deco(fn):
-            parser = self._sub_parsers_action._name_parser_map[fn.__name__]
-            parser.add_argument(*arg_flags, **arg_conf)
+            self._sub_parser_pending_map[fn.__name__].append((arg_flags, arg_conf))
             return fn
 
         return deco
@@ -89,26 +145,58 @@ class CLI(argparse.ArgumentParser):
         """
 
         def deco(fn):
-            metadata = self._argument_group_metadata_map.get(title, None)
-            if metadata:
-                description, list_of_arg_conf = metadata
-                parser = self._sub_parsers_action._name_parser_map[fn.__name__]
-                g = parser.add_argument_group(title, description)
-                for arg_flags, arg_conf in list_of_arg_conf:
-                    g.add_argument(*arg_flags, **arg_conf)
+            self._sub_parser_pending_map[fn.__name__].append(title)
+            return fn
 
         return deco
 
+    def handler_context(self, fn):
+        """
+        Decorator.
+        - Register `fn(namespace)`, which returns a context manager, to be entered
+          around every handler call, e.g. to open a resource given by a main argument.
+        """
+        self._handler_contexts.append(fn)
+        return fn
+
     def register_argument_group(self, title, description=None, list_of_arg_conf=[]):
         """
         Register an argument group by given title and related metadata.
         """
         self._argument_group_metadata_map[title] = (description, list_of_arg_conf)
 
+    def _build_sub_parser(self, name):
+        """
+        Add the pending arguments & argument groups to the sub parser `name` or its alias.
+        """
+        name = self._sub_parser_alias_map.get(name, name)
+        pending = self._sub_parser_pending_map.pop(name, None)
+        if pending is None:
+            return
+        parser = self._sub_parsers_action._name_parser_map[name]
+        for item in pending:
+            if type(item) is str:
+                metadata = self._argument_group_metadata_map.get(item, None)
+                if metadata:
+                    description, list_of_arg_conf = metadata
+                    g = parser.add_argument_group(item, description)
+                    for arg_flags, arg_conf in list_of_arg_conf:
+                        g.add_argument(*arg_flags, **arg_conf)
+            else:
+                arg_flags, arg_conf = item
+                parser.add_argument(*arg_flags, **arg_conf)
+
     def handle_args(self, args=None, namespace=None):
         """
-        Parse args then pass to handler
+        Parse args then pass to handler, whose return value is set as
+        `handler_result` of the returned namespace.
         """
+        if args is None:
+            args = sys.argv[1:]
+        # only the sub parsers of sub commands in `args` are built
+        for arg in args:
+            if arg in self._sub_parsers_action._name_parser_map:
+                self._build_sub_parser(arg)
         namespace = self.parse_args(args, namespace)
         sub_parser_name = getattr(namespace, self._sub_dest_name, None)
         if sub_parser_name is not None:
@@ -117,5 +205,39 @@ class CLI(argparse.ArgumentParser):
                 fn_name = self._sub_parser_alias_map.get(sub_parser_name)
                 fn = self._sub_parser_handler_map.get(fn_name)
             if callable(fn):
-                fn(namespace)
+                path_metrics = getattr(namespace, "metrics", None)
+                if path_metrics:
+                    metrics.enable()
+                quiet = getattr(namespace, "quiet", False)
+                json_lines = getattr(namespace, "json", False)
+                path_log = getattr(namespace, "log_file", None)
+                # otherwise the output of the running process is left as is
+                configure_output = quiet or json_lines or path_log
+                if configure_output:
+                    output.configure(quiet, json_lines, path_log)
+                path_profile = getattr(namespace, "profile", None)
+                profile_context = contextlib.nullcontext()
+                if path_profile:
+                    from .profiling import profiler
+
+                    profiler.enable(
+                        path_profile,
+                        getattr(namespace, "profile_format", "pstats"),
+                        getattr(namespace, "profile_aggregate", False),
+                    )
+                    profile_context = profiler.command(sub_parser_name)
+                try:
+                    with contextlib.ExitStack() as stack:
+                        for context in self._handler_contexts:
+                            stack.enter_context(context(namespace))
+                        with metrics.span("command", command=sub_parser_name):
+                            with profile_context:
+                                namespace.handler_result = fn(namespace)
+                finally:
+                    if path_metrics:
+                        metrics.export(path_metrics)
+                    if path_profile:
+                        profiler.export()
+                    if configure_output:
+                        output.close()
         return namespace
@@ -1,73 +1,501 @@
 from pathlib import Path
-import json
-import requests
+import time
+from .config_store import Config_Store
+from .metrics import metrics
+from .output import output
+from .record_index import get_record_index
+from .rate_limit import (
+    Retry_Policy,
+    Token_Bucket,
+    counters,
+    get_token_bucket,
+    parse_retry_after,
+)
+from .zone_cache import Zone_Cache, domain_suffixes
 
 _path_cwd = Path.cwd()
 _path_api_token_json = _path_cwd / "CLOUDFLARE_API_TOKEN.json"
 _path_cloudflare_zone_json = _path_cwd / "CLOUDFLARE_ZONE.json"
 
+# tokens are secret and the file is small, so no marshal cache is written beside it
+api_token_store = Config_Store(_path_api_token_json, use_cache=False)
+cloudflare_zone_store = Config_Store(_path_cloudflare_zone_json)
+zone_cache = Zone_Cache(_path_cwd / ".cloudflare_zone_cache.json")
 
+
+@metrics.timed("config_lookup")
 def read_dns_api_token(token_name: str) -> str:
-    with _path_api_token_json.open("r") as f:
-        token_dict: dict = json.load(f)
-        return token_dict.get(token_name, None)
+    return api_token_store.get(token_name, None)
 
 
+@metrics.timed("config_lookup")
 def read_cloudflare_zone_id(domain: str):
-    with _path_cloudflare_zone_json.open("r") as f:
-        zone_dict: dict = json.load(f)
-        return zone_dict.get(domain, None)
+    """
+    Return the zone identifier listed in `CLOUDFLARE_ZONE.json` for `domain` or
+    the longest parent domain of it.
+    """
+    zones = cloudflare_zone_store.data
+    for name in domain_suffixes(domain):
+        if name in zones:
+            return zones[name]
+    return None
+
+
+def _is_connect_error(err) -> bool:
+    """
+    Return True if the request of a `requests` error wasn't sent because the
+    connection couldn't be opened.
+    """
+    import requests
+    from urllib3.exceptions import ConnectTimeoutError
+
+    if isinstance(err, requests.ConnectTimeout):
+        return True
+    # `NewConnectionError` is a `ConnectTimeoutError` too
+    reason = getattr(err.args[0], "reason", None) if err.args else None
+    return isinstance(reason, ConnectTimeoutError)
+
+
+class Cloudflare_API_Error(Exception):
+    """
+    Raised when a listing request of Cloudflare API fails, `response` is the failed
+    response.
+    """
+
+    def __init__(self, response):
+        super().__init__("{} {}".format(response.status_code, response.reason))
+        self.response = response
 
 
 class Cloudflare_API:
+    """
+    Cloudflare API client.
+
+    Each instance owns a pooled `requests.Session` so that connections are kept alive
+    and reused across DNS record creations. An instance can be shared by several zones,
+    see `for_zone`.
+
+    Requests are paced by the `Token_Bucket` of the token and retried by `retry_policy`,
+    `counters` counts sent, throttled and retried requests of all instances.
+    """
+
     endpoint = "https://api.cloudflare.com/client/v4/"
+    default_pool_maxsize = 10
+    # seconds to connect and to wait for a response, e.g. of a large batch request
+    timeout = (10, 60)
+    retry_policy = Retry_Policy()
+    counters = counters
 
     @classmethod
-    def response_post_processsing(cls, response: requests.Response, success_fn):
+    def response_post_processsing(cls, response: "requests.Response", success_fn):
         status_code = response.status_code
         if not status_code in (200, 400):
-            print("[Response] HTTP  status  : {} {}".format(status_code, response.reason))
+            output.error(
+                "[Response] HTTP  status  : {} {}".format(status_code, response.reason),
+                status=status_code,
+            )
             return False
 
         response_json: dict = response.json()
         success = response_json.get("success", None)
 
-        print("[Cloudflare API]")
+        output.info("[Cloudflare API]")
         if success is True:
             if callable(success_fn):
                 success_fn(response_json)
                 return True
         elif success is False:
             for entry in response_json["errors"]:
-                print(
+                output.error(
                     "API Response Error: [code:{}] {}".format(
                         entry["code"], entry["message"]
-                    )
+                    ),
+                    status=status_code,
                 )
                 if "error_chain" in entry:
                     for item in entry["error_chain"]:
-                        print(
+                        output.error(
                             "        ----> [code:{}] {}".format(
                                 item["code"], item["message"]
                             )
                         )
         else:
-            print("Unexepected response:", response_json)
+            output.error("Unexepected response: {}".format(response_json))
         return False
 
-    def __init__(self, token: str, zone_identifier: str):
+    def __init__(
+        self,
+        token: str,
+        zone_identifier: str,
+        pool_maxsize: int = None,
+        session: "requests.Session" = None,
+        bucket: Token_Bucket = None,
+    ):
         self.token = token
         self.zone_identifier = zone_identifier
+        self._owns_session = session is None
+        if session is None:
+            session = self._new_session(token, pool_maxsize or self.default_pool_maxsize)
+        self.session = session
+        self.bucket = bucket or get_token_bucket(token)
+
+    @staticmethod
+    def _new_session(token: str, pool_maxsize: int) -> "requests.Session":
+        import requests
+        import requests.adapters
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_maxsize
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(
+            {
+                "Content-Type": "application/json",
+                "Authorization": "Bearer {}".format(token),
+            }
+        )
+        return session
+
+    def for_zone(self, zone_identifier: str) -> "Cloudflare_API":
+        """
+        Return an instance for another zone which shares the same session.
+        """
+        if zone_identifier == self.zone_identifier:
+            return self
+        return Cloudflare_API(
+            self.token, zone_identifier, session=self.session, bucket=self.bucket
+        )
+
+    def close(self):
+        """
+        Close the session if it is owned by this instance.
+        """
+        if self._owns_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _request(self, method: str, url: str, **kwargs) -> "requests.Response":
+        """
+        Send a request paced by the token bucket, retrying throttled requests, server
+        errors and connection errors as allowed by `retry_policy`.
+        """
+        import requests
+
+        retry_policy = self.retry_policy
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            self.counters.incr("requests")
+            try:
+                with metrics.span("cloudflare_request", method=method) as span:
+                    response = self.session.request(method, url, **kwargs)
+                    span.set(status=response.status_code)
+                metrics.incr(
+                    "cloudflare_responses", method=method, status=response.status_code
+                )
+            except (requests.ConnectionError, requests.Timeout) as err:
+                if attempt >= retry_policy.max_retries or not retry_policy.retries_error(
+                    method, not _is_connect_error(err)
+                ):
+                    raise
+                delay = retry_policy.delay(attempt)
+            else:
+                status_code = response.status_code
+                if status_code == 429:
+                    self.counters.incr("throttled")
+                if (
+                    not retry_policy.retries_status(method, status_code)
+                    or attempt >= retry_policy.max_retries
+                ):
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                delay = retry_policy.delay(attempt, retry_after)
+                if status_code == 429:
+                    # hold back the other requests with the same token too,
+                    # the bucket makes the next `acquire` wait
+                    self.bucket.pause(delay)
+                    delay = 0
+            self.counters.incr("retried")
+            if delay > 0:
+                time.sleep(delay)
+            attempt += 1
+
+    def iter_results(self, path: str, per_page: int = 50, **params):
+        """
+        Yield every item of a paginated listing, e.g. `zones`, page by page.
+        Raise `Cloudflare_API_Error` if a page can't be fetched.
+        """
+        url = "{}{}".format(self.endpoint, path)
+        page = 1
+        while True:
+            response = self._request(
+                "GET", url, params=dict(params, page=page, per_page=per_page)
+            )
+            response_json = response.json() if response.status_code == 200 else {}
+            if response_json.get("success") is not True:
+                Cloudflare_API.response_post_processsing(response, None)
+                raise Cloudflare_API_Error(response)
+            yield from response_json["result"]
+            info = response_json.get("result_info") or {}
+            if page >= info.get("total_pages", 1):
+                return
+            page += 1
+
+    def list_zones(self) -> dict:
+        """
+        Return a dict of names to identifiers of all the zones the token can access.
+        """
+        output.info("List zones")
+        return {zone["name"]: zone["id"] for zone in self.iter_results("zones")}
+
+    def resolve_zone_id(self, domain: str):
+        """
+        Return the identifier of the zone which `domain` belongs to, from
+        `CLOUDFLARE_ZONE.json` or else the zone list of the token, which is cached
+        in `.cloudflare_zone_cache.json`.
+        """
+        zone_id = read_cloudflare_zone_id(domain)
+        if zone_id:
+            return zone_id
+
+        def fetch_zones():
+            import requests
+
+            try:
+                return self.list_zones()
+            except (Cloudflare_API_Error, requests.RequestException) as err:
+                output.error("Failed to list zones: {}".format(err))
+                return None
+
+        with metrics.span("zone_resolve"):
+            return zone_cache.resolve(domain, self.token, fetch_zones)
+
+    def list_dns_records(self, per_page: int = 5000, **params):
+        """
+        Yield every DNS record of the zone which matches `params`.
+        Raise `Cloudflare_API_Error` if a page can't be fetched.
+        """
+        path = "zones/{}/dns_records".format(self.zone_identifier)
+        return self.iter_results(path, per_page=per_page, **params)
+
+    def find_dns_records(self, record_type: str = None, name: str = None) -> list:
+        """
+        Return the DNS records of the zone with `record_type` and `name` if given,
+        from the record index of the current run, synced first, otherwise from the API.
+        """
+        record_index = get_record_index()
+        if record_index is not None:
+            record_index.sync(self)
+            return record_index.find(self.zone_identifier, record_type, name)
+        params = {}
+        if record_type is not None:
+            params["type"] = record_type
+        if name is not None:
+            params["name"] = name
+        return list(self.list_dns_records(**params))
+
+    @staticmethod
+    def mirror_response(zone_identifier: str, response: "requests.Response", deleted=()):
+        """
+        Update the record index of the current run with the records of a successful
+        response which created, updated or deleted records of the zone.
+        """
+        record_index = get_record_index()
+        if record_index is None or response.status_code != 200:
+            return
+        response_json = response.json() or {}
+        if response_json.get("success") is not True:
+            return
+        result = response_json.get("result") or {}
+        for record_id in deleted:
+            record_index.delete(zone_identifier, record_id)
+        if "id" in result and not deleted:
+            record_index.upsert(zone_identifier, result)
+        for key in ("deletes", "patches", "puts", "posts"):
+            for record in result.get(key) or ():
+                if key == "deletes":
+                    record_index.delete(zone_identifier, record["id"])
+                else:
+                    record_index.upsert(zone_identifier, record)
 
-    def create_dns_record(self, payload: dict) -> dict:
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": "Bearer {}".format(self.token),
-        }
+    def update_dns_record(
+        self, record_identifier: str, payload: dict
+    ) -> "requests.Response":
+        url = "{}zones/{}/dns_records/{}".format(
+            self.endpoint, self.zone_identifier, record_identifier
+        )
+        output.info(
+            "Update DNS Record: {} | {} | {}".format(
+                payload["type"], payload["name"], payload["content"]
+            ),
+            record_id=record_identifier,
+        )
+        response = self._request("PATCH", url, json=payload)
+        self.mirror_response(self.zone_identifier, response)
+        return response
+
+    def delete_dns_record(self, record_identifier: str) -> "requests.Response":
+        url = "{}zones/{}/dns_records/{}".format(
+            self.endpoint, self.zone_identifier, record_identifier
+        )
+        output.info(
+            "Delete DNS Record: {}".format(record_identifier), record_id=record_identifier
+        )
+        response = self._request("DELETE", url)
+        self.mirror_response(self.zone_identifier, response, deleted=(record_identifier,))
+        return response
+
+    def create_dns_record(self, payload: dict) -> "requests.Response":
         url = "{}zones/{}/dns_records".format(self.endpoint, self.zone_identifier)
-        print(
+        output.info(
             "Add DNS Record: {} | {} | {}".format(
                 payload["type"], payload["name"], payload["content"]
             )
         )
-        return requests.post(url, headers=headers, json=payload)
+        response = self._request("POST", url, json=payload)
+        self.mirror_response(self.zone_identifier, response)
+        return response
+
+    def batch(self) -> "DNS_Record_Batch":
+        """
+        Return a `DNS_Record_Batch` which collects DNS records of the zone.
+        """
+        return DNS_Record_Batch(self)
+
+    def batch_dns_records(
+        self, posts=(), patches=(), puts=(), deletes=()
+    ) -> "requests.Response":
+        """
+        Submit several DNS record changes of the zone in one request.
+        Cloudflare executes them atomically in the order deletes, patches, puts, posts.
+        """
+        url = "{}zones/{}/dns_records/batch".format(self.endpoint, self.zone_identifier)
+        payload = {}
+        for key, items in (
+            ("deletes", deletes),
+            ("patches", patches),
+            ("puts", puts),
+            ("posts", posts),
+        ):
+            if items:
+                payload[key] = list(items)
+        output.info(
+            "Batch DNS Records: {} change(s)".format(sum(map(len, payload.values())))
+        )
+        response = self._request("POST", url, json=payload)
+        self.mirror_response(self.zone_identifier, response)
+        return response
+
+    def import_dns_records(self, zone_fragment: str, proxied=False) -> "requests.Response":
+        """
+        Upload a BIND zone fragment to the zone import endpoint.
+        """
+        url = "{}zones/{}/dns_records/import".format(self.endpoint, self.zone_identifier)
+        output.info(
+            "Import DNS Records: {} line(s)".format(len(zone_fragment.splitlines()))
+        )
+        # let `requests` set the multipart content type
+        response = self._request(
+            "POST",
+            url,
+            headers={"Content-Type": None},
+            files={"file": ("records.txt", zone_fragment)},
+            data={"proxied": "true" if proxied else "false"},
+        )
+        # the endpoint doesn't return the created records
+        record_index = get_record_index()
+        if record_index is not None and response.status_code == 200:
+            record_index.invalidate(self.zone_identifier)
+        return response
+
+
+def _bind_txt_content(content: str) -> str:
+    if content.startswith('"') and content.endswith('"'):
+        content = content[1:-1]
+    # a character-string of TXT record is limited to 255 octets
+    chunks = [content[i : i + 255] for i in range(0, len(content), 255)] or [""]
+    return " ".join('"{}"'.format(c) for c in chunks)
+
+
+def bind_zone_fragment(payloads) -> str:
+    """
+    Render payloads of DNS records as a BIND zone fragment.
+    """
+    lines = []
+    for payload in payloads:
+        name = payload["name"].rstrip(".") + "."
+        record_type = payload["type"]
+        content = payload["content"]
+        if record_type == "TXT":
+            content = _bind_txt_content(content)
+        elif record_type in ("MX", "CNAME", "NS"):
+            content = content.rstrip(".") + "."
+        if "priority" in payload:
+            content = "{} {}".format(payload["priority"], content)
+        lines.append(
+            "{}\t{}\tIN\t{}\t{}".format(name, payload.get("ttl", 1), record_type, content)
+        )
+    return "\n".join(lines) + "\n"
+
+
+class DNS_Record_Batch:
+    """
+    Collect payloads of DNS records of a zone, then create them in one request
+    through the batch endpoint (`submit`) or the zone import endpoint (`submit_import`).
+    """
+
+    def __init__(self, dns_editor: Cloudflare_API):
+        self.dns_editor = dns_editor
+        self.payloads = []
+
+    def create_dns_record(self, payload: dict):
+        output.info(
+            "Queue DNS Record: {} | {} | {}".format(
+                payload["type"], payload["name"], payload["content"]
+            )
+        )
+        self.payloads.append(payload)
+
+    def submit(self, success_fn) -> bool:
+        """
+        Create the collected records by the batch endpoint.
+        `success_fn` is called once per created record as if it was created alone.
+        """
+        if not self.payloads:
+            return True
+
+        def batch_success_fn(response_json: dict):
+            for record in response_json["result"].get("posts", ()):
+                if callable(success_fn):
+                    success_fn(dict(response_json, result=record))
+
+        response = self.dns_editor.batch_dns_records(posts=self.payloads)
+        return Cloudflare_API.response_post_processsing(response, batch_success_fn)
+
+    def submit_import(self) -> bool:
+        """
+        Create the collected records by the zone import endpoint.
+        The endpoint doesn't return created records, so nothing is passed to
+        a success function.
+        """
+        if not self.payloads:
+            return True
+
+        def import_success_fn(response_json: dict):
+            result = response_json.get("result") or {}
+            output.info(
+                "{} of {} record(s) added.".format(
+                    result.get("recs_added"), result.get("total_records_parsed")
+                )
+            )
+
+        response = self.dns_editor.import_dns_records(bind_zone_fragment(self.payloads))
+        return Cloudflare_API.response_post_processsing(response, import_success_fn)
@@ -0,0 +1,200 @@
+"""
+asyncio counterpart of `Cloudflare_API`, it requires the module `aiohttp`.
+"""
+
+__all__ = ["Async_Cloudflare_API"]
+
+import asyncio
+from .cloudflare_api import Cloudflare_API, Cloudflare_API_Error
+from .metrics import metrics
+from .output import output
+from .rate_limit import get_token_bucket, parse_retry_after
+
+
+class _Response:
+    """
+    The subset of `requests.Response` used by `Cloudflare_API.response_post_processsing`.
+    """
+
+    def __init__(self, status_code: int, reason: str, response_json, headers=None):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers or {}
+        self._json = response_json
+
+    def json(self):
+        return self._json
+
+
+class Async_Cloudflare_API:
+    """
+    Async Cloudflare API client.
+
+    Requests of all the instances which share a session are bounded by the same
+    semaphore, see `for_zone`. Like `Cloudflare_API`, requests are paced by the token
+    bucket of the token and retried by `Cloudflare_API.retry_policy`.
+    """
+
+    endpoint = Cloudflare_API.endpoint
+    default_concurrency = 16
+
+    def __init__(self, token: str, zone_identifier: str, concurrency: int = None):
+        self.token = token
+        self.zone_identifier = zone_identifier
+        self.concurrency = concurrency or self.default_concurrency
+        self._owns_session = True
+        self._session = None
+        self._semaphore = None
+        self.bucket = get_token_bucket(token)
+
+    def for_zone(self, zone_identifier: str) -> "Async_Cloudflare_API":
+        """
+        Return an instance for another zone which shares the same session and
+        concurrency limit.
+        """
+        if zone_identifier == self.zone_identifier:
+            return self
+        api = Async_Cloudflare_API(self.token, zone_identifier, self.concurrency)
+        api._owns_session = False
+        api._session = self._get_session()
+        api._semaphore = self._semaphore
+        return api
+
+    def _get_session(self):
+        if self._session is None:
+            import aiohttp
+
+            self._session = aiohttp.ClientSession(
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": "Bearer {}".format(self.token),
+                },
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=Cloudflare_API.timeout[0],
+                    sock_read=Cloudflare_API.timeout[1],
+                ),
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _send(self, method: str, url: str, **kwargs) -> _Response:
+        async with self._semaphore:
+            async with self._session.request(method, url, **kwargs) as response:
+                try:
+                    response_json = await response.json(content_type=None)
+                except ValueError:
+                    response_json = None
+                return _Response(
+                    response.status,
+                    response.reason,
+                    response_json,
+                    dict(response.headers),
+                )
+
+    async def _request(self, method: str, path: str, **kwargs) -> _Response:
+        import aiohttp
+
+        self._get_session()
+        url = "{}zones/{}/{}".format(self.endpoint, self.zone_identifier, path)
+        retry_policy = Cloudflare_API.retry_policy
+        counters = Cloudflare_API.counters
+        attempt = 0
+        while True:
+            wait = self.bucket.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            counters.incr("requests")
+            try:
+                with metrics.span("cloudflare_request", method=method) as span:
+                    response = await self._send(method, url, **kwargs)
+                    span.set(status=response.status_code)
+                metrics.incr(
+                    "cloudflare_responses", method=method, status=response.status_code
+                )
+            except aiohttp.ClientConnectionError as err:
+                sent = not isinstance(err, aiohttp.ClientConnectorError)
+                if attempt >= retry_policy.max_retries or not retry_policy.retries_error(
+                    method, sent
+                ):
+                    raise
+                delay = retry_policy.delay(attempt)
+            else:
+                if response.status_code == 429:
+                    counters.incr("throttled")
+                if (
+                    not retry_policy.retries_status(method, response.status_code)
+                    or attempt >= retry_policy.max_retries
+                ):
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                delay = retry_policy.delay(attempt, retry_after)
+                if response.status_code == 429:
+                    self.bucket.pause(delay)
+                    delay = 0
+            counters.incr("retried")
+            if delay > 0:
+                await asyncio.sleep(delay)
+            attempt += 1
+
+    async def create_dns_record(self, payload: dict) -> _Response:
+        output.info(
+            "Add DNS Record: {} | {} | {}".format(
+                payload["type"], payload["name"], payload["content"]
+            )
+        )
+        response = await self._request("POST", "dns_records", json=payload)
+        Cloudflare_API.mirror_response(self.zone_identifier, response)
+        return response
+
+    async def create_dns_records(self, payloads, success_fn) -> bool:
+        """
+        Create DNS records concurrently, return True if all of them are created.
+        """
+        responses = await asyncio.gather(*map(self.create_dns_record, payloads))
+        status = [
+            Cloudflare_API.response_post_processsing(response, success_fn)
+            for response in responses
+        ]
+        return all(status)
+
+    async def list_dns_records(self, per_page: int = 100, **params) -> list:
+        """
+        Return all DNS records of the zone which match `params`.
+        Raise `Cloudflare_API_Error` if a page can't be fetched.
+        """
+        records = []
+        page = 1
+        while True:
+            query = dict(params, page=page, per_page=per_page)
+            response = await self._request("GET", "dns_records", params=query)
+            response_json = (response.json() or {}) if response.status_code == 200 else {}
+            if response_json.get("success") is not True:
+                Cloudflare_API.response_post_processsing(response, None)
+                raise Cloudflare_API_Error(response)
+            records.extend(response_json["result"])
+            info = response_json.get("result_info") or {}
+            if page >= info.get("total_pages", 1):
+                return records
+            page += 1
+
+    async def delete_dns_record(self, record_identifier: str) -> _Response:
+        output.info(
+            "Delete DNS Record: {}".format(record_identifier), record_id=record_identifier
+        )
+        response = await self._request("DELETE", "dns_records/{}".format(record_identifier))
+        Cloudflare_API.mirror_response(
+            self.zone_identifier, response, deleted=(record_identifier,)
+        )
+        return response
@@ -0,0 +1,97 @@
+"""
+JSON object files loaded once per process and held as dict indexes.
+"""
+
+__all__ = ["Config_Store"]
+
+from pathlib import Path
+from threading import Lock
+from time import monotonic
+import json
+import marshal
+import os
+
+
+class Config_Store:
+    """
+    A JSON object file, e.g. `CLOUDFLARE_ZONE.json`, held in memory as a dict.
+
+    The file is reloaded if its mtime changes, which is checked at most once every
+    `check_interval` seconds, so lookups in between cost no I/O. A missing file is
+    an empty dict until it is created.
+    If `use_cache` is True, the parsed dict is also kept in a marshal file beside the
+    JSON file (`<name>.cache`), which is much faster to load than a large JSON file.
+    """
+
+    def __init__(self, path: Path, check_interval: float = 1.0, use_cache=True):
+        self.path = path
+        self.path_cache = path.with_name(path.name + ".cache")
+        self.check_interval = check_interval
+        self.use_cache = use_cache
+        self._data = None
+        self._signature = None
+        self._checked_at = None
+        self._lock = Lock()
+
+    def get(self, key: str, default=None):
+        return self.data.get(key, default)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.data
+
+    @property
+    def data(self) -> dict:
+        checked_at = self._checked_at
+        if checked_at is None or monotonic() - checked_at >= self.check_interval:
+            self._refresh()
+        return self._data
+
+    def invalidate(self):
+        """
+        Force a reload at the next lookup.
+        """
+        with self._lock:
+            self._checked_at = None
+            self._signature = None
+
+    def _refresh(self):
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                self._data = {}
+                self._signature = None
+                self._checked_at = monotonic()
+                return
+            signature = (st.st_mtime_ns, st.st_size)
+            if signature != self._signature:
+                self._data = self._load(signature)
+                self._signature = signature
+            self._checked_at = monotonic()
+
+    def _load(self, signature: tuple) -> dict:
+        if self.use_cache:
+            try:
+                with self.path_cache.open("rb") as f:
+                    cached_signature, data = marshal.loads(f.read())
+                if tuple(cached_signature) == signature:
+                    return data
+            except (OSError, EOFError, ValueError, TypeError):
+                pass
+
+        with self.path.open("r") as f:
+            data: dict = json.load(f)
+
+        if self.use_cache:
+            path_tmp = self.path_cache.with_name(
+                "{}.{}.tmp".format(self.path_cache.name, os.getpid())
+            )
+            try:
+                with path_tmp.open("wb") as f:
+                    f.write(marshal.dumps((signature, data)))
+                os.replace(path_tmp, self.path_cache)
+            except (OSError, ValueError):
+                # the cache is optional, e.g. the directory may be read-only
+                if path_tmp.exists():
+                    path_tmp.unlink()
+        return data
@@ -0,0 +1,600 @@
+"""
+Onboarding a fleet of domains described by a manifest.
+"""
+
+__all__ = [
+    "manifest_fields",
+    "read_manifest",
+    "domain_steps",
+    "onboard_domain",
+    "schedule_domain",
+    "iter_onboard_fleet",
+    "onboard_fleet",
+    "plan_domain",
+    "iter_plan_fleet",
+    "plan_fleet",
+    "Domain_Result",
+    "Fleet_Report",
+    "print_summary",
+    "print_report",
+]
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from queue import SimpleQueue
+from threading import Lock
+import csv
+import gzip
+import itertools
+import json
+from . import (
+    create_byodkim_dns_record,
+    aws_ses_create_email_identity,
+    aws_set_mail_from_domain,
+    create_mail_from_dns_record,
+    create_inbound_mx_dns_record,
+    create_dmarc_dns_record,
+    domain_dns_payloads,
+    create_dns_records_in_batch,
+    plan_dns_records,
+)
+from .cloudflare_api import Cloudflare_API
+from .journal import get_journal, journal_key
+from .output import output
+from .plan import Zone_Indexes
+from .profiling import profiler
+from .record_log import close_record_log
+from .scheduler import DAG_Scheduler, Step_Graph
+from .token_pool import get_cloudflare_api
+
+manifest_fields = ("domain", "region", "selector", "token_name", "subdomain", "local_part")
+
+
+def _open_text(path: Path, mode: str):
+    """
+    Open a text file, gzipped if its suffix is `.gz`.
+    """
+    if path.suffix == ".gz":
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return path.open(mode, encoding="utf-8", newline="")
+
+
+def _is_jsonl(path: Path) -> bool:
+    suffix = Path(path.stem).suffix if path.suffix == ".gz" else path.suffix
+    return suffix in (".jsonl", ".ndjson")
+
+
+def read_manifest(path: Path, defaults: dict = None):
+    """
+    Yield the rows of a manifest as dicts, reading the file lazily.
+    The manifest is JSONL if its suffix is `.jsonl`, otherwise CSV with a header line,
+    gzipped if it ends with `.gz` (e.g. `domains.csv.gz`).
+    Empty fields fall back to `defaults`.
+    """
+    defaults = {k: v for k, v in (defaults or {}).items() if v is not None}
+    with _open_text(path, "r") as f:
+        if _is_jsonl(path):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for row in rows:
+            d = dict(defaults)
+            d.update({k: v for k, v in row.items() if k in manifest_fields and v})
+            yield d
+
+
+class _Cloudflare_API_Pool:
+    """
+    One shared `Cloudflare_API` per token name, pooled if the name lists several
+    tokens.
+    """
+
+    def __init__(self, pool_maxsize: int):
+        self._pool_maxsize = pool_maxsize
+        self._apis = {}
+        self._lock = Lock()
+
+    def get(self, token_name: str) -> Cloudflare_API:
+        with self._lock:
+            if token_name not in self._apis:
+                self._apis[token_name] = get_cloudflare_api(
+                    token_name, None, self._pool_maxsize
+                )
+            return self._apis[token_name]
+
+    def close(self):
+        with self._lock:
+            for api in self._apis.values():
+                if api is not None:
+                    api.close()
+            self._apis.clear()
+
+
+def domain_steps(
+    path_cwd: Path,
+    row: dict,
+    cf_api: Cloudflare_API = None,
+    batch: str = None,
+    ses_backend=None,
+    public_key: str = None,
+) -> Step_Graph:
+    """
+    Return the `Step_Graph` onboarding the domain of a manifest row.
+    Only the MAIL FROM attributes depend on the SES identity, DNS records don't depend
+    on AWS SES nor on each other.
+    If `batch` is "records" or "import", all the DNS records are created in one request
+    by the batch endpoint or the zone import endpoint.
+    `public_key` is the base64 public key if the key pair was just generated.
+    """
+    domain = row["domain"]
+    region = row.get("region")
+    selector = row.get("selector")
+    token_name = row.get("token_name")
+    subdomain = row.get("subdomain")
+    local_part = row.get("local_part")
+    path_src = path_cwd / domain
+
+    graph = Step_Graph()
+    if batch:
+        graph.add(
+            "dns_batch",
+            lambda: create_dns_records_in_batch(
+                path_src,
+                domain,
+                token_name,
+                domain_dns_payloads(
+                    path_src, domain, region, selector, subdomain, local_part, public_key
+                ),
+                cf_api,
+                zone_import=(batch == "import"),
+            ),
+        )
+    elif selector:
+        graph.add(
+            "byodkim_dns",
+            lambda: create_byodkim_dns_record(
+                path_src, domain, token_name, selector, cf_api, public_key
+            ),
+        )
+
+    graph.add(
+        "ses_identity",
+        lambda: aws_ses_create_email_identity(
+            path_src, domain, region, selector, ses_backend=ses_backend
+        ),
+    )
+    if subdomain:
+        graph.add(
+            "mail_from_attributes",
+            lambda: aws_set_mail_from_domain(
+                domain, region, subdomain, ses_backend=ses_backend
+            ),
+            deps=("ses_identity",),
+        )
+
+    if not batch:
+        if subdomain:
+            graph.add(
+                "mail_from_dns",
+                lambda: create_mail_from_dns_record(
+                    path_src, domain, region, token_name, subdomain, cf_api
+                ),
+            )
+        graph.add(
+            "inbound_mx_dns",
+            lambda: create_inbound_mx_dns_record(
+                path_src, domain, region, token_name, cf_api=cf_api
+            ),
+        )
+        if local_part:
+            graph.add(
+                "dmarc_dns",
+                lambda: create_dmarc_dns_record(
+                    path_src, domain, token_name, local_part, cf_api=cf_api
+                ),
+            )
+    return graph
+
+
+def _onboard_key(row: dict, batch: str) -> str:
+    return journal_key(
+        row.get("region"),
+        row.get("selector"),
+        row.get("subdomain"),
+        row.get("local_part"),
+        batch,
+    )
+
+
+def onboard_domain(
+    path_cwd: Path,
+    row: dict,
+    cf_api: Cloudflare_API = None,
+    batch: str = None,
+    ses_backend=None,
+    public_key: str = None,
+) -> dict:
+    """
+    Run every onboarding step of `domain_steps` in order, in this thread.
+    With a journal (see `journal.set_journal`), a domain already onboarded with the
+    same parameters is skipped by a single lookup, and each step is skipped if it
+    was completed.
+    Return a dict contains `domain`, `success`, the `failed_step` and the `error` if any.
+    """
+    domain = row["domain"]
+    journal = get_journal()
+    key = _onboard_key(row, batch)
+    if journal is not None and journal.is_done(domain, "onboard", key):
+        return {"domain": domain, "success": True, "failed_step": None, "error": None}
+
+    graph = domain_steps(path_cwd, row, cf_api, batch, ses_backend, public_key)
+    result = _run_steps(path_cwd / domain, row, graph)
+    if result["success"] and journal is not None:
+        journal.mark_done(domain, "onboard", key)
+    return result
+
+
+def schedule_domain(
+    scheduler: DAG_Scheduler,
+    path_cwd: Path,
+    row: dict,
+    cf_api: Cloudflare_API = None,
+    batch: str = None,
+    ses_backend=None,
+    public_key: str = None,
+) -> Future:
+    """
+    Like `onboard_domain`, but the steps run on `scheduler` as soon as their
+    dependencies succeeded. Return a future of the result.
+    """
+    domain = row["domain"]
+    path_src = path_cwd / domain
+    result = {"domain": domain, "success": True, "failed_step": None, "error": None}
+    future = Future()
+
+    journal = get_journal()
+    key = _onboard_key(row, batch)
+    if journal is not None and journal.is_done(domain, "onboard", key):
+        future.set_result(result)
+        return future
+    try:
+        _check_row(path_src, row)
+    except AssertionError as err:
+        result.update(success=False, error="{}: {}".format(type(err).__name__, err))
+        future.set_result(result)
+        return future
+
+    def done(graph_future: Future):
+        result.update(graph_future.result())
+        try:
+            close_record_log(path_src)
+            if result["success"] and journal is not None:
+                journal.mark_done(domain, "onboard", key)
+        except Exception as err:
+            result.update(success=False, error="{}: {}".format(type(err).__name__, err))
+        finally:
+            future.set_result(result)
+
+    graph = domain_steps(path_cwd, row, cf_api, batch, ses_backend, public_key)
+    scheduler.submit(graph).add_done_callback(done)
+    return future
+
+
+def _check_row(path_src: Path, row: dict):
+    assert path_src.exists(), "`{}` don't exist.".format(path_src)
+    assert type(row.get("region")) is str, "Missing `region`."
+    assert type(row.get("token_name")) is str, "Missing `token_name`."
+
+
+def _run_steps(path_src: Path, row: dict, steps) -> dict:
+    """
+    Run `(name, fn)` steps in order until one of them fails.
+    """
+    result = {"domain": row["domain"], "success": True, "failed_step": None, "error": None}
+    try:
+        _check_row(path_src, row)
+        for step, fn in steps:
+            result["failed_step"] = step
+            if not fn():
+                result["success"] = False
+                return result
+        result["failed_step"] = None
+    except Exception as err:
+        result["success"] = False
+        result["error"] = "{}: {}".format(type(err).__name__, err)
+    finally:
+        close_record_log(path_src)
+    return result
+
+
+def plan_domain(
+    path_cwd: Path,
+    row: dict,
+    cf_api: Cloudflare_API = None,
+    apply=False,
+    zone_indexes: Zone_Indexes = None,
+) -> dict:
+    """
+    Diff the DNS records of the domain of a manifest row against its zone, and
+    apply the differences if `apply` is True. AWS SES is not touched.
+    """
+    domain = row["domain"]
+    path_src = path_cwd / domain
+
+    def step():
+        payloads = domain_dns_payloads(
+            path_src,
+            domain,
+            row.get("region"),
+            row.get("selector"),
+            row.get("subdomain"),
+            row.get("local_part"),
+        )
+        return plan_dns_records(
+            path_src, domain, row.get("token_name"), payloads, cf_api, apply, zone_indexes
+        )
+
+    # not a journaled step, so it is profiled here
+    with profiler.step(domain):
+        return _run_steps(path_src, row, [("dns_apply" if apply else "dns_plan", step)])
+
+
+def _iter_bounded(rows, limit: int, submit):
+    """
+    Call `submit(row)`, which returns a future, for every row with at most `limit`
+    futures pending, and yield their results in the order they complete.
+    A row is only read once a pending future completes, so `rows` can be a lazy
+    manifest of any size.
+    """
+    completed = SimpleQueue()
+    pending = 0
+    for row in rows:
+        while pending >= limit or not completed.empty():
+            pending -= 1
+            yield completed.get().result()
+        submit(row).add_done_callback(completed.put)
+        pending += 1
+    for _ in range(pending):
+        yield completed.get().result()
+
+
+def _keygen_rows(path_cwd: Path, rows, key_size: int, chunk_size: int = 1000):
+    """
+    Yield `(row, public_key)`, key pairs are generated through a process pool for
+    chunks of `chunk_size` rows at once, for the domains which have none.
+    """
+    from .keygen import keygen_domains
+
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        domains = [row["domain"] for row in chunk if row.get("selector")]
+        public_keys = keygen_domains(path_cwd, domains, key_size)
+        if public_keys:
+            output.info("generate {} key pair(s)".format(len(public_keys)))
+        for row in chunk:
+            yield row, public_keys.get(row["domain"])
+
+
+def iter_onboard_fleet(
+    path_cwd: Path,
+    rows,
+    workers: int = 8,
+    batch: str = None,
+    ses_backend=None,
+    keygen: int = None,
+):
+    """
+    Onboard every domain of `rows` through a bounded worker pool, and yield the results
+    of `schedule_domain` as domains complete.
+    If `keygen` is a key size, key pairs are first generated for the domains which have
+    none, through a process pool.
+    Steps of all the domains share `workers` threads and run as soon as their
+    dependencies succeeded, at most `2 * workers` domains are in progress at once.
+    """
+    if keygen:
+        rows = _keygen_rows(path_cwd, rows, keygen)
+    else:
+        rows = ((row, None) for row in rows)
+
+    apis = _Cloudflare_API_Pool(workers)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    scheduler = DAG_Scheduler(executor)
+
+    def submit(row_key: tuple) -> Future:
+        row, public_key = row_key
+        return schedule_domain(
+            scheduler,
+            path_cwd,
+            row,
+            apis.get(row.get("token_name")),
+            batch,
+            ses_backend,
+            public_key,
+        )
+
+    try:
+        yield from _iter_bounded(rows, 2 * workers, submit)
+    finally:
+        executor.shutdown()
+        apis.close()
+
+
+def onboard_fleet(
+    path_cwd: Path,
+    rows,
+    workers: int = 8,
+    batch: str = None,
+    ses_backend=None,
+    keygen: int = None,
+) -> list:
+    """
+    Return the list of results of `iter_onboard_fleet`.
+    """
+    return list(iter_onboard_fleet(path_cwd, rows, workers, batch, ses_backend, keygen))
+
+
+def _iter_fleet(rows, workers: int, job):
+    """
+    Call `job(row, cf_api)` for every row through a bounded worker pool, and yield the
+    results as they complete.
+    """
+    apis = _Cloudflare_API_Pool(workers)
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(row: dict) -> Future:
+        return executor.submit(job, row, apis.get(row.get("token_name")))
+
+    try:
+        yield from _iter_bounded(rows, 2 * workers, submit)
+    finally:
+        executor.shutdown()
+        apis.close()
+
+
+def iter_plan_fleet(path_cwd: Path, rows, workers: int = 8, apply=False):
+    """
+    Plan, or apply if `apply` is True, the DNS records of every domain of `rows`
+    through a bounded worker pool, and yield the results of `plan_domain` as domains
+    complete. Each zone is listed once.
+    """
+    zone_indexes = Zone_Indexes()
+
+    def job(row: dict, cf_api: Cloudflare_API):
+        return plan_domain(path_cwd, row, cf_api, apply, zone_indexes)
+
+    return _iter_fleet(rows, workers, job)
+
+
+def plan_fleet(path_cwd: Path, rows, workers: int = 8, apply=False) -> list:
+    """
+    Return the list of results of `iter_plan_fleet`.
+    """
+    return list(iter_plan_fleet(path_cwd, rows, workers, apply))
+
+
+class Domain_Result:
+    """
+    Result of a domain, with the fields of the result dicts, kept by `Fleet_Report`
+    in a fraction of the memory of a dict. Fields can be read like dict items.
+    """
+
+    __slots__ = ("domain", "success", "failed_step", "error")
+
+    def __init__(self, domain: str, success=True, failed_step=None, error=None):
+        self.domain = domain
+        self.success = success
+        self.failed_step = failed_step
+        self.error = error
+
+    @classmethod
+    def from_dict(cls, result: dict) -> "Domain_Result":
+        return cls(
+            result["domain"], result["success"], result["failed_step"], result["error"]
+        )
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __getitem__(self, field: str):
+        return getattr(self, field)
+
+
+class Fleet_Report:
+    """
+    Results of a fleet run, added as domains complete.
+    With a report `path`, each result is written to it right away, as JSONL if its
+    suffix is `.jsonl`, otherwise CSV, gzipped if it ends with `.gz`, and only failed
+    results are kept in memory. Otherwise every result is kept to be printed.
+    """
+
+    def __init__(self, path: Path = None):
+        self.path = path
+        self.succeeded = 0
+        self.failed = 0
+        self.results = []
+        self._file = None
+        self._writer = None
+        if path is not None:
+            self._file = _open_text(path, "w")
+            if not _is_jsonl(path):
+                self._writer = csv.DictWriter(self._file, Domain_Result.__slots__)
+                self._writer.writeheader()
+
+    def add(self, result: dict):
+        record = Domain_Result.from_dict(result)
+        if record.success:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        if self._file is None:
+            self.results.append(record)
+            return
+        if not record.success:
+            self.results.append(record)
+        if self._writer is not None:
+            self._writer.writerow(record.to_dict())
+        else:
+            self._file.write(json.dumps(record.to_dict(), separators=(",", ":")) + "\n")
+
+    def extend(self, results):
+        for result in results:
+            self.add(result)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _print_results(results):
+    for r in results:
+        if r["success"]:
+            output.result("OK     {}".format(r["domain"]), domain=r["domain"], status="ok")
+        else:
+            line = "FAILED {}".format(r["domain"])
+            if r["failed_step"]:
+                line += " at `{}`".format(r["failed_step"])
+            if r["error"]:
+                line += " {}".format(r["error"])
+            output.result(
+                line,
+                domain=r["domain"],
+                status="failed",
+                step=r["failed_step"],
+                error=r["error"],
+            )
+
+
+def _print_counts(succeeded: int, failed: int):
+    output.result(
+        "{} succeeded, {} failed.".format(succeeded, failed),
+        succeeded=succeeded,
+        failed=failed,
+    )
+    output.result(
+        "Cloudflare API: {requests} request(s), {throttled} throttled, "
+        "{retried} retried.".format(**Cloudflare_API.counters.snapshot())
+    )
+
+
+def print_summary(results: list):
+    succeeded = [r for r in results if r["success"]]
+    output.result("[Fleet summary]")
+    _print_results(results)
+    _print_counts(len(succeeded), len(results) - len(succeeded))
+
+
+def print_report(report: Fleet_Report):
+    output.result("[Fleet summary]")
+    _print_results(report.results)
+    _print_counts(report.succeeded, report.failed)
+    if report.path is not None:
+        output.result("Results written to `{}`.".format(report.path))
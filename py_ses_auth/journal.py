@@ -0,0 +1,168 @@
+"""
+Durable journal of completed onboarding steps, so that a resumed run skips them.
+
+Steps are keyed by `(domain, step, key)`, where `key` holds the parameters the step
+depends on (e.g. region and selector), so changing them runs the step again.
+The journal is a SQLite database in WAL mode, each completed step is one transaction.
+"""
+
+__all__ = [
+    "Job_Journal",
+    "journal_key",
+    "get_journal",
+    "set_journal",
+    "journaled",
+]
+
+from pathlib import Path
+from threading import Lock
+import json
+import time
+from .output import output
+from .profiling import profiler
+
+
+def journal_key(*parts) -> str:
+    return "|".join("" if part is None else str(part) for part in parts)
+
+
+class Job_Journal:
+    """
+    Journal of completed steps in the SQLite database `path`.
+    An instance can be shared by threads.
+    """
+
+    def __init__(self, path: Path):
+        import sqlite3
+
+        self.path = Path(path)
+        self._conn = sqlite3.connect(
+            str(self.path), isolation_level=None, check_same_thread=False, timeout=30
+        )
+        self._lock = Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS steps ("
+                "domain TEXT NOT NULL, step TEXT NOT NULL, key TEXT NOT NULL, "
+                "result TEXT, completed_at REAL NOT NULL, "
+                "PRIMARY KEY (domain, step, key)) WITHOUT ROWID"
+            )
+
+    def is_done(self, domain: str, step: str, key: str = "") -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM steps WHERE domain = ? AND step = ? AND key = ?",
+                (domain, step, key),
+            ).fetchone()
+        return row is not None
+
+    def mark_done(self, domain: str, step: str, key: str = "", result=None):
+        """
+        Record a completed step, `result` is stored as JSON.
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO steps VALUES (?, ?, ?, ?, ?)",
+                (domain, step, key, json.dumps(result), time.time()),
+            )
+
+    def get(self, domain: str, step: str, key: str = ""):
+        """
+        Return the result of a completed step, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM steps WHERE domain = ? AND step = ? AND key = ?",
+                (domain, step, key),
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def completed_at(self, domain: str, step: str, key: str = ""):
+        """
+        Return the time when a step was completed, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT completed_at FROM steps "
+                "WHERE domain = ? AND step = ? AND key = ?",
+                (domain, step, key),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def steps(self, domain: str) -> list:
+        """
+        Return `(step, key, completed_at)` of the completed steps of `domain`.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT step, key, completed_at FROM steps WHERE domain = ? "
+                "ORDER BY completed_at",
+                (domain,),
+            ).fetchall()
+
+    def forget(self, domain: str, step: str = None):
+        """
+        Remove the completed steps (or `step`) of `domain`, so that they run again.
+        """
+        with self._lock:
+            if step is None:
+                self._conn.execute("DELETE FROM steps WHERE domain = ?", (domain,))
+            else:
+                self._conn.execute(
+                    "DELETE FROM steps WHERE domain = ? AND step = ?", (domain, step)
+                )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_journal = None
+
+
+def get_journal() -> Job_Journal:
+    """
+    Return the journal of the current run, or None.
+    """
+    return _journal
+
+
+def set_journal(journal: Job_Journal):
+    global _journal
+    _journal = journal
+
+
+def journaled(domain: str, step: str, key: str, fn):
+    """
+    Return True without calling `fn` if the step is completed in the journal of the
+    current run, otherwise return `fn()` and record the step if it succeeded.
+    Messages emitted by `fn` carry the domain and the step, which ends with an event
+    of its status and duration.
+    """
+    with output.context(domain=domain, step=step):
+        journal = _journal
+        if journal is not None and journal.is_done(domain, step, key):
+            output.info("skip `{}` of {}, already done.".format(step, domain))
+            output.event(status="skipped", duration=0.0)
+            return True
+        start = time.perf_counter()
+        status = False
+        try:
+            with profiler.step(domain):
+                status = fn()
+        finally:
+            output.event(
+                status="ok" if status else "failed",
+                duration=round(time.perf_counter() - start, 6),
+            )
+        if status and journal is not None:
+            journal.mark_done(domain, step, key)
+        return status
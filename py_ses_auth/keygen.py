@@ -0,0 +1,128 @@
+"""
+Generating DKIM key pairs in process, it requires the module `cryptography`.
+"""
+
+__all__ = [
+    "key_sizes",
+    "generate_key_pair",
+    "write_key_pair",
+    "keygen_domain",
+    "keygen_paths",
+    "keygen_domains",
+]
+
+from pathlib import Path
+import base64
+import os
+
+# RSA key sizes accepted by AWS SES BYODKIM
+key_sizes = (1024, 2048)
+
+
+def generate_key_pair(key_size: int = 2048) -> tuple:
+    """
+    Return `(private_pem, public_pem, public_key)` of a new RSA key pair, where
+    `public_key` is the base64 DER of the public key, i.e. the `p=` value of the
+    DKIM TXT record.
+    The private key is PKCS#1 like `openssl genrsa` and the public key is
+    SubjectPublicKeyInfo like `openssl rsa -pubout`.
+    """
+    assert key_size in key_sizes, "Key size must be one of {}.".format(key_sizes)
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.TraditionalOpenSSL,
+        serialization.NoEncryption(),
+    )
+    public_der = key.public_key().public_bytes(
+        serialization.Encoding.DER,
+        serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+    public_key = base64.b64encode(public_der).decode()
+    public_pem = "-----BEGIN PUBLIC KEY-----\n{}\n-----END PUBLIC KEY-----\n".format(
+        "\n".join(public_key[i : i + 64] for i in range(0, len(public_key), 64))
+    )
+    return private_pem, public_pem.encode(), public_key
+
+
+def _write_atomic(path: Path, data: bytes, mode: int):
+    path_tmp = path.with_name(".{}.{}.tmp".format(path.name, os.getpid()))
+    fd = os.open(path_tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path_tmp, path)
+    except BaseException:
+        if path_tmp.exists():
+            path_tmp.unlink()
+        raise
+
+
+def write_key_pair(path_src: Path, private_pem: bytes, public_pem: bytes):
+    """
+    Write `private.key` (readable by the owner only) and `public.key` atomically, the
+    private key first so that a `public.key` never exists without its private key.
+    """
+    path_src.mkdir(parents=True, exist_ok=True)
+    _write_atomic(path_src / "private.key", private_pem, 0o600)
+    _write_atomic(path_src / "public.key", public_pem, 0o644)
+
+
+def keygen_domain(path_src: Path, key_size: int = 2048, overwrite=False):
+    """
+    Generate the key pair of the domain directory `path_src`.
+    Return the base64 public key, or None if the key pair exists and `overwrite`
+    is False.
+    """
+    path_src = Path(path_src)
+    if not overwrite and (path_src / "private.key").exists():
+        return None
+    private_pem, public_pem, public_key = generate_key_pair(key_size)
+    write_key_pair(path_src, private_pem, public_pem)
+    return public_key
+
+
+def _keygen_job(args: tuple):
+    path_src, key_size, overwrite = args
+    return keygen_domain(path_src, key_size, overwrite)
+
+
+def keygen_paths(paths, key_size: int = 2048, workers: int = None, overwrite=False) -> dict:
+    """
+    Generate the key pairs of the directories `paths` through a pool of `workers`
+    processes (default: one per CPU).
+    Return a dict of paths to base64 public keys of the generated key pairs, paths
+    which already have a key pair are skipped unless `overwrite` is True.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    paths = list(dict.fromkeys(paths))
+    jobs = [(path, key_size, overwrite) for path in paths]
+    if workers == 1 or len(jobs) <= 1:
+        public_keys = map(_keygen_job, jobs)
+        return {p: k for p, k in zip(paths, public_keys) if k is not None}
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        public_keys = executor.map(_keygen_job, jobs, chunksize=chunksize)
+        return {p: k for p, k in zip(paths, public_keys) if k is not None}
+
+
+def keygen_domains(
+    path_cwd: Path, domains, key_size: int = 2048, workers: int = None, overwrite=False
+) -> dict:
+    """
+    Generate the key pairs of `domains` in their directories under `path_cwd`.
+    Return a dict of domain names to base64 public keys of the generated key pairs,
+    see `keygen_paths`.
+    """
+    domains = list(dict.fromkeys(domains))
+    public_keys = keygen_paths(
+        [path_cwd / domain for domain in domains], key_size, workers, overwrite
+    )
+    return {d: public_keys[path_cwd / d] for d in domains if path_cwd / d in public_keys}
@@ -0,0 +1,262 @@
+"""
+Timed spans of the phases of a run, e.g. key reads, config lookups, Cloudflare requests,
+record log writes and AWS SES calls, exported as a JSON trace or Prometheus text.
+"""
+
+__all__ = ["Metrics", "metrics", "span_buckets"]
+
+from pathlib import Path
+from threading import Lock, get_ident
+from time import perf_counter
+import json
+import os
+import time
+from .rate_limit import counters as request_counters
+
+# upper bounds (seconds) of the histogram buckets of every phase
+span_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _Null_Span:
+    """
+    Span returned while metrics are disabled, it does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_null_span = _Null_Span()
+
+
+class _Span:
+    def __init__(self, metrics: "Metrics", name: str, attrs: dict):
+        self._metrics = metrics
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self._metrics._finish(self, perf_counter() - self.start)
+        return False
+
+    def set(self, **attrs):
+        """
+        Add attributes known only inside the span, e.g. the response status.
+        """
+        self.attrs.update(attrs)
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(span_buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(span_buckets):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+
+    def cumulative(self) -> list:
+        out = []
+        total = 0
+        for n in self.buckets:
+            total += n
+            out.append(total)
+        return out
+
+
+class Metrics:
+    """
+    Collector of timed spans and counters.
+
+    While disabled, `span` returns a shared no-op context manager and `incr` returns
+    at once, so instrumented code costs one attribute check. Every finished span is
+    added to the histogram of its name, kept in the trace (up to `max_spans`) and
+    passed to the hooks as `hook(name, seconds, attrs)`.
+    """
+
+    def __init__(self, max_spans: int = 100000):
+        self.enabled = False
+        self.max_spans = max_spans
+        self._hooks = []
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._started_at = time.time()
+            self._origin = perf_counter()
+            self._spans = []
+            self._dropped = 0
+            self._histograms = {}
+            self._counts = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def add_hook(self, hook):
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def span(self, name: str, **attrs):
+        """
+        Return a context manager which times the phase `name`.
+        """
+        if not self.enabled:
+            return _null_span
+        return _Span(self, name, attrs)
+
+    def timed(self, name: str):
+        """
+        Decorator. Time every call of the function as the phase `name`.
+        """
+
+        def deco(fn):
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with _Span(self, name, {}):
+                    return fn(*args, **kwargs)
+
+            wrapper.__name__ = fn.__name__
+            wrapper.__doc__ = fn.__doc__
+            wrapper.__wrapped__ = fn
+            return wrapper
+
+        return deco
+
+    def incr(self, name: str, value: int = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + value
+
+    def _finish(self, span: _Span, seconds: float):
+        with self._lock:
+            histogram = self._histograms.get(span.name)
+            if histogram is None:
+                histogram = self._histograms[span.name] = _Histogram()
+            histogram.observe(seconds)
+            if len(self._spans) < self.max_spans:
+                self._spans.append(
+                    (span.name, span.start - self._origin, seconds, get_ident(), span.attrs)
+                )
+            else:
+                self._dropped += 1
+        for hook in self._hooks:
+            hook(span.name, seconds, span.attrs)
+
+    def to_dict(self) -> dict:
+        """
+        Return the trace, the histograms and the counters as a JSON-serializable dict.
+        """
+        with self._lock:
+            return {
+                "started_at": self._started_at,
+                "spans": [
+                    {
+                        "name": name,
+                        "start": round(start, 6),
+                        "seconds": round(seconds, 6),
+                        "thread": thread,
+                        "attrs": attrs,
+                    }
+                    for name, start, seconds, thread, attrs in self._spans
+                ],
+                "dropped_spans": self._dropped,
+                "histograms": {
+                    name: {
+                        "buckets": dict(zip(map(str, span_buckets), h.cumulative())),
+                        "count": h.count,
+                        "sum": round(h.sum, 6),
+                    }
+                    for name, h in sorted(self._histograms.items())
+                },
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self._counts.items())
+                ],
+                "cloudflare_api": request_counters.snapshot(),
+            }
+
+    def to_prometheus(self, prefix: str = "ses_auth") -> str:
+        """
+        Return the histograms and the counters in Prometheus text format.
+        """
+
+        def labels_str(labels) -> str:
+            return ",".join(
+                '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                for k, v in labels
+            )
+
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counts = sorted(self._counts.items())
+        name = "{}_phase_seconds".format(prefix)
+        lines.append("# HELP {} Duration of the phases of a run.".format(name))
+        lines.append("# TYPE {} histogram".format(name))
+        for phase, h in histograms:
+            phase_label = labels_str((("phase", phase),))
+            for bound, n in zip(span_buckets, h.cumulative()):
+                lines.append(
+                    '{}_bucket{{{},le="{}"}} {}'.format(name, phase_label, bound, n)
+                )
+            lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, phase_label, h.count))
+            lines.append("{}_sum{{{}}} {}".format(name, phase_label, round(h.sum, 6)))
+            lines.append("{}_count{{{}}} {}".format(name, phase_label, h.count))
+
+        declared = set()
+        for (counter, labels), value in counts:
+            name = "{}_{}_total".format(prefix, counter)
+            if name not in declared:
+                declared.add(name)
+                lines.append("# TYPE {} counter".format(name))
+            lines.append("{}{{{}}} {}".format(name, labels_str(labels), value))
+
+        for counter, value in request_counters.snapshot().items():
+            name = "{}_cloudflare_{}_total".format(prefix, counter)
+            lines.append("# TYPE {} counter".format(name))
+            lines.append("{} {}".format(name, value))
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: Path):
+        """
+        Write Prometheus text if the suffix of `path` is `.prom`, otherwise a JSON trace.
+        The file is replaced atomically so that a scraper never reads half of it.
+        """
+        path = Path(path)
+        if path.suffix == ".prom":
+            out = self.to_prometheus()
+        else:
+            out = json.dumps(self.to_dict(), indent=2)
+        path_tmp = path.with_name(".{}.tmp".format(path.name))
+        with path_tmp.open("w") as f:
+            f.write(out)
+        os.replace(path_tmp, path)
+
+
+metrics = Metrics()
@@ -0,0 +1,164 @@
+"""
+Messages of a run, e.g. every DNS record created and every API error.
+
+They are printed as text by default. With `--json` they are written as JSON lines
+which carry the domain and step they belong to, along with an event per step with its
+status and duration. With `--log_file` they are appended to a file. JSON lines and log
+files are written by one writer thread which writes all the lines queued since its last
+write at once, so concurrent workers neither interleave lines nor write one at a time.
+"""
+
+__all__ = ["Output", "output"]
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from queue import SimpleQueue
+from threading import Thread
+import json
+import sys
+import time
+
+# fields of the messages emitted in the current context, e.g. domain and step
+_fields = ContextVar("output_fields", default=None)
+# stream which also gets the messages emitted in the current context, see `Output.tee`
+_tee = ContextVar("output_tee", default=None)
+
+
+class _Buffered_Writer:
+    """
+    Write the lines queued by any thread to a text stream from one thread.
+    """
+
+    def __init__(self, stream, close_stream=False):
+        self.stream = stream
+        self._close_stream = close_stream
+        self._queue = SimpleQueue()
+        self._thread = Thread(target=self._run, name="output_writer", daemon=True)
+        self._thread.start()
+
+    def write(self, line: str):
+        self._queue.put(line)
+
+    def _run(self):
+        while True:
+            lines = [self._queue.get()]
+            while not self._queue.empty():
+                lines.append(self._queue.get())
+            closing = None in lines
+            if closing:
+                lines = lines[: lines.index(None)]
+            if lines:
+                self.stream.write("".join(lines))
+                self.stream.flush()
+            if closing:
+                return
+
+    def close(self):
+        """
+        Write the queued lines, then stop the thread.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self._close_stream:
+            self.stream.close()
+
+
+class Output:
+    """
+    Emit the messages of a run.
+    Levels are `info` (progress, hidden by `quiet`), `error`, `result` (summaries) and
+    `event` (structured only, not printed as text).
+    """
+
+    def __init__(self):
+        self.quiet = False
+        self.json_lines = False
+        self._writer = None
+
+    def configure(self, quiet=False, json_lines=False, path: Path = None):
+        """
+        Hide `info` messages if `quiet`, write JSON lines if `json_lines`, and append
+        to the file `path` instead of standard output if given.
+        """
+        self.close()
+        self.quiet = quiet
+        self.json_lines = json_lines
+        if path is not None:
+            stream = Path(path).open("a", encoding="utf-8")
+            self._writer = _Buffered_Writer(stream, close_stream=True)
+        elif json_lines:
+            self._writer = _Buffered_Writer(sys.stdout)
+
+    def close(self):
+        """
+        Write pending lines and stop the writer, later messages are written to
+        standard output right away, in the same mode.
+        """
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+
+    @contextmanager
+    def context(self, **fields):
+        """
+        Add `fields`, e.g. `domain` and `step`, to the messages emitted in the context,
+        including the steps it schedules on other threads.
+        """
+        token = _fields.set({**(_fields.get() or {}), **fields})
+        try:
+            yield
+        finally:
+            _fields.reset(token)
+
+    @contextmanager
+    def tee(self, stream):
+        """
+        Also write the messages emitted in the context to `stream`, e.g. the output of
+        a service job, when they go to the writer of `--json` or `--log_file` instead
+        of standard output.
+        """
+        token = _tee.set(stream)
+        try:
+            yield
+        finally:
+            _tee.reset(token)
+
+    def emit(self, level: str, message: str = None, **fields):
+        if level == "info" and self.quiet:
+            return
+        if self.json_lines:
+            event = {"time": round(time.time(), 3), "level": level}
+            event.update(_fields.get() or {})
+            event.update((k, v) for k, v in fields.items() if v is not None)
+            if message is not None:
+                event["message"] = message
+            line = json.dumps(event, separators=(",", ":"), default=str)
+        elif level == "event":
+            return
+        else:
+            line = message
+        writer = self._writer
+        if writer is not None:
+            writer.write(line + "\n")
+            stream = _tee.get()
+            if stream is not None:
+                stream.write(line + "\n")
+        else:
+            # one write per line, so lines of concurrent workers don't interleave
+            sys.stdout.write(line + "\n")
+
+    def info(self, message: str, **fields):
+        self.emit("info", message, **fields)
+
+    def error(self, message: str, **fields):
+        self.emit("error", message, **fields)
+
+    def result(self, message: str, **fields):
+        self.emit("result", message, **fields)
+
+    def event(self, **fields):
+        self.emit("event", **fields)
+
+
+output = Output()
@@ -0,0 +1,179 @@
+"""
+Diffing desired DNS records against the live zone, so that only differences are applied.
+"""
+
+__all__ = [
+    "Plan_Action",
+    "Zone_Index",
+    "Zone_Indexes",
+    "normalize_record",
+    "record_kind",
+    "plan_records",
+    "print_plan",
+    "apply_plan",
+]
+
+from collections import namedtuple
+from threading import Lock
+from .cloudflare_api import Cloudflare_API
+from .output import output
+from .record_index import get_record_index
+
+Plan_Action = namedtuple("Plan_Action", ("action", "payload", "record"))
+Plan_Action.__doc__ = """
+`action` is "create", "update" or "noop". `record` is the live record to update or
+which already matches `payload`, None for "create".
+"""
+
+
+def _normalize_content(record_type: str, content: str) -> str:
+    content = content or ""
+    if record_type == "TXT":
+        # `"a" "b"` and `"ab"` and `ab` are the same TXT value
+        content = content.strip()
+        if content.startswith('"') and content.endswith('"'):
+            content = content[1:-1].replace('" "', "")
+        return content
+    if record_type in ("MX", "CNAME", "NS"):
+        return content.lower().rstrip(".")
+    return content
+
+
+def normalize_record(record: dict) -> tuple:
+    """
+    Return `(type, name, content, priority)` of a payload or a live record in
+    comparable form.
+    """
+    record_type = record["type"]
+    return (
+        record_type,
+        record["name"].lower().rstrip("."),
+        _normalize_content(record_type, record.get("content")),
+        record.get("priority") if record_type == "MX" else None,
+    )
+
+
+def record_kind(record: dict) -> tuple:
+    """
+    Return what a record is for, records of the same kind at the same name replace
+    each other, e.g. `("TXT", "_dmarc.example.com", "v=dmarc1")`.
+    """
+    record_type, name, content, _ = normalize_record(record)
+    kind = None
+    if record_type == "TXT":
+        tag = content.split(";", 1)[0].split(" ", 1)[0].strip().lower()
+        kind = tag if tag.startswith("v=") else tag.split("=", 1)[0]
+    elif record_type == "MX":
+        # only an MX record of the same mail provider is replaced
+        kind = ".".join(content.split(".")[-2:])
+    return (record_type, name, kind)
+
+
+class Zone_Index:
+    """
+    Hashed index of live DNS records of a zone by their content and kind.
+    """
+
+    def __init__(self, records=()):
+        self._by_digest = {}
+        self._by_kind = {}
+        self._lock = Lock()
+        for record in records:
+            self.add(record)
+
+    def add(self, record: dict):
+        with self._lock:
+            self._by_digest[normalize_record(record)] = record
+            self._by_kind.setdefault(record_kind(record), []).append(record)
+
+    def replace(self, old_record: dict, record: dict):
+        with self._lock:
+            self._by_digest.pop(normalize_record(old_record), None)
+            same_kind = self._by_kind.get(record_kind(old_record), [])
+            same_kind[:] = [r for r in same_kind if r.get("id") != old_record.get("id")]
+        self.add(record)
+
+    def plan(self, payload: dict) -> Plan_Action:
+        with self._lock:
+            record = self._by_digest.get(normalize_record(payload))
+            if record is not None:
+                return Plan_Action("noop", payload, record)
+            same_kind = self._by_kind.get(record_kind(payload))
+            if same_kind:
+                return Plan_Action("update", payload, same_kind[0])
+            return Plan_Action("create", payload, None)
+
+
+class Zone_Indexes:
+    """
+    `Zone_Index` of each zone, fetched once by one bulk listing (or a full sync of the
+    record index of the current run, so records deleted outside of the CLI are planned
+    again) and shared by threads.
+    """
+
+    def __init__(self):
+        self._indexes = {}
+        self._lock = Lock()
+        self._zone_locks = {}
+
+    def get(self, dns_editor: Cloudflare_API) -> Zone_Index:
+        zone_id = dns_editor.zone_identifier
+        with self._lock:
+            zone_lock = self._zone_locks.setdefault(zone_id, Lock())
+        with zone_lock:
+            index = self._indexes.get(zone_id)
+            if index is None:
+                record_index = get_record_index()
+                if record_index is not None:
+                    record_index.sync(dns_editor, full=True)
+                    index = Zone_Index(record_index.records(zone_id))
+                else:
+                    output.info("List DNS records of zone {}".format(zone_id))
+                    index = Zone_Index(dns_editor.list_dns_records())
+                self._indexes[zone_id] = index
+            return index
+
+
+def plan_records(index: Zone_Index, payloads) -> list:
+    return [index.plan(payload) for payload in payloads]
+
+
+def print_plan(domain: str, plan: list):
+    symbols = {"create": "+", "update": "~", "noop": "="}
+    lines = ["[Plan] {}".format(domain)]
+    for action, payload, _ in plan:
+        lines.append(
+            "  {} {} | {} | {}".format(
+                symbols[action], payload["type"], payload["name"], payload["content"]
+            )
+        )
+    # the plan of a domain is emitted at once, so plans of concurrent domains don't mix
+    output.result("\n".join(lines), domain=domain)
+
+
+def apply_plan(
+    dns_editor: Cloudflare_API, index: Zone_Index, plan: list, success_fn
+) -> bool:
+    """
+    Create or update the records of `plan` which differ from the zone.
+    `success_fn` is called for each created or updated record.
+    """
+    status = True
+    for action, payload, record in plan:
+        if action == "noop":
+            continue
+        if action == "create":
+            response = dns_editor.create_dns_record(payload)
+        else:
+            response = dns_editor.update_dns_record(record["id"], payload)
+
+        def apply_success_fn(response_json: dict):
+            if record is None:
+                index.add(response_json["result"])
+            else:
+                index.replace(record, response_json["result"])
+            success_fn(response_json)
+
+        if not Cloudflare_API.response_post_processsing(response, apply_success_fn):
+            status = False
+    return status
@@ -0,0 +1,298 @@
+"""
+Profiling a run, enabled by `--profile DIR`.
+
+With the `pstats` format, the sub command and every step of a domain (see
+`journal.journaled`) run under their own `cProfile` profiler, in whichever thread
+they run. With the `collapsed` format, the threads running them are sampled every few
+milliseconds, and stacks are written for flame graph tools.
+
+A profile of the sub command merged across domains and threads is written to DIR,
+along with one per domain unless `aggregate`. The time of the steps (or of the sub
+command, if it runs no step on other threads) is also split between the Cloudflare API,
+AWS, subprocesses, files and the rest.
+
+On Python 3.12+ one `cProfile` profiler at a time covers every thread, so per domain
+profiles are sampled with the `collapsed` format instead.
+"""
+
+__all__ = ["profile_formats", "profile_categories", "Profiler", "profiler"]
+
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from threading import Event, Lock, Thread, get_ident, local
+import os
+import sys
+from .output import output
+
+profile_formats = ("pstats", "collapsed")
+
+# the time of a function or a sample goes to the category of the innermost frame whose
+# file matches one of the patterns
+profile_categories = {
+    "cloudflare": ("cloudflare_api.py", "cloudflare_async.py", "token_pool.py"),
+    "aws": ("ses_backend.py", "botocore", "boto3"),
+    "subprocess": ("subprocess.py",),
+    "file": (
+        "record_log.py",
+        "journal.py",
+        "record_index.py",
+        "config_store.py",
+        "zone_cache.py",
+        "pathlib.py",
+    ),
+}
+
+_null_context = nullcontext()
+
+# a `cProfile` profiler can be enabled per thread, not only once per process
+_per_thread_profiles = sys.version_info < (3, 12)
+
+
+def _category(filename: str):
+    for category, patterns in profile_categories.items():
+        for pattern in patterns:
+            if pattern in filename:
+                return category
+    return None
+
+
+def _stats_categories(stats: dict) -> Counter:
+    """
+    Split the time of `pstats.Stats.stats` between categories. The time of a function
+    outside of the categories, e.g. a socket read, goes to the categories of its
+    callers, in proportion to the time spent in it from each of them.
+    """
+    shares = {}
+
+    def share_of(func) -> dict:
+        if func in shares:
+            return shares[func]
+        category = _category(func[0])
+        callers = stats[func][4] if func in stats else {}
+        if category is not None or not callers:
+            shares[func] = {category or "other": 1.0}
+            return shares[func]
+        # recursive calls fall back to "other"
+        shares[func] = {"other": 1.0}
+        total = sum(timing[2] for timing in callers.values())
+        share = Counter()
+        for caller, timing in callers.items():
+            weight = timing[2] / total if total else 1.0 / len(callers)
+            for caller_category, fraction in share_of(caller).items():
+                share[caller_category] += weight * fraction
+        shares[func] = dict(share)
+        return shares[func]
+
+    seconds = Counter()
+    for func, (_, _, tottime, _, _) in stats.items():
+        for category, fraction in share_of(func).items():
+            seconds[category] += tottime * fraction
+    return seconds
+
+
+class Profiler:
+    """
+    Profiles of the running sub command. It does nothing until `enable` is called.
+    """
+
+    # seconds between samples of the `collapsed` format
+    sample_interval = 0.005
+
+    def __init__(self):
+        self.enabled = False
+        self._local = local()
+        self._lock = Lock()
+
+    def enable(self, path: Path, profile_format: str = "pstats", aggregate=False):
+        assert profile_format in profile_formats, "Unknown profile format `{}`.".format(
+            profile_format
+        )
+        if profile_format == "pstats" and not aggregate and not _per_thread_profiles:
+            output.error(
+                "Per domain `pstats` profiles need Python < 3.12, the stacks are sampled "
+                "(`collapsed`) instead. Use `--profile_aggregate` for a `pstats` profile."
+            )
+            profile_format = "collapsed"
+        self.path = Path(path)
+        self.profile_format = profile_format
+        self.aggregate = aggregate
+        self.command_name = None
+        self._stats = None
+        self._steps_stats = None
+        self._domain_stats = {}
+        self._samples = Counter()
+        self._domain_samples = {}
+        self._categories = Counter()
+        # thread ident -> domain of the step it runs, None for the sub command
+        self._threads = {}
+        self._command_thread = None
+        self._stop = Event()
+        self.enabled = True
+
+    @contextmanager
+    def command(self, name: str):
+        """
+        Profile the sub command `name` in the current thread.
+        """
+        if not self.enabled:
+            yield
+            return
+        self.command_name = name
+        if self.profile_format == "pstats":
+            with self._profiled(None):
+                yield
+            return
+        self._command_thread = get_ident()
+        self._threads[self._command_thread] = None
+        sampler = Thread(target=self._sample, name="profile_sampler", daemon=True)
+        sampler.start()
+        try:
+            yield
+        finally:
+            self._stop.set()
+            sampler.join()
+            self._threads.pop(self._command_thread, None)
+
+    def step(self, domain: str):
+        """
+        Return a context manager profiling a step of `domain` in the current thread.
+        """
+        if not self.enabled:
+            return _null_context
+        if self.profile_format == "pstats":
+            return self._profiled(domain)
+        return self._sampled(domain)
+
+    @contextmanager
+    def _profiled(self, domain):
+        if getattr(self._local, "profile", None) is not None:
+            # already profiled by the sub command or an outer step
+            yield
+            return
+        import cProfile
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is active, on Python 3.12+ the profiler of the sub command
+            # covers every thread when the profiles are aggregated
+            yield
+            return
+        self._local.profile = profile
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._local.profile = None
+            self._merge(domain, profile)
+
+    def _merge(self, domain, profile):
+        import pstats
+
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(pstats.Stats(profile))
+            if domain is None:
+                return
+            if self._steps_stats is None:
+                self._steps_stats = pstats.Stats(profile)
+            else:
+                self._steps_stats.add(pstats.Stats(profile))
+            if self.aggregate:
+                return
+            if domain in self._domain_stats:
+                self._domain_stats[domain].add(pstats.Stats(profile))
+            else:
+                self._domain_stats[domain] = pstats.Stats(profile)
+
+    @contextmanager
+    def _sampled(self, domain):
+        ident = get_ident()
+        previous = self._threads.get(ident, ())
+        self._threads[ident] = domain
+        try:
+            yield
+        finally:
+            if previous == ():
+                self._threads.pop(ident, None)
+            else:
+                self._threads[ident] = previous
+
+    def _sample(self):
+        while not self._stop.wait(self.sample_interval):
+            frames = sys._current_frames()
+            threads = dict(self._threads)
+            for ident, domain in threads.items():
+                frame = frames.get(ident)
+                # the sub command thread mostly waits while steps run on other threads
+                if frame is None or (ident == self._command_thread and len(threads) > 1):
+                    continue
+                names = []
+                category = None
+                while frame is not None:
+                    filename = frame.f_code.co_filename
+                    if category is None:
+                        category = _category(filename)
+                    names.append(
+                        "{}:{}".format(os.path.basename(filename), frame.f_code.co_name)
+                    )
+                    frame = frame.f_back
+                stack = ";".join(reversed(names))
+                self._samples[stack] += 1
+                self._categories[category or "other"] += 1
+                if domain is not None and not self.aggregate:
+                    self._domain_samples.setdefault(domain, Counter())[stack] += 1
+
+    def _write_collapsed(self, path: Path, samples: Counter):
+        with path.open("w", encoding="utf-8") as f:
+            for stack, count in samples.most_common():
+                f.write("{} {}\n".format(stack, count))
+
+    def export(self):
+        """
+        Write the profiles, print the time of each category, and disable profiling.
+        """
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.path.mkdir(parents=True, exist_ok=True)
+        name = self.command_name or "command"
+        if self.profile_format == "pstats":
+            paths = [self.path / "{}.pstats".format(name)]
+            if self._stats is not None:
+                self._stats.dump_stats(str(paths[0]))
+            for domain, stats in self._domain_stats.items():
+                paths.append(self.path / "{}.{}.pstats".format(name, domain))
+                stats.dump_stats(str(paths[-1]))
+            stats = self._steps_stats or self._stats
+            seconds = _stats_categories(stats.stats if stats else {})
+        else:
+            paths = [self.path / "{}.folded".format(name)]
+            self._write_collapsed(paths[0], self._samples)
+            for domain, samples in self._domain_samples.items():
+                paths.append(self.path / "{}.{}.folded".format(name, domain))
+                self._write_collapsed(paths[-1], samples)
+            seconds = Counter(
+                {k: n * self.sample_interval for k, n in self._categories.items()}
+            )
+        total = sum(seconds.values()) or 1.0
+        output.result("[Profile] {}".format(name))
+        for category in tuple(profile_categories) + ("other",):
+            output.result(
+                "  {:<10} {:8.3f} s {:5.1f}%".format(
+                    category, seconds[category], 100 * seconds[category] / total
+                ),
+                category=category,
+                duration=round(seconds[category], 6),
+            )
+        output.result(
+            "{} profile(s) written to `{}`.".format(len(paths), self.path),
+            profiles=len(paths),
+        )
+
+
+profiler = Profiler()
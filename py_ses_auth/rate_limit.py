@@ -0,0 +1,178 @@
+"""
+Rate limiting and retrying of Cloudflare API requests.
+"""
+
+__all__ = [
+    "Token_Bucket",
+    "Retry_Policy",
+    "Request_Counters",
+    "get_token_bucket",
+    "parse_retry_after",
+    "counters",
+    "bucket_config",
+]
+
+from hashlib import sha256
+from threading import Lock
+from time import monotonic
+import random
+import time
+
+
+class Token_Bucket:
+    """
+    Token bucket shared by every thread and task using the same API token.
+
+    `limit` requests per `period` seconds is Cloudflare's documented global rate limit.
+    At most `burst` requests are sent at once, the bucket refills at
+    `(limit - burst) / period` per second, so no window of `period` seconds exceeds
+    `limit` requests.
+    """
+
+    def __init__(self, limit: int = 1200, period: float = 300, burst: int = 100):
+        self.burst = burst
+        self.rate = (limit - burst) / period
+        self._tokens = float(burst)
+        self._updated_at = monotonic()
+        self._lock = Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def reserve(self) -> float:
+        """
+        Take a token, return how many seconds to wait before using it.
+        """
+        with self._lock:
+            now = monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def headroom(self) -> float:
+        """
+        Return the number of tokens available now.
+        """
+        with self._lock:
+            self._refill(monotonic())
+            return self._tokens
+
+    def pause(self, seconds: float):
+        """
+        Hold back every request for `seconds`, e.g. after a 429 response.
+        """
+        with self._lock:
+            self._refill(monotonic())
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+class Retry_Policy:
+    """
+    Retry throttled (429), server error (5xx) and failed connections with
+    jittered exponential backoff, `Retry-After` is honoured if present.
+
+    Requests which may have been applied are only retried if their method is in
+    `idempotent_methods`, so a POST is retried when throttled or when its connection
+    failed before it was sent, not after a server error or a read timeout.
+    """
+
+    retry_status = frozenset((429, 500, 502, 503, 504))
+    # PATCH of a DNS record sets the same fields again
+    idempotent_methods = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "PATCH", "DELETE"))
+
+    def __init__(
+        self, max_retries: int = 5, base_delay: float = 0.5, max_delay: float = 60
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def retries_status(self, method: str, status_code: int) -> bool:
+        """
+        Return True if a response with `status_code` to a `method` request is retried.
+        """
+        return status_code in self.retry_status and (
+            status_code == 429 or method in self.idempotent_methods
+        )
+
+    def retries_error(self, method: str, sent: bool) -> bool:
+        """
+        Return True if a `method` request which failed without response is retried,
+        `sent` is False if the connection failed before it was sent.
+        """
+        return not sent or method in self.idempotent_methods
+
+    def delay(self, attempt: int, retry_after: float = None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_delay) + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+def parse_retry_after(value):
+    """
+    Return seconds of a `Retry-After` header value, either seconds or an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Request_Counters:
+    """
+    Thread-safe counters of `requests`, `throttled` and `retried` requests.
+    """
+
+    names = ("requests", "throttled", "retried")
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = dict.fromkeys(self.names, 0)
+
+    def incr(self, name: str):
+        with self._lock:
+            self._counts[name] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+
+counters = Request_Counters()
+
+# parameters of `Token_Bucket` created by `get_token_bucket`
+bucket_config = dict(limit=1200, period=300, burst=100)
+_buckets = {}
+_buckets_lock = Lock()
+
+
+def get_token_bucket(token: str) -> Token_Bucket:
+    """
+    Return the `Token_Bucket` shared by all the requests with `token`.
+    """
+    key = sha256((token or "").encode()).hexdigest()
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = _buckets[key] = Token_Bucket(**bucket_config)
+        return bucket
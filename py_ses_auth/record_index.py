@@ -0,0 +1,288 @@
+"""
+Local mirror of the DNS records of Cloudflare zones, so that lookups don't need the API.
+
+Records are kept in a SQLite database in WAL mode, keyed by zone and record id and
+indexed by zone, name and type. A zone is filled by a bulk listing, then refreshed
+incrementally by listing records ordered by `modified_on` until the newest record
+already mirrored. An incremental listing doesn't see records deleted outside of the
+CLI, so a zone is listed completely again once its last full listing is older than
+`Record_Index.full_max_age`. Records created, updated or deleted through
+`Cloudflare_API` are updated in place.
+"""
+
+__all__ = ["Record_Index", "get_record_index", "set_record_index"]
+
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+import itertools
+import json
+import time
+from .metrics import metrics
+from .output import output
+
+
+def _normalize_name(name: str) -> str:
+    return (name or "").lower().rstrip(".")
+
+
+class Record_Index:
+    """
+    Mirror of DNS records in the SQLite database `path`.
+    An instance can be shared by threads.
+    """
+
+    # records written per transaction during a bulk listing
+    chunk_size = 1000
+    # seconds during which a synced zone isn't listed again
+    max_age = 60
+    # seconds after which a zone is listed completely again, to drop deleted records
+    full_max_age = 3600
+
+    def __init__(self, path: Path):
+        import sqlite3
+
+        self.path = Path(path)
+        self._conn = sqlite3.connect(
+            str(self.path), isolation_level=None, check_same_thread=False, timeout=30
+        )
+        self._lock = Lock()
+        # zone id -> lock serializing the listings of the zone
+        self._zone_locks = {}
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS records ("
+                "zone_id TEXT NOT NULL, id TEXT NOT NULL, type TEXT, name TEXT, "
+                "modified_on TEXT, generation INTEGER NOT NULL, data TEXT NOT NULL, "
+                "PRIMARY KEY (zone_id, id)) WITHOUT ROWID"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS records_name ON records (zone_id, name, type)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS zones ("
+                "zone_id TEXT PRIMARY KEY, generation INTEGER NOT NULL, "
+                "modified_on TEXT, synced_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS full_syncs ("
+                "zone_id TEXT PRIMARY KEY, synced_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _zone(self, zone_id: str):
+        return self._conn.execute(
+            "SELECT generation, modified_on, synced_at FROM zones WHERE zone_id = ?",
+            (zone_id,),
+        ).fetchone()
+
+    def _full_synced_at(self, zone_id: str) -> float:
+        row = self._conn.execute(
+            "SELECT synced_at FROM full_syncs WHERE zone_id = ?", (zone_id,)
+        ).fetchone()
+        return 0.0 if row is None else row[0]
+
+    def has_zone(self, zone_id: str) -> bool:
+        """
+        Return True if the zone was listed and not invalidated since.
+        """
+        with self._lock:
+            zone = self._zone(zone_id)
+        return zone is not None and zone[1] is not None
+
+    def _write(self, zone_id: str, records, generation: int):
+        rows = [
+            (
+                zone_id,
+                record["id"],
+                record.get("type"),
+                _normalize_name(record.get("name")),
+                record.get("modified_on"),
+                generation,
+                json.dumps(record, separators=(",", ":")),
+            )
+            for record in records
+        ]
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+        )
+
+    def _set_zone(self, zone_id: str, generation: int, modified_on):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO zones VALUES (?, ?, ?, ?)",
+            (zone_id, generation, modified_on, time.time()),
+        )
+
+    def sync(self, dns_editor: "Cloudflare_API", full=False) -> int:
+        """
+        Mirror the records of the zone of `dns_editor`, return the number of records
+        listed. The zone is listed completely if it was never listed, if its last
+        full listing is older than `full_max_age` seconds or if `full` is True, which
+        also drops deleted records, otherwise only records modified since the newest
+        mirrored one are listed, unless the zone was synced less than `max_age` seconds
+        ago.
+        Syncs of a zone are serialized, a sync which waited for another one doesn't
+        list the zone again if it's fresh by then.
+        Raise `Cloudflare_API_Error` if a page can't be fetched.
+        """
+        zone_id = dns_editor.zone_identifier
+        requested_at = time.time()
+        with self._zone_lock(zone_id):
+            with self._lock:
+                zone = self._zone(zone_id)
+                full_synced_at = self._full_synced_at(zone_id)
+            if zone is None or zone[1] is None:
+                return self._sync_full(dns_editor, zone_id, (zone or (0,))[0] + 1)
+            if full and full_synced_at >= requested_at:
+                # listed completely while this sync waited
+                return 0
+            if full or time.time() - full_synced_at >= self.full_max_age:
+                return self._sync_full(dns_editor, zone_id, zone[0] + 1)
+            if time.time() - zone[2] < self.max_age:
+                return 0
+            return self._sync_modified(dns_editor, zone_id, *zone[:2])
+
+    def _zone_lock(self, zone_id: str) -> Lock:
+        with self._lock:
+            return self._zone_locks.setdefault(zone_id, Lock())
+
+    def _sync_full(self, dns_editor: "Cloudflare_API", zone_id: str, generation: int):
+        # rows of the previous generation stay readable until the listing completes
+        count = 0
+        newest = ""
+        records = iter(dns_editor.list_dns_records())
+        with metrics.span("record_index_sync", mode="full"):
+            while True:
+                chunk = list(itertools.islice(records, self.chunk_size))
+                if not chunk:
+                    break
+                count += len(chunk)
+                newest = max([newest] + [r.get("modified_on") or "" for r in chunk])
+                with self._transaction():
+                    self._write(zone_id, chunk, generation)
+            with self._transaction():
+                self._conn.execute(
+                    "DELETE FROM records WHERE zone_id = ? AND generation != ?",
+                    (zone_id, generation),
+                )
+                self._set_zone(zone_id, generation, newest)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO full_syncs VALUES (?, ?)",
+                    (zone_id, time.time()),
+                )
+        output.info("Mirror {} record(s) of zone {}".format(count, zone_id))
+        return count
+
+    def _sync_modified(
+        self, dns_editor: "Cloudflare_API", zone_id: str, generation: int, newest: str
+    ):
+        newest = newest or ""
+        modified = []
+        with metrics.span("record_index_sync", mode="modified"):
+            for record in dns_editor.list_dns_records(
+                per_page=100, order="modified_on", direction="desc"
+            ):
+                if (record.get("modified_on") or "") <= newest:
+                    break
+                modified.append(record)
+            with self._transaction():
+                self._write(zone_id, modified, generation)
+                if modified:
+                    newest = max(r.get("modified_on") or "" for r in modified)
+                self._set_zone(zone_id, generation, newest)
+        return len(modified)
+
+    def upsert(self, zone_id: str, record: dict):
+        """
+        Mirror a record created or updated through the API.
+        """
+        with self._transaction():
+            zone = self._zone(zone_id)
+            self._write(zone_id, [record], zone[0] if zone else 0)
+
+    def invalidate(self, zone_id: str):
+        """
+        Make the next `sync` of the zone list it completely, e.g. after records were
+        created without being returned by the API.
+        """
+        with self._transaction():
+            self._conn.execute(
+                "UPDATE zones SET modified_on = NULL WHERE zone_id = ?", (zone_id,)
+            )
+
+    def delete(self, zone_id: str, record_id: str):
+        with self._transaction():
+            self._conn.execute(
+                "DELETE FROM records WHERE zone_id = ? AND id = ?", (zone_id, record_id)
+            )
+
+    def find(self, zone_id: str, record_type: str = None, name: str = None) -> list:
+        """
+        Return the mirrored records of the zone with `record_type` and `name` if given.
+        """
+        query = "SELECT data FROM records WHERE zone_id = ?"
+        params = [zone_id]
+        if name is not None:
+            query += " AND name = ?"
+            params.append(_normalize_name(name))
+        if record_type is not None:
+            query += " AND type = ?"
+            params.append(record_type)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def records(self, zone_id: str):
+        """
+        Yield every mirrored record of the zone, `chunk_size` records are read at once.
+        """
+        last_id = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, data FROM records WHERE zone_id = ? AND id > ? "
+                    "ORDER BY id LIMIT ?",
+                    (zone_id, last_id, self.chunk_size),
+                ).fetchall()
+            if not rows:
+                return
+            for _, data in rows:
+                yield json.loads(data)
+            last_id = rows[-1][0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_record_index = None
+
+
+def get_record_index() -> Record_Index:
+    """
+    Return the record index of the current run, or None.
+    """
+    return _record_index
+
+
+def set_record_index(record_index: Record_Index):
+    global _record_index
+    _record_index = record_index
@@ -0,0 +1,206 @@
+"""
+Append-only log of DNS records created for a domain.
+
+Records are appended to `dns_record_info.jsonl` at constant cost, `compact` merges them
+into the legacy `dns_record_info.json` document `{"Cloudflare": [...]}`.
+"""
+
+__all__ = ["Record_Log", "get_record_log", "close_record_log", "close_record_logs"]
+
+from pathlib import Path
+from threading import Lock
+import json
+import os
+from .metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # not POSIX, only in-process locking
+    fcntl = None
+
+
+class _File_Lock:
+    """
+    Exclusive advisory lock on an open file across processes.
+    """
+
+    def __init__(self, f):
+        self.f = f
+
+    def __enter__(self):
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+
+
+class Record_Log:
+    """
+    DNS records of a domain directory, `path_src`.
+
+    Appended records are flushed immediately and fsynced once every `fsync_every`
+    appends, on `flush` and on `close`. Records are indexed by id, type and name
+    once any of `get`, `find` or `records` is used.
+    """
+
+    name = "dns_record_info.jsonl"
+    legacy_name = "dns_record_info.json"
+
+    def __init__(self, path_src: Path, fsync_every: int = 16):
+        self.path = path_src / self.name
+        self.path_legacy = path_src / self.legacy_name
+        self.fsync_every = fsync_every
+        self._file = None
+        self._unsynced = 0
+        self._lock = Lock()
+        self._by_id = None
+        self._by_type = None
+        self._by_name = None
+
+    def _open(self):
+        if self._file is None:
+            self._file = self.path.open("a", encoding="utf-8")
+        return self._file
+
+    def append(self, record: dict):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            f = self._open()
+            with _File_Lock(f):
+                f.write(line)
+                f.flush()
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every:
+                os.fsync(f.fileno())
+                self._unsynced = 0
+            if self._by_id is not None:
+                self._index(record)
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None and self._unsynced:
+                os.fsync(self._file.fileno())
+                self._unsynced = 0
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _read_all(self) -> list:
+        records = []
+        if self.path_legacy.exists():
+            with self.path_legacy.open("r") as f:
+                # ignore trailing bytes left by the former in-place rewrites
+                d, _ = json.JSONDecoder().raw_decode(f.read())
+                records.extend(d.get("Cloudflare", []))
+        if self.path.exists():
+            with self.path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    # skip a partial line left by an interrupted write
+                    if line.endswith("\n"):
+                        records.append(json.loads(line))
+        return records
+
+    def _index(self, record: dict):
+        record_id = record.get("id")
+        self._by_id[record_id] = record
+        self._by_type.setdefault(record.get("type"), []).append(record)
+        name = (record.get("name") or "").lower().rstrip(".")
+        self._by_name.setdefault(name, []).append(record)
+
+    def _ensure_index(self):
+        if self._by_id is None:
+            self._by_id, self._by_type, self._by_name = {}, {}, {}
+            for record in self._read_all():
+                self._index(record)
+
+    def records(self) -> list:
+        with self._lock:
+            self._ensure_index()
+            return list(self._by_id.values())
+
+    def get(self, record_id: str):
+        with self._lock:
+            self._ensure_index()
+            return self._by_id.get(record_id)
+
+    def find(self, record_type: str = None, name: str = None) -> list:
+        with self._lock:
+            self._ensure_index()
+            if name is not None:
+                found = self._by_name.get(name.lower().rstrip("."), [])
+                if record_type is not None:
+                    found = [r for r in found if r.get("type") == record_type]
+                return list(found)
+            if record_type is not None:
+                return list(self._by_type.get(record_type, []))
+            return list(self._by_id.values())
+
+    def compact(self):
+        """
+        Merge the log into `dns_record_info.json`, then truncate the log.
+        """
+        with self._lock, metrics.span("record_log_compact"):
+            if self._file is None and not self.path.exists():
+                return
+            f = self._open()
+            with _File_Lock(f):
+                if os.fstat(f.fileno()).st_size == 0:
+                    return
+                records = self._read_all()
+                path_tmp = self.path_legacy.with_name(
+                    "{}.{}.tmp".format(self.legacy_name, os.getpid())
+                )
+                with path_tmp.open("w") as f_tmp:
+                    json.dump({"Cloudflare": records}, f_tmp, indent=4)
+                    f_tmp.flush()
+                    os.fsync(f_tmp.fileno())
+                os.replace(path_tmp, self.path_legacy)
+                f.truncate(0)
+            self._unsynced = 0
+
+
+_logs = {}
+_logs_lock = Lock()
+
+
+def get_record_log(path_src: Path) -> Record_Log:
+    """
+    Return the shared `Record_Log` of a domain directory.
+    """
+    key = os.path.abspath(path_src)
+    with _logs_lock:
+        log = _logs.get(key)
+        if log is None:
+            log = _logs[key] = Record_Log(path_src)
+        return log
+
+
+def close_record_log(path_src: Path, compact=True):
+    """
+    Compact and close the shared `Record_Log` of a domain directory if it is open.
+    """
+    with _logs_lock:
+        log = _logs.pop(os.path.abspath(path_src), None)
+    if log is not None:
+        if compact:
+            log.compact()
+        log.close()
+
+
+def close_record_logs(compact=True):
+    """
+    Compact and close all the shared `Record_Log`.
+    """
+    with _logs_lock:
+        logs = list(_logs.values())
+        _logs.clear()
+    for log in logs:
+        if compact:
+            log.compact()
+        log.close()
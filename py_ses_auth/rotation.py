@@ -0,0 +1,296 @@
+"""
+Rotating the BYODKIM keys of a fleet of domains to a new selector, in phases:
+`publish` the TXT record of a new key pair, wait until it is `visible` in DNS, `switch`
+the signing key of the SES identity, then `retire` the TXT records of the old selectors
+once a grace period passed. It requires the modules `cryptography` and `dnspython`.
+
+Every completed phase is recorded in the journal, so a rotation can run in bounded time
+windows, each run resumes every domain at the phase where the previous one stopped.
+"""
+
+__all__ = [
+    "rotation_phases",
+    "key_path",
+    "old_selectors",
+    "rotation_phase",
+    "rotate_fleet",
+    "print_rotation_summary",
+]
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import asyncio
+import time
+from . import (
+    _read_key_from_file,
+    aws_ses_create_email_identity,
+    byodkim_dns_payloads,
+    create_byodkim_dns_record,
+    delete_byodkim_dns_record,
+)
+from .cloudflare_api import Cloudflare_API
+from .fleet import _check_row, _Cloudflare_API_Pool, _print_counts
+from .journal import Job_Journal, get_journal, journal_key, set_journal
+from .keygen import keygen_paths, write_key_pair
+from .output import output
+from .plan import normalize_record
+from .record_log import close_record_log
+from .verify import Backoff, DNS_Checker, _dns_check, verify_domain
+
+rotation_phases = ("publish", "visible", "switch", "retire", "done")
+
+
+def key_path(path_src: Path, selector: str) -> Path:
+    """
+    Return the directory of the key pair of `selector` in the domain directory.
+    The key pair is copied to the domain directory once SES signs with it.
+    """
+    return path_src / "keys" / selector
+
+
+def old_selectors(journal: Job_Journal, domain: str, selector: str, old_selector=None):
+    """
+    Return the selectors of `domain` to retire: the ones whose TXT record is published
+    according to the journal, and `old_selector`, except `selector` and the selectors
+    already retired.
+    """
+    published = set()
+    retired = set()
+    for step, key, _ in journal.steps(domain):
+        if step == "byodkim_dns":
+            published.add(key)
+        elif step == "byodkim_dns_delete":
+            retired.add(key)
+    if old_selector:
+        published.add(old_selector)
+    published.discard(selector)
+    return sorted(published - retired)
+
+
+def rotation_phase(journal: Job_Journal, row: dict) -> str:
+    """
+    Return the first phase of `rotation_phases` that the rotation of the domain of a
+    manifest row to its `selector` has not completed.
+    """
+    domain = row["domain"]
+    selector = row["selector"]
+    if not journal.is_done(domain, "byodkim_dns", journal_key(selector)):
+        return "publish"
+    if not journal.is_done(domain, "byodkim_dns_visible", journal_key(selector)):
+        return "visible"
+    if not journal.is_done(
+        domain, "ses_dkim_attributes", journal_key(row.get("region"), selector)
+    ):
+        return "switch"
+    if not journal.is_done(domain, "rotation", journal_key(selector)):
+        return "retire"
+    return "done"
+
+
+def _promote_key_pair(path_src: Path, path_key: Path):
+    private_pem = (path_key / "private.key").read_bytes()
+    path_private_key = path_src / "private.key"
+    if path_private_key.exists() and path_private_key.read_bytes() == private_pem:
+        return
+    write_key_pair(path_src, private_pem, (path_key / "public.key").read_bytes())
+    output.info("promote key pair `{}`".format(path_key.name))
+
+
+async def _rotate_rows(
+    path_cwd: Path,
+    rows: list,
+    journal: Job_Journal,
+    public_keys: dict,
+    workers: int,
+    grace: float,
+    window: float,
+    nameservers,
+    concurrency: int,
+    ses_backend,
+    old_selector,
+    base_delay: float,
+    max_delay: float,
+) -> list:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + window
+    dns_checker = DNS_Checker(nameservers, concurrency)
+    apis = _Cloudflare_API_Pool(workers)
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    def in_thread(fn, *args):
+        return loop.run_in_executor(executor, fn, *args)
+
+    async def rotate_row(row: dict) -> dict:
+        domain = row["domain"]
+        region = row.get("region")
+        selector = row.get("selector")
+        token_name = row.get("token_name")
+        path_src = path_cwd / domain
+        path_key = key_path(path_src, selector or "")
+
+        async def publish():
+            public_key = public_keys.get(path_key)
+            if public_key is None:
+                public_key = _read_key_from_file(path_key / "public.key")
+            cf_api: Cloudflare_API = apis.get(token_name)
+            return await in_thread(
+                create_byodkim_dns_record,
+                path_src,
+                domain,
+                token_name,
+                selector,
+                cf_api,
+                public_key,
+            )
+
+        async def visible():
+            public_key = _read_key_from_file(path_key / "public.key")
+            record = normalize_record(byodkim_dns_payloads(domain, selector, public_key)[0])
+            checks = {
+                "dns TXT {}".format(record[1]): _dns_check(
+                    dns_checker, "TXT", record[1], {record}
+                )
+            }
+            verified = await verify_domain(
+                domain, checks, Backoff(base_delay, max_delay), deadline
+            )
+            if not verified["success"]:
+                return None
+            journal.mark_done(domain, "byodkim_dns_visible", journal_key(selector))
+            return True
+
+        async def switch():
+            return await in_thread(
+                lambda: aws_ses_create_email_identity(
+                    path_src, domain, region, selector, False, ses_backend, path_key
+                )
+            )
+
+        def delete_old_selectors(selectors: list):
+            cf_api = apis.get(token_name)
+            for old in selectors:
+                if not delete_byodkim_dns_record(path_src, domain, token_name, old, cf_api):
+                    return False
+            journal.mark_done(domain, "rotation", journal_key(selector), selectors)
+            return True
+
+        async def retire():
+            await in_thread(_promote_key_pair, path_src, path_key)
+            switched_at = journal.completed_at(
+                domain, "ses_dkim_attributes", journal_key(region, selector)
+            )
+            if time.time() < switched_at + grace:
+                return None
+            selectors = old_selectors(journal, domain, selector, old_selector)
+            return await in_thread(delete_old_selectors, selectors)
+
+        phases = dict(publish=publish, visible=visible, switch=switch, retire=retire)
+        result = {"domain": domain, "success": True, "failed_step": None, "error": None}
+        phase = "publish"
+        try:
+            _check_row(path_src, row)
+            assert type(selector) is str, "Missing `selector`."
+            phase = rotation_phase(journal, row)
+            while phase != "done" and loop.time() < deadline:
+                status = await phases[phase]()
+                if status is None:
+                    break
+                if not status:
+                    result["success"] = False
+                    result["failed_step"] = phase
+                    break
+                phase = rotation_phases[rotation_phases.index(phase) + 1]
+        except Exception as err:
+            result["success"] = False
+            result["failed_step"] = phase
+            result["error"] = "{}: {}".format(type(err).__name__, err)
+        finally:
+            close_record_log(path_src)
+        result["phase"] = phase
+        return result
+
+    try:
+        return await asyncio.gather(*map(rotate_row, rows))
+    finally:
+        executor.shutdown(wait=False)
+        apis.close()
+
+
+def rotate_fleet(
+    path_cwd: Path,
+    rows,
+    journal: Job_Journal,
+    workers: int = 8,
+    key_size: int = 2048,
+    grace: float = 72 * 3600,
+    window: float = 900,
+    nameservers=None,
+    concurrency: int = 256,
+    ses_backend=None,
+    old_selector: str = None,
+    base_delay: float = 5,
+    max_delay: float = 120,
+) -> list:
+    """
+    Rotate every domain of `rows` to the `selector` of its row, for at most `window`
+    seconds, then return the list of results with the `phase` each domain reached.
+    Key pairs of the new selectors are generated first through a process pool, TXT
+    records are published and SES identities switched by `workers` threads, DNS
+    propagation is polled in one event loop with at most `concurrency` queries in
+    flight. Old selectors are retired `grace` seconds after the switch.
+    """
+    rows = list(rows)
+    paths = [
+        key_path(path_cwd / row["domain"], row["selector"])
+        for row in rows
+        if row.get("selector")
+        and (path_cwd / row["domain"]).exists()
+        and rotation_phase(journal, row) == "publish"
+    ]
+    public_keys = keygen_paths(paths, key_size)
+    if public_keys:
+        output.info("generate {} key pair(s)".format(len(public_keys)))
+    previous_journal = get_journal()
+    set_journal(journal)
+    try:
+        return asyncio.run(
+            _rotate_rows(
+                path_cwd,
+                rows,
+                journal,
+                public_keys,
+                workers,
+                grace,
+                window,
+                nameservers,
+                concurrency,
+                ses_backend,
+                old_selector,
+                base_delay,
+                max_delay,
+            )
+        )
+    finally:
+        set_journal(previous_journal)
+
+
+def print_rotation_summary(results: list):
+    failed = [r for r in results if not r["success"]]
+    phases = Counter(r["phase"] for r in results if r["success"])
+    output.result("[Rotation summary]")
+    for r in failed:
+        line = "FAILED {} at `{}`".format(r["domain"], r["failed_step"])
+        if r["error"]:
+            line += " {}".format(r["error"])
+        output.result(
+            line,
+            domain=r["domain"],
+            status="failed",
+            step=r["failed_step"],
+            error=r["error"],
+        )
+    for phase in rotation_phases[:-1]:
+        if phases[phase]:
+            output.result("{} domain(s) waiting to `{}`.".format(phases[phase], phase))
+    _print_counts(phases["done"], len(failed))
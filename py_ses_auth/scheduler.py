@@ -0,0 +1,138 @@
+"""
+Running the onboarding steps of domains as dependency graphs on a shared executor, so
+that a step starts as soon as the steps it depends on have succeeded.
+"""
+
+__all__ = ["Step_Graph", "DAG_Scheduler", "run_graph"]
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from threading import Lock
+
+
+class Step_Graph:
+    """
+    Steps of one domain: `name -> (fn, deps)`, `fn()` returns True if it succeeded.
+    A step can only depend on steps added before it, so the graph is acyclic and the
+    insertion order is a valid sequential order.
+    """
+
+    def __init__(self):
+        self.steps = {}
+
+    def add(self, name: str, fn, deps=()):
+        for dep in deps:
+            assert dep in self.steps, "Unknown dependency `{}` of `{}`.".format(dep, name)
+        self.steps[name] = (fn, tuple(deps))
+
+    def __iter__(self):
+        """
+        Yield `(name, fn)` in a sequential order.
+        """
+        for name, (fn, _) in self.steps.items():
+            yield name, fn
+
+    def __len__(self):
+        return len(self.steps)
+
+
+class _Graph_Run:
+    """
+    State of a running `Step_Graph`.
+    """
+
+    def __init__(self, scheduler: "DAG_Scheduler", graph: Step_Graph, future: Future):
+        self.scheduler = scheduler
+        self.graph = graph
+        self.future = future
+        self.waiting = {name: len(deps) for name, (_, deps) in graph.steps.items()}
+        self.dependents = {name: [] for name in graph.steps}
+        for name, (_, deps) in graph.steps.items():
+            for dep in deps:
+                self.dependents[dep].append(name)
+        self.status = {}
+        self.errors = {}
+        self._lock = Lock()
+
+    def start(self):
+        ready = [name for name, n in self.waiting.items() if n == 0]
+        if not ready:
+            self._finish()
+        for name in ready:
+            self._submit(name)
+
+    def _submit(self, name: str):
+        # steps run in the context of the thread submitting them, e.g. to print to
+        # the output of a service job
+        self.scheduler.executor.submit(copy_context().run, self._run, name)
+
+    def _run(self, name: str):
+        fn, _ = self.graph.steps[name]
+        try:
+            ok = bool(fn())
+        except Exception as err:
+            ok = False
+            self.errors[name] = "{}: {}".format(type(err).__name__, err)
+        ready = []
+        with self._lock:
+            self.status[name] = ok
+            if ok:
+                for dependent in self.dependents[name]:
+                    self.waiting[dependent] -= 1
+                    if self.waiting[dependent] == 0:
+                        ready.append(dependent)
+            else:
+                self._skip_dependents(name)
+            finished = len(self.status) == len(self.graph)
+        for dependent in ready:
+            self._submit(dependent)
+        if finished:
+            self._finish()
+
+    def _skip_dependents(self, name: str):
+        for dependent in self.dependents[name]:
+            if dependent not in self.status:
+                self.status[dependent] = None
+                self._skip_dependents(dependent)
+
+    def _finish(self):
+        failed_step = None
+        for name in self.graph.steps:
+            if self.status.get(name) is False:
+                failed_step = name
+                break
+        self.future.set_result(
+            {
+                "success": failed_step is None,
+                "failed_step": failed_step,
+                "error": self.errors.get(failed_step),
+            }
+        )
+
+
+class DAG_Scheduler:
+    """
+    Run `Step_Graph` of many domains on one executor. A step runs once all its
+    dependencies succeeded, steps depending on a failed step are skipped. No thread
+    waits for another step, dependents are submitted by the step they wait for.
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+
+    def submit(self, graph: Step_Graph) -> Future:
+        """
+        Start running `graph`, return a future of a dict contains `success`, the first
+        `failed_step` in insertion order and its `error` if any.
+        """
+        future = Future()
+        _Graph_Run(self, graph, future).start()
+        return future
+
+
+def run_graph(graph: Step_Graph, workers: int = None) -> dict:
+    """
+    Run one `Step_Graph` on its own threads (one per step by default) and wait for it.
+    """
+    with ThreadPoolExecutor(max_workers=workers or max(1, len(graph))) as executor:
+        return DAG_Scheduler(executor).submit(graph).result()
@@ -0,0 +1,382 @@
+"""
+Long-running onboarding service: jobs are CLI sub-commands queued through a small local
+HTTP API (on TCP or a Unix socket) and run by a worker pool in one process, so that
+Cloudflare sessions, SES clients, zone caches and config indexes stay warm across jobs.
+
+    POST /jobs               {"args": ["byodkim", "example.com", "--region", ...]}
+    GET  /jobs               status of all the jobs
+    GET  /jobs/<id>          status and output of a job
+    GET  /jobs/<id>/stream   output of a job, streamed line by line until it finishes
+
+The API has no authentication: it listens on a loopback address unless told otherwise,
+and its Unix socket is only accessible by its owner.
+"""
+
+__all__ = [
+    "service_commands",
+    "Job",
+    "Onboarding_Service",
+    "start_server",
+]
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Condition, Lock
+import ipaddress
+import itertools
+import json
+import os
+import re
+import socketserver
+import sys
+import time
+from .output import output
+from .token_pool import set_shared_cloudflare_apis
+
+# sub-commands which can be queued
+service_commands = ("byodkim", "mail_from_domain", "inbound_smtp", "dmarc")
+
+_current_job = ContextVar("current_job", default=None)
+
+# a domain name made of hostname labels, which is also a safe directory name
+_domain_name = re.compile(
+    r"^(?=.{1,253}$)(?!-)[A-Za-z0-9-]{1,63}(?<!-)(\.(?!-)[A-Za-z0-9-]{1,63}(?<!-))+$"
+)
+
+
+class Job:
+    """
+    A queued sub-command, its status ("queued", "running", "done" or "failed") and
+    the lines it printed.
+    """
+
+    def __init__(self, job_id: str, args: list):
+        self.id = job_id
+        self.args = args
+        self.status = "queued"
+        self.error = None
+        self.lines = []
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._partial = ""
+        self._condition = Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def write(self, text: str):
+        with self._condition:
+            lines = (self._partial + text).split("\n")
+            self._partial = lines.pop()
+            if lines:
+                self.lines.extend(lines)
+                self._condition.notify_all()
+
+    def set_status(self, status: str, error: str = None):
+        with self._condition:
+            if status == "running":
+                self.started_at = time.time()
+            elif status in ("done", "failed"):
+                if self._partial:
+                    self.lines.append(self._partial)
+                    self._partial = ""
+                self.finished_at = time.time()
+            self.status = status
+            self.error = error
+            self._condition.notify_all()
+
+    def follow(self, timeout: float = 15):
+        """
+        Yield output lines as they are printed until the job finishes, or None every
+        `timeout` seconds without any line.
+        """
+        sent = 0
+        while True:
+            with self._condition:
+                if sent == len(self.lines) and not self.finished:
+                    self._condition.wait(timeout)
+                lines = self.lines[sent:]
+                finished = self.finished
+            sent += len(lines)
+            if lines:
+                yield from lines
+            elif not finished:
+                yield None
+            if finished and sent == len(self.lines):
+                return
+
+    def to_dict(self, output=True) -> dict:
+        d = {
+            "id": self.id,
+            "args": self.args,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if output:
+            d["output"] = list(self.lines)
+        return d
+
+
+class _Output_Router:
+    """
+    Replacement of `sys.stdout` which writes to the output of the job of the current
+    context, or to the original stream outside of jobs.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text: str):
+        job = _current_job.get()
+        if job is None:
+            return self.stream.write(text)
+        job.write(text)
+        return len(text)
+
+    def flush(self):
+        if _current_job.get() is None:
+            self.stream.flush()
+
+    def __getattr__(self, name: str):
+        return getattr(self.stream, name)
+
+
+def _job_failed(result) -> bool:
+    # handlers return the result of their step graph or the status of their step
+    if isinstance(result, dict):
+        return not result.get("success")
+    return not result
+
+
+class Onboarding_Service:
+    """
+    Run queued jobs through `cli.handle_args` on `workers` threads. The last
+    `max_jobs` jobs are kept for status queries. `after_job(job, namespace)` is called
+    once each job finishes, with the parsed arguments or None, e.g. to close its record
+    log.
+    """
+
+    def __init__(
+        self,
+        cli,
+        workers: int = 8,
+        commands=service_commands,
+        max_jobs: int = 10000,
+        after_job=None,
+    ):
+        from .fleet import _Cloudflare_API_Pool
+
+        self.cli = cli
+        self.commands = tuple(commands)
+        self.max_jobs = max_jobs
+        self.after_job = after_job
+        self.apis = _Cloudflare_API_Pool(workers)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = Lock()
+        # build the sub parsers once, before jobs parse arguments concurrently
+        for command in self.commands:
+            cli._build_sub_parser(command)
+
+    def submit(self, args: list) -> Job:
+        assert (
+            type(args) is list and args and all(type(arg) is str for arg in args)
+        ), "`args` must be a non-empty list of strings."
+        assert args[0] in self.commands, "Sub command must be one of {}.".format(
+            ", ".join(self.commands)
+        )
+        try:
+            namespace = self.cli.parse_args(args)
+        except SystemExit:
+            raise AssertionError("Invalid arguments.") from None
+        # the domain is the directory of its keys and record log
+        domain = getattr(namespace, "domain", None) or ""
+        assert _domain_name.match(domain), "`{}` is not a domain name.".format(domain)
+        with self._lock:
+            job = Job(str(next(self._ids)), args)
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_jobs:
+                oldest = next(iter(self.jobs.values()))
+                if not oldest.finished:
+                    break
+                self.jobs.popitem(last=False)
+        self.executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list(self) -> list:
+        with self._lock:
+            return list(self.jobs.values())
+
+    def _run(self, job: Job):
+        _current_job.set(job)
+        job.set_status("running")
+        status, error = "done", None
+        namespace = None
+        try:
+            # messages written to `--json` or `--log_file` are kept by the job too
+            with output.context(job=job.id), output.tee(job):
+                namespace = self.cli.handle_args(list(job.args))
+            if _job_failed(getattr(namespace, "handler_result", None)):
+                status = "failed"
+        except AssertionError as err:
+            status, error = "failed", str(err.args[0] if err.args else err)
+        except SystemExit:
+            status, error = "failed", "Invalid arguments."
+        except Exception as err:
+            status, error = "failed", "{}: {}".format(type(err).__name__, err)
+        finally:
+            if callable(self.after_job):
+                try:
+                    self.after_job(job, namespace)
+                except Exception as err:
+                    output.error("after_job: {}: {}".format(type(err).__name__, err))
+            job.set_status(status, error)
+
+    def start(self):
+        """
+        Route printed output, and errors of arguments, to jobs and share the
+        Cloudflare sessions.
+        """
+        sys.stdout = _Output_Router(sys.stdout)
+        sys.stderr = _Output_Router(sys.stderr)
+        set_shared_cloudflare_apis(self.apis)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        set_shared_cloudflare_apis(None)
+        if isinstance(sys.stdout, _Output_Router):
+            sys.stdout = sys.stdout.stream
+        if isinstance(sys.stderr, _Output_Router):
+            sys.stderr = sys.stderr.stream
+        self.apis.close()
+
+
+def _handler_class(service: Onboarding_Service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, code: int, obj):
+            body = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _job(self, job_id: str):
+            job = service.get(job_id)
+            if job is None:
+                self._send_json(404, {"error": "Unknown job `{}`.".format(job_id)})
+            return job
+
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+            if parts == ["jobs"]:
+                return self._send_json(
+                    200, [job.to_dict(output=False) for job in service.list()]
+                )
+            if len(parts) == 2 and parts[0] == "jobs":
+                job = self._job(parts[1])
+                if job is not None:
+                    self._send_json(200, job.to_dict())
+                return
+            if len(parts) == 3 and parts[0] == "jobs" and parts[2] == "stream":
+                job = self._job(parts[1])
+                if job is not None:
+                    self._stream(job)
+                return
+            self._send_json(404, {"error": "Not found."})
+
+        def _stream(self, job: Job):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def chunk(data: bytes):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            for line in job.follow():
+                # an empty chunk would end the response, keep the connection alive
+                # with an empty line instead
+                chunk(b"\n" if line is None else (line + "\n").encode())
+            chunk("[{}] {}\n".format(job.status, job.error or "").encode())
+            self.wfile.write(b"0\r\n\r\n")
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/jobs":
+                return self._send_json(404, {"error": "Not found."})
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                job = service.submit(body.get("args"))
+            except (ValueError, AttributeError):
+                return self._send_json(400, {"error": "Body must be a JSON object."})
+            except AssertionError as err:
+                return self._send_json(400, {"error": err.args[0]})
+            self._send_json(202, job.to_dict(output=False))
+
+    return Handler
+
+
+class _Unix_HTTP_Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # `BaseHTTPRequestHandler` expects `(host, port)`
+        return request, ("local", 0)
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def start_server(service: Onboarding_Service, listen: str, allow_remote=False):
+    """
+    Return a server of the HTTP API of `service`, listening on `host:port`, or on a
+    Unix socket only accessible by its owner if `listen` is a path (containing `/`).
+    A host which isn't a loopback address is refused unless `allow_remote` is True.
+    """
+    handler = _handler_class(service)
+    if "/" in listen:
+        path = Path(listen)
+        if path.is_socket():
+            os.unlink(path)
+        # the socket is created with mode 0600, not changed after it is bound
+        umask = os.umask(0o177)
+        try:
+            return _Unix_HTTP_Server(str(path), handler)
+        finally:
+            os.umask(umask)
+    host, _, port = listen.rpartition(":")
+    host = host or "127.0.0.1"
+    assert allow_remote or _is_loopback(host), (
+        "`{}` is not a loopback address and the API has no authentication, "
+        "use `--allow_remote` to listen on it anyway.".format(host)
+    )
+    server = ThreadingHTTPServer((host, int(port)), handler)
+    server.daemon_threads = True
+    return server
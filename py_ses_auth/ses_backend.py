@@ -0,0 +1,321 @@
+"""
+Backends which call the AWS SES v2 API.
+"""
+
+__all__ = [
+    "SES_Backend",
+    "AWS_CLI_Backend",
+    "SDK_Backend",
+    "Fake_Backend",
+    "get_ses_backend",
+]
+
+from abc import ABC, abstractmethod
+from threading import Lock
+import json
+import os
+from .output import output
+
+
+class SES_Backend(ABC):
+    """
+    Interface of AWS SES v2 backends.
+    Request bodies are the same as the `--cli-input-json` of AWS CLI.
+    Each method returns True if the request succeeded, except `get_email_identity`.
+    """
+
+    name = None
+
+    @abstractmethod
+    def get_email_identity(self, region: str, domain: str):
+        """
+        Return the response of `GetEmailIdentity`, e.g. `DkimAttributes.Status` and
+        `MailFromAttributes.MailFromDomainStatus`, or None if the request failed.
+        """
+
+    @abstractmethod
+    def create_email_identity(self, region: str, body: dict) -> bool:
+        pass
+
+    @abstractmethod
+    def put_email_identity_dkim_signing_attributes(
+        self, region: str, domain: str, body: dict
+    ) -> bool:
+        pass
+
+    @abstractmethod
+    def put_email_identity_mail_from_attributes(
+        self, region: str, domain: str, mail_from_domain: str, behavior_on_mx_failure: str
+    ) -> bool:
+        pass
+
+
+class AWS_CLI_Backend(SES_Backend):
+    """
+    Run `aws sesv2` in a subprocess for each request.
+    """
+
+    name = "cli"
+
+    def _run(self, *args) -> bool:
+        import subprocess
+
+        output.info("[AWS CLI]")
+        cp = subprocess.run(("aws", "sesv2") + args, capture_output=True, text=True)
+        if cp.stdout.strip():
+            output.info(cp.stdout.rstrip())
+        if cp.stderr.strip():
+            output.error(cp.stderr.rstrip(), status=cp.returncode)
+        return cp.returncode == 0
+
+    def _run_with_input(self, body: dict, *args) -> bool:
+        """
+        Run with `--cli-input-json` read from a private temporary file, so that the
+        body, e.g. a DKIM private key, doesn't show in the process arguments.
+        """
+        import tempfile
+
+        fd, path = tempfile.mkstemp(prefix="ses_auth_", suffix=".json")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(body, f)
+            return self._run(*args, "--cli-input-json", "file://{}".format(path))
+        finally:
+            os.unlink(path)
+
+    def get_email_identity(self, region: str, domain: str):
+        import subprocess
+
+        cp = subprocess.run(
+            (
+                "aws",
+                "sesv2",
+                "get-email-identity",
+                "--email-identity",
+                domain,
+                "--region",
+                region,
+                "--output",
+                "json",
+            ),
+            stdout=subprocess.PIPE,
+        )
+        if cp.returncode != 0:
+            return None
+        try:
+            return json.loads(cp.stdout)
+        except ValueError:
+            return None
+
+    def create_email_identity(self, region: str, body: dict) -> bool:
+        return self._run_with_input(body, "create-email-identity", "--region", region)
+
+    def put_email_identity_dkim_signing_attributes(
+        self, region: str, domain: str, body: dict
+    ) -> bool:
+        return self._run_with_input(
+            body,
+            "put-email-identity-dkim-signing-attributes",
+            "--email-identity",
+            domain,
+            "--region",
+            region,
+        )
+
+    def put_email_identity_mail_from_attributes(
+        self, region: str, domain: str, mail_from_domain: str, behavior_on_mx_failure: str
+    ) -> bool:
+        return self._run(
+            "put-email-identity-mail-from-attributes",
+            "--email-identity",
+            domain,
+            "--mail-from-domain",
+            mail_from_domain,
+            "--behavior-on-mx-failure",
+            behavior_on_mx_failure,
+            "--region",
+            region,
+        )
+
+
+class SDK_Backend(SES_Backend):
+    """
+    Call AWS SES v2 in process by `boto3`, keeping one client per region.
+    """
+
+    name = "sdk"
+
+    def __init__(self):
+        import boto3.session
+
+        self._session = boto3.session.Session()
+        self._clients = {}
+        self._lock = Lock()
+
+    def client(self, region: str):
+        with self._lock:
+            client = self._clients.get(region)
+            if client is None:
+                client = self._session.client("sesv2", region_name=region)
+                self._clients[region] = client
+            return client
+
+    def _call(self, region: str, operation: str, **kwargs) -> bool:
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        output.info("[AWS SDK] {}".format(operation))
+        try:
+            getattr(self.client(region), operation)(**kwargs)
+        except (BotoCoreError, ClientError) as err:
+            output.error("AWS Error: {}".format(err))
+            return False
+        return True
+
+    def get_email_identity(self, region: str, domain: str):
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        try:
+            response = self.client(region).get_email_identity(EmailIdentity=domain)
+        except (BotoCoreError, ClientError) as err:
+            output.error("AWS Error: {}".format(err))
+            return None
+        response.pop("ResponseMetadata", None)
+        return response
+
+    def create_email_identity(self, region: str, body: dict) -> bool:
+        return self._call(region, "create_email_identity", **body)
+
+    def put_email_identity_dkim_signing_attributes(
+        self, region: str, domain: str, body: dict
+    ) -> bool:
+        return self._call(
+            region,
+            "put_email_identity_dkim_signing_attributes",
+            EmailIdentity=domain,
+            **body,
+        )
+
+    def put_email_identity_mail_from_attributes(
+        self, region: str, domain: str, mail_from_domain: str, behavior_on_mx_failure: str
+    ) -> bool:
+        return self._call(
+            region,
+            "put_email_identity_mail_from_attributes",
+            EmailIdentity=domain,
+            MailFromDomain=mail_from_domain,
+            BehaviorOnMxFailure=behavior_on_mx_failure,
+        )
+
+
+class Fake_Backend(SES_Backend):
+    """
+    Keep email identities in memory, for offline use.
+    Every request is recorded in `calls` as `(operation, region, kwargs)`.
+    `get_email_identity` reports `status` for DKIM and MAIL FROM of every identity.
+    """
+
+    name = "fake"
+
+    def __init__(self, status: str = "SUCCESS"):
+        self.identities = {}
+        self.calls = []
+        self.status = status
+        self._lock = Lock()
+
+    def get_email_identity(self, region: str, domain: str):
+        self._record("get_email_identity", region, EmailIdentity=domain)
+        with self._lock:
+            identity = self.identities.get((region, domain))
+            if identity is None:
+                return None
+            response = {
+                "IdentityType": "DOMAIN",
+                "DkimAttributes": {
+                    "Status": self.status,
+                    "SigningAttributesOrigin": "EXTERNAL",
+                },
+            }
+            if identity["MailFromAttributes"] is not None:
+                response["MailFromAttributes"] = dict(
+                    identity["MailFromAttributes"], MailFromDomainStatus=self.status
+                )
+            return response
+
+    def _record(self, operation: str, region: str, **kwargs):
+        with self._lock:
+            self.calls.append((operation, region, kwargs))
+
+    def create_email_identity(self, region: str, body: dict) -> bool:
+        self._record("create_email_identity", region, **body)
+        key = (region, body["EmailIdentity"])
+        with self._lock:
+            if key in self.identities:
+                return False
+            self.identities[key] = {
+                "DkimSigningAttributes": body.get("DkimSigningAttributes"),
+                "MailFromAttributes": None,
+            }
+        return True
+
+    def put_email_identity_dkim_signing_attributes(
+        self, region: str, domain: str, body: dict
+    ) -> bool:
+        self._record(
+            "put_email_identity_dkim_signing_attributes",
+            region,
+            EmailIdentity=domain,
+            **body,
+        )
+        with self._lock:
+            identity = self.identities.get((region, domain))
+            if identity is None:
+                return False
+            identity["DkimSigningAttributes"] = body.get("SigningAttributes")
+        return True
+
+    def put_email_identity_mail_from_attributes(
+        self, region: str, domain: str, mail_from_domain: str, behavior_on_mx_failure: str
+    ) -> bool:
+        self._record(
+            "put_email_identity_mail_from_attributes",
+            region,
+            EmailIdentity=domain,
+            MailFromDomain=mail_from_domain,
+            BehaviorOnMxFailure=behavior_on_mx_failure,
+        )
+        with self._lock:
+            identity = self.identities.get((region, domain))
+            if identity is None:
+                return False
+            identity["MailFromAttributes"] = {
+                "MailFromDomain": mail_from_domain,
+                "BehaviorOnMxFailure": behavior_on_mx_failure,
+            }
+        return True
+
+
+_backend_classes = {cls.name: cls for cls in (AWS_CLI_Backend, SDK_Backend, Fake_Backend)}
+_backends = {}
+_backends_lock = Lock()
+
+
+def get_ses_backend(backend=None) -> SES_Backend:
+    """
+    Return the shared backend by name: "sdk", "cli" or "fake".
+    "auto" or None means "sdk" if `boto3` is installed, otherwise "cli".
+    A `SES_Backend` instance is returned as is.
+    """
+    if isinstance(backend, SES_Backend):
+        return backend
+    name = backend or "auto"
+    if name == "auto":
+        try:
+            import boto3
+        except ImportError:
+            name = "cli"
+        else:
+            name = "sdk"
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = _backend_classes[name]()
+        return _backends[name]
@@ -0,0 +1,298 @@
+"""
+Spreading Cloudflare API requests over several API tokens, each with its own rate limit.
+
+A token name given to the CLI can be a comma separated list of names in
+`CLOUDFLARE_API_TOKEN.json`, or `*` for all of them. Each zone is served by the tokens
+which can see it, every request goes to the eligible token with the most rate limit
+headroom, and a token is set aside when it is throttled or fails to authenticate.
+"""
+
+__all__ = [
+    "auth_error_codes",
+    "is_token_pool",
+    "read_dns_api_tokens",
+    "Token_Pool",
+    "Pooled_Cloudflare_API",
+    "get_cloudflare_api",
+    "get_shared_cloudflare_api",
+    "set_shared_cloudflare_apis",
+]
+
+from threading import Lock
+from .cloudflare_api import (
+    Cloudflare_API,
+    Cloudflare_API_Error,
+    api_token_store,
+    read_dns_api_token,
+    zone_cache,
+)
+from .output import output
+from .rate_limit import Retry_Policy, parse_retry_after
+
+# Cloudflare error codes of invalid tokens (9109, 6003) and missing permissions
+# (10000, 9106)
+auth_error_codes = frozenset((6003, 9106, 9109, 10000))
+_invalid_token_codes = frozenset((6003, 9109))
+
+
+def is_token_pool(token_name: str) -> bool:
+    return type(token_name) is str and (token_name == "*" or "," in token_name)
+
+
+def read_dns_api_tokens(token_name: str) -> dict:
+    """
+    Return a dict of names to tokens of a token name, a comma separated list of names
+    or `*`. Unknown names are left out.
+    """
+    if token_name == "*":
+        return dict(api_token_store.data)
+    names = [name.strip() for name in (token_name or "").split(",") if name.strip()]
+    tokens = {name: read_dns_api_token(name) for name in names}
+    return {name: token for name, token in tokens.items() if token}
+
+
+def _error_codes(response) -> set:
+    try:
+        response_json = response.json() or {}
+    except ValueError:
+        return set()
+    return {entry.get("code") for entry in response_json.get("errors") or ()}
+
+
+class _Token_Member:
+    """
+    One token of a `Token_Pool`, with its own session and token bucket.
+    """
+
+    def __init__(self, name: str, token: str, pool_maxsize: int):
+        self.name = name
+        self.api = Cloudflare_API(token, None, pool_maxsize)
+        # a throttled request is moved to another token instead of waiting
+        self.api.retry_policy = Retry_Policy()
+        self.api.retry_policy.retry_status = Retry_Policy.retry_status - {429}
+        self.in_flight = 0
+        self.disabled = False
+        self.denied_zones = set()
+        self._zone_ids = None
+        self._zones_lock = Lock()
+
+    @property
+    def token(self) -> str:
+        return self.api.token
+
+    def zone_ids(self) -> set:
+        """
+        Return the identifiers of the zones the token can see, listed once and
+        cached like the zones used to resolve domains.
+        """
+        with self._zones_lock:
+            if self._zone_ids is None:
+                zones = zone_cache.zones(self.token)
+                if zones is None:
+                    zones = self.api.list_zones()
+                    zone_cache.store(self.token, zones)
+                self._zone_ids = set(zones.values())
+            return self._zone_ids
+
+
+class Token_Pool:
+    """
+    Tokens sharing the requests of a run. `acquire` returns the eligible token with
+    the most headroom in its token bucket, minus the requests it has in flight.
+    """
+
+    def __init__(self, tokens: dict, pool_maxsize: int = None):
+        assert tokens, "No Cloudflare API token in the pool."
+        pool_maxsize = pool_maxsize or Cloudflare_API.default_pool_maxsize
+        self.members = [
+            _Token_Member(name, token, pool_maxsize) for name, token in tokens.items()
+        ]
+        self._lock = Lock()
+
+    def _can_serve(self, member: _Token_Member, zone_identifier: str) -> bool:
+        if member.disabled or zone_identifier in member.denied_zones:
+            return False
+        if zone_identifier is None:
+            return True
+        try:
+            return zone_identifier in member.zone_ids()
+        except Cloudflare_API_Error as err:
+            if err.response.status_code == 429:
+                # throttled, not set aside, its zones are listed by a later request
+                return False
+            output.error("Token `{}` can't list zones: {}".format(member.name, err))
+            member.disabled = True
+            return False
+
+    def eligible(self, zone_identifier: str, exclude=()) -> list:
+        """
+        Return the members which can serve the zone. If no token lists the zone, e.g.
+        a zone only known from `CLOUDFLARE_ZONE.json`, every usable token is tried.
+        """
+        members = [m for m in self.members if m not in exclude]
+        eligible = [m for m in members if self._can_serve(m, zone_identifier)]
+        if eligible or zone_identifier is None:
+            return eligible
+        if any(zone_identifier in (m._zone_ids or ()) for m in self.members):
+            return []
+        return [
+            m for m in members if not m.disabled and zone_identifier not in m.denied_zones
+        ]
+
+    def acquire(self, zone_identifier: str, exclude=()):
+        """
+        Return the member which should send the next request for the zone, or None.
+        `release` it once the request completes.
+        """
+        members = self.eligible(zone_identifier, exclude)
+        if not members:
+            return None
+        with self._lock:
+            member = max(members, key=lambda m: m.api.bucket.headroom() - m.in_flight)
+            member.in_flight += 1
+        return member
+
+    def release(self, member: _Token_Member):
+        with self._lock:
+            member.in_flight -= 1
+
+    def demote(self, member: _Token_Member, zone_identifier: str, invalid=False):
+        """
+        Stop sending requests for the zone, or any request if `invalid`, to `member`.
+        """
+        if invalid or zone_identifier is None:
+            member.disabled = True
+            output.error("Token `{}` is set aside.".format(member.name))
+        else:
+            member.denied_zones.add(zone_identifier)
+            output.error(
+                "Token `{}` is set aside for zone {}.".format(member.name, zone_identifier)
+            )
+
+    def resolve_zone_id(self, domain: str):
+        for member in self.members:
+            if member.disabled:
+                continue
+            zone_id = member.api.resolve_zone_id(domain)
+            if zone_id:
+                return zone_id
+        return None
+
+    def list_zones(self) -> dict:
+        zones = {}
+        for member in self.members:
+            if not member.disabled:
+                zones.update(member.api.list_zones())
+        return zones
+
+    def close(self):
+        for member in self.members:
+            member.api.close()
+
+
+class Pooled_Cloudflare_API(Cloudflare_API):
+    """
+    `Cloudflare_API` whose requests are sent with the tokens of a `Token_Pool`.
+    """
+
+    def __init__(self, pool: Token_Pool, zone_identifier: str, owns_pool=True):
+        self.pool = pool
+        self.token = None
+        self.zone_identifier = zone_identifier
+        self._owns_pool = owns_pool
+        self.session = None
+        self.bucket = None
+
+    def for_zone(self, zone_identifier: str) -> "Pooled_Cloudflare_API":
+        if zone_identifier == self.zone_identifier:
+            return self
+        return Pooled_Cloudflare_API(self.pool, zone_identifier, owns_pool=False)
+
+    def close(self):
+        if self._owns_pool:
+            self.pool.close()
+
+    def resolve_zone_id(self, domain: str):
+        return self.pool.resolve_zone_id(domain)
+
+    def list_zones(self) -> dict:
+        return self.pool.list_zones()
+
+    def _request(self, method: str, url: str, **kwargs) -> "requests.Response":
+        """
+        Send a request with the eligible token with the most headroom. It is sent
+        again with another token if the token is throttled or fails to authenticate.
+        """
+        tried = set()
+        response = None
+        attempts = self.retry_policy.max_retries + len(self.pool.members)
+        for _ in range(attempts):
+            member = self.pool.acquire(self.zone_identifier, exclude=tried)
+            if member is None:
+                if response is not None and response.status_code == 429 and tried:
+                    # every token is throttled, wait for the one which recovers first
+                    tried.clear()
+                    continue
+                break
+            try:
+                response = member.api._request(method, url, **kwargs)
+            finally:
+                self.pool.release(member)
+            status_code = response.status_code
+            if status_code == 429:
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                member.api.bucket.pause(self.retry_policy.delay(0, retry_after))
+                self.counters.incr("retried")
+                tried.add(member)
+                continue
+            codes = _error_codes(response) if status_code in (400, 401, 403) else set()
+            if status_code in (401, 403) or codes & auth_error_codes:
+                invalid = status_code == 401 or bool(codes & _invalid_token_codes)
+                self.pool.demote(member, self.zone_identifier, invalid)
+                tried.add(member)
+                continue
+            return response
+        assert response is not None, "No Cloudflare API token can access zone {}.".format(
+            self.zone_identifier
+        )
+        return response
+
+
+def get_cloudflare_api(
+    token_name: str, zone_identifier: str = None, pool_maxsize: int = None
+) -> Cloudflare_API:
+    """
+    Return a `Cloudflare_API` for a token name, pooled if it names several tokens,
+    or None if no token is found.
+    """
+    if is_token_pool(token_name):
+        tokens = read_dns_api_tokens(token_name)
+        if not tokens:
+            return None
+        return Pooled_Cloudflare_API(Token_Pool(tokens, pool_maxsize), zone_identifier)
+    token = read_dns_api_token(token_name)
+    if not token:
+        return None
+    return Cloudflare_API(token, zone_identifier, pool_maxsize)
+
+
+_shared_apis = None
+
+
+def get_shared_cloudflare_api(token_name: str):
+    """
+    Return the `Cloudflare_API` of `token_name` kept open by a long-running service,
+    or None.
+    """
+    apis = _shared_apis
+    if apis is None or token_name is None:
+        return None
+    return apis.get(token_name)
+
+
+def set_shared_cloudflare_apis(apis):
+    """
+    `apis` has `get(token_name)`, e.g. the per token name cache of `fleet`.
+    """
+    global _shared_apis
+    _shared_apis = apis
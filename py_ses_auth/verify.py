@@ -0,0 +1,320 @@
+"""
+Polling DNS propagation of the records of domains and their verification status in
+AWS SES until they converge, it requires the module `dnspython`.
+"""
+
+__all__ = [
+    "Backoff",
+    "DNS_Checker",
+    "parse_nameservers",
+    "verify_checks",
+    "verify_domain",
+    "verify_fleet",
+]
+
+from pathlib import Path
+import asyncio
+import random
+from . import domain_dns_payloads
+from .metrics import metrics
+from .output import output
+from .plan import normalize_record
+from .profiling import profiler
+from .ses_backend import get_ses_backend
+
+
+class Backoff:
+    """
+    Adaptive exponential backoff of the polls of one domain: the delay goes back to
+    `base_delay` after a poll which verified something, and is multiplied by `factor`
+    (up to `max_delay`) after a poll which didn't.
+    """
+
+    def __init__(self, base_delay: float = 5, max_delay: float = 120, factor: float = 2):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.delay = base_delay
+
+    def next(self, progressed: bool) -> float:
+        if progressed:
+            self.delay = self.base_delay
+        else:
+            self.delay = min(self.max_delay, self.delay * self.factor)
+        return random.uniform(self.delay / 2, self.delay)
+
+
+def parse_nameservers(nameservers) -> tuple:
+    """
+    Return `(addresses, ports)` of nameservers given as `address`, `address:port` or
+    `[IPv6 address]:port`.
+    """
+    addresses = []
+    ports = {}
+    for nameserver in nameservers or ():
+        address, port = nameserver, None
+        if nameserver.startswith("["):
+            address, _, port = nameserver[1:].partition("]")
+            port = port.lstrip(":")
+        elif nameserver.count(":") == 1:
+            address, port = nameserver.split(":")
+        addresses.append(address)
+        if port:
+            ports[address] = int(port)
+    return addresses, ports
+
+
+class DNS_Checker:
+    """
+    Resolve records through an async resolver, with at most `concurrency` queries
+    (i.e. sockets) in flight. The nameservers of the system are used if `nameservers`
+    is empty.
+    """
+
+    def __init__(self, nameservers=None, concurrency: int = 256, timeout: float = 5):
+        import dns.asyncresolver
+
+        addresses, ports = parse_nameservers(nameservers)
+        self.resolver = dns.asyncresolver.Resolver(configure=not addresses)
+        if addresses:
+            self.resolver.nameservers = addresses
+            self.resolver.nameserver_ports = ports
+        self.resolver.lifetime = timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def lookup(self, record_type: str, name: str) -> set:
+        """
+        Return the records of `record_type` at `name` as `normalize_record` tuples.
+        """
+        import dns.exception
+        import dns.resolver
+
+        async with self._semaphore:
+            with metrics.span("dns_lookup", type=record_type):
+                try:
+                    answer = await self.resolver.resolve(
+                        name, record_type, raise_on_no_answer=False
+                    )
+                except (dns.resolver.NXDOMAIN, dns.resolver.NoNameservers):
+                    return set()
+                except dns.exception.Timeout:
+                    return None
+        records = set()
+        for rdata in answer.rrset or ():
+            record = {"type": record_type, "name": name}
+            if record_type == "TXT":
+                record["content"] = b"".join(rdata.strings).decode()
+            elif record_type == "MX":
+                record["content"] = rdata.exchange.to_text()
+                record["priority"] = rdata.preference
+            else:
+                record["content"] = rdata.to_text()
+            records.add(normalize_record(record))
+        return records
+
+
+def _dns_check(dns_checker: DNS_Checker, record_type: str, name: str, expected: set):
+    async def check() -> tuple:
+        found = await dns_checker.lookup(record_type, name)
+        if found is None:
+            return False, "timeout"
+        if expected <= found:
+            return True, "ok"
+        return False, "mismatch" if found else "missing"
+
+    return check
+
+
+def _ses_check(ses_status, region: str, domain: str, attributes: dict):
+    """
+    `attributes` maps names to `(key, status_key)` of statuses in the response of
+    `GetEmailIdentity` which must all be "SUCCESS".
+    """
+
+    async def check() -> tuple:
+        response = await ses_status(region, domain)
+        if response is None:
+            return False, "unknown"
+        statuses = {
+            name: (response.get(key) or {}).get(status_key) or "NOT_STARTED"
+            for name, (key, status_key) in attributes.items()
+        }
+        verified = all(status == "SUCCESS" for status in statuses.values())
+        return verified, " ".join("{}={}".format(*item) for item in statuses.items())
+
+    return check
+
+
+def verify_checks(
+    path_src: Path,
+    row: dict,
+    dns_checker: DNS_Checker,
+    ses_status=None,
+    public_key: str = None,
+) -> dict:
+    """
+    Return a dict of names to checks of the domain of a manifest row, a check is an
+    async function returning `(verified, status)`.
+    DNS checks compare the records of `domain_dns_payloads` with the resolved ones.
+    If `ses_status` is given as `async ses_status(region, domain)`, the DKIM (if the
+    row has a selector) and MAIL FROM (if it has a subdomain) status of the SES
+    identity is checked too.
+    """
+    domain = row["domain"]
+    region = row.get("region")
+    payloads = domain_dns_payloads(
+        path_src,
+        domain,
+        region,
+        row.get("selector"),
+        row.get("subdomain"),
+        row.get("local_part"),
+        public_key,
+    )
+    expected = {}
+    for payload in payloads:
+        record = normalize_record(payload)
+        expected.setdefault(record[:2], set()).add(record)
+
+    checks = {}
+    for (record_type, name), records in expected.items():
+        checks["dns {} {}".format(record_type, name)] = _dns_check(
+            dns_checker, record_type, name, records
+        )
+    attributes = {}
+    if row.get("selector"):
+        attributes["dkim"] = ("DkimAttributes", "Status")
+    if row.get("subdomain"):
+        attributes["mail_from"] = ("MailFromAttributes", "MailFromDomainStatus")
+    if ses_status is not None and attributes:
+        checks["ses {}".format(region)] = _ses_check(ses_status, region, domain, attributes)
+    return checks
+
+
+async def verify_domain(domain: str, checks: dict, backoff: Backoff, deadline: float):
+    """
+    Poll `checks` until all of them are verified or the loop time passes `deadline`.
+    Each poll only runs the checks which are not verified yet.
+    Return a dict contains `domain`, `success`, the first unverified check as
+    `failed_step`, `attempts` and the last `status` of every check.
+    """
+    loop = asyncio.get_running_loop()
+    result = {
+        "domain": domain,
+        "success": False,
+        "failed_step": None,
+        "error": None,
+        "attempts": 0,
+        "status": {},
+    }
+    pending = dict(checks)
+    while True:
+        result["attempts"] += 1
+        names = list(pending)
+        outcomes = await asyncio.gather(*(pending[name]() for name in names))
+        progressed = False
+        for name, (verified, status) in zip(names, outcomes):
+            result["status"][name] = status
+            if verified:
+                del pending[name]
+                progressed = True
+        if not pending:
+            result["success"] = True
+            output.info("verified {}".format(domain), domain=domain)
+            return result
+        delay = backoff.next(progressed)
+        if loop.time() + delay > deadline:
+            name = next(iter(pending))
+            result["failed_step"] = "{} ({})".format(name, result["status"][name])
+            return result
+        await asyncio.sleep(delay)
+
+
+async def _verify_rows(
+    path_cwd: Path,
+    rows,
+    nameservers,
+    timeout: float,
+    concurrency: int,
+    ses_backend,
+    ses_workers: int,
+    base_delay: float,
+    max_delay: float,
+) -> list:
+    from concurrent.futures import ThreadPoolExecutor
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    dns_checker = DNS_Checker(nameservers, concurrency)
+    executor = None
+    ses_status = None
+    if ses_backend is not False:
+        backend = get_ses_backend(ses_backend)
+        executor = ThreadPoolExecutor(max_workers=ses_workers)
+
+        async def ses_status(region: str, domain: str):
+            with metrics.span("ses_status"):
+                return await loop.run_in_executor(
+                    executor, backend.get_email_identity, region, domain
+                )
+
+    async def verify_row(row: dict) -> dict:
+        # an error only fails the domain it happens in, not the whole `gather`
+        try:
+            # polling domains interleave in the event loop, only this part is profiled
+            # per domain
+            with profiler.step(row["domain"]):
+                checks = verify_checks(
+                    path_cwd / row["domain"], row, dns_checker, ses_status
+                )
+            return await verify_domain(
+                row["domain"], checks, Backoff(base_delay, max_delay), deadline
+            )
+        except Exception as err:
+            error = "{}: {}".format(type(err).__name__, err)
+            output.error(error, domain=row["domain"])
+            return {
+                "domain": row["domain"],
+                "success": False,
+                "failed_step": None,
+                "error": error,
+            }
+
+    try:
+        return await asyncio.gather(*map(verify_row, rows))
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+def verify_fleet(
+    path_cwd: Path,
+    rows,
+    nameservers=None,
+    timeout: float = 900,
+    concurrency: int = 256,
+    ses_backend=None,
+    ses_workers: int = 8,
+    base_delay: float = 5,
+    max_delay: float = 120,
+) -> list:
+    """
+    Poll DNS records and SES verification of every domain of `rows` concurrently in
+    one event loop, until each domain converges or `timeout` seconds pass.
+    DNS queries are bounded by `concurrency`, SES requests by `ses_workers` threads.
+    `ses_backend=False` only checks DNS records.
+    Return the list of results of `verify_domain`.
+    """
+    return asyncio.run(
+        _verify_rows(
+            path_cwd,
+            rows,
+            nameservers,
+            timeout,
+            concurrency,
+            ses_backend,
+            ses_workers,
+            base_delay,
+            max_delay,
+        )
+    )
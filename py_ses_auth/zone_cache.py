@@ -0,0 +1,134 @@
+"""
+Persistent cache of Cloudflare zones for resolving zone identifiers of domains.
+"""
+
+__all__ = ["domain_suffixes", "Zone_Cache"]
+
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+import json
+import os
+import time
+
+
+def domain_suffixes(domain: str):
+    """
+    Yield `domain` and its parent domains, longest first, without the TLD.
+    """
+    labels = domain.lower().rstrip(".").split(".")
+    for i in range(max(len(labels) - 1, 1)):
+        yield ".".join(labels[i:])
+
+
+class Zone_Cache:
+    """
+    Zone names and identifiers visible to each API token, stored in a JSON file.
+
+    Entries expire after `ttl` seconds. When the cache is saved, expired entries are
+    dropped and only the `max_entries` most recently used tokens are kept.
+    Tokens are stored as hashes.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        ttl: float = 86400,
+        max_entries: int = 32,
+        min_refresh_interval: float = 60,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.min_refresh_interval = min_refresh_interval
+        self._entries = None
+        self._lock = Lock()
+        self._token_locks = {}
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return sha256(token.encode()).hexdigest()[:32]
+
+    def _load(self) -> dict:
+        if self._entries is None:
+            try:
+                with self.path.open("r") as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        now = time.time()
+        entries = {
+            k: v for k, v in self._entries.items() if now - v["fetched_at"] < self.ttl
+        }
+        keep = sorted(entries, key=lambda k: entries[k]["used_at"], reverse=True)
+        self._entries = {k: entries[k] for k in keep[: self.max_entries]}
+        path_tmp = self.path.with_name("{}.{}.tmp".format(self.path.name, os.getpid()))
+        try:
+            with path_tmp.open("w") as f:
+                json.dump(self._entries, f)
+            os.replace(path_tmp, self.path)
+        except OSError:
+            # the cache is optional, e.g. the directory may be read-only or full
+            if path_tmp.exists():
+                path_tmp.unlink()
+
+    def _token_lock(self, key: str) -> Lock:
+        with self._lock:
+            return self._token_locks.setdefault(key, Lock())
+
+    def _entry(self, token: str):
+        with self._lock:
+            entry = self._load().get(self._key(token))
+            if entry is None or time.time() - entry["fetched_at"] >= self.ttl:
+                return None
+            entry["used_at"] = time.time()
+            return entry
+
+    def zones(self, token: str):
+        """
+        Return the cached dict of zone names to identifiers for `token`, or None
+        if it is missing or expired.
+        """
+        entry = self._entry(token)
+        return None if entry is None else entry["zones"]
+
+    def store(self, token: str, zones: dict):
+        with self._lock:
+            now = time.time()
+            self._load()[self._key(token)] = {
+                "fetched_at": now,
+                "used_at": now,
+                "zones": zones,
+            }
+            self._save()
+
+    def resolve(self, domain: str, token: str, fetch_zones):
+        """
+        Return the identifier of the zone which is the longest suffix of `domain`.
+        `fetch_zones()` is called to list all the zones of `token` if the cache is
+        missing, expired, or older than `min_refresh_interval` and has no match.
+        """
+        key = self._key(token)
+        with self._token_lock(key):
+            entry = self._entry(token)
+            if entry is not None:
+                zone_id = self._match(entry["zones"], domain)
+                fresh = time.time() - entry["fetched_at"] < self.min_refresh_interval
+                if zone_id or fresh:
+                    return zone_id
+
+            zones = fetch_zones()
+            if zones is None:
+                return None
+            self.store(token, zones)
+            return self._match(zones, domain)
+
+    @staticmethod
+    def _match(zones: dict, domain: str):
+        for name in domain_suffixes(domain):
+            if name in zones:
+                return zones[name]
+        return None
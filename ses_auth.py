@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+from contextlib import contextmanager
 from pathlib import Path
 from py_ses_auth import (
     __version__,
@@ -10,6 +11,11 @@ from py_ses_auth import (
     create_dmarc_dns_record,
 )
 from py_ses_auth.cli import CLI, arg_meta
+from py_ses_auth.journal import Job_Journal, get_journal, set_journal
+from py_ses_auth.output import output
+from py_ses_auth.record_index import Record_Index, set_record_index
+from py_ses_auth.scheduler import Step_Graph, run_graph
+from py_ses_auth.record_log import close_record_log, close_record_logs
 
 path_cwd = Path.cwd()
 
@@ -30,6 +36,63 @@ _ses_auth = CLI(
     ),
 )
 
+_ses_auth.add_argument(
+    "--journal",
+    metavar="PATH",
+    help="SQLite journal of completed steps. Steps already completed in it are skipped, "
+    "so an interrupted run can be resumed by running the same command again.",
+)
+
+
+@_ses_auth.handler_context
+@contextmanager
+def _journal_context(ns):
+    if ns.journal is None:
+        yield
+        return
+    with Job_Journal(Path(ns.journal)) as journal:
+        set_journal(journal)
+        try:
+            yield
+        finally:
+            set_journal(None)
+
+
+_ses_auth.add_argument(
+    "--record_index",
+    metavar="PATH",
+    help="SQLite mirror of the DNS records of zones. Zones are listed once, then only "
+    "their modified records are, and records created by the CLI are added to it.",
+)
+
+
+@_ses_auth.handler_context
+@contextmanager
+def _record_index_context(ns):
+    if ns.record_index is None:
+        yield
+        return
+    with Record_Index(Path(ns.record_index)) as record_index:
+        set_record_index(record_index)
+        try:
+            yield
+        finally:
+            set_record_index(None)
+
+
+@_ses_auth.handler_context
+@contextmanager
+def _record_log_context(ns):
+    # compact the record log of a single domain within the command, so that its
+    # compaction is timed by `--metrics`
+    try:
+        yield
+    finally:
+        domain = getattr(ns, "domain", None)
+        if type(domain) is str:
+            close_record_log(path_cwd / domain)
+
+
 _ses_auth.register_argument_group(
     "Common arguments",
     list_of_arg_conf=[
@@ -37,7 +100,8 @@ _ses_auth.register_argument_group(
         arg_meta("--region", help="Which AWS region you use."),
         arg_meta(
             "--token_name",
-            help="Which name of Cloudflare API token  listed in `CLOUDFLARE_API_TOKEN.json` you would use.",
+            help="Which name of Cloudflare API token  listed in `CLOUDFLARE_API_TOKEN.json` you would use. "
+            "Several names separated by commas, or `*` for all, spread requests over those tokens.",
         ),
         arg_meta(
             "--aws_only",
@@ -47,8 +111,22 @@ _ses_auth.register_argument_group(
     ],
 )
 
+_ses_auth.register_argument_group(
+    "AWS SES backend arguments",
+    list_of_arg_conf=[
+        arg_meta(
+            "--ses_backend",
+            help="How to call AWS SES: `sdk` (boto3, in process), `cli` (AWS CLI) "
+            "or `auto` (`sdk` if boto3 is installed). Default is `auto`.",
+            choices=("auto", "sdk", "cli"),
+            default="auto",
+        ),
+    ],
+)
+
 
 @_ses_auth.arg_group("Common arguments")
+@_ses_auth.arg_group("AWS SES backend arguments")
 @_ses_auth.sub_command_arg(
     "--selector",
     help="Unique name used in DNS TXT record name to identify the public key.",
@@ -69,6 +147,8 @@ def byodkim(ns):
 
     token_name = ns.token_name
     selector = ns.selector
+    # the TXT record and the SES identity don't depend on each other
+    graph = Step_Graph()
     if not ns.aws_only:
         assert (
             type(token_name) is str
@@ -76,18 +156,36 @@ def byodkim(ns):
         assert (
             type(selector) is str
         ), "Please use `--selector` to specify `DomainSigningSelector`."
-        success = create_byodkim_dns_record(path_src, domain, token_name, selector)
-        if not success:
-            return
+        graph.add(
+            "byodkim_dns",
+            lambda: create_byodkim_dns_record(path_src, domain, token_name, selector),
+        )
 
     region = ns.region
     assert type(region) is str, "Please use `--region` to specify the AWS region."
-    aws_ses_create_email_identity(
-        path_src, domain, ns.region, selector, is_new=(not ns.exist)
+    graph.add(
+        "ses_identity",
+        lambda: aws_ses_create_email_identity(
+            path_src,
+            domain,
+            region,
+            selector,
+            is_new=(not ns.exist),
+            ses_backend=ns.ses_backend,
+        ),
     )
+    return _run_graph(graph)
+
+
+def _run_graph(graph: Step_Graph):
+    result = run_graph(graph)
+    if result["error"]:
+        output.error(result["error"])
+    return result
 
 
 @_ses_auth.arg_group("Common arguments")
+@_ses_auth.arg_group("AWS SES backend arguments")
 @_ses_auth.sub_command_arg(
     "subdomain",
     help="The name of 'Mail From' subdomain you would use. Not need the domain name as suffix.",
@@ -111,13 +209,26 @@ def mail_from_domain(ns):
     region = ns.region
     assert type(region) is str, "Please use `--region` to specify the AWS region."
     subdomain = ns.subdomain
-    aws_set_mail_from_domain(domain, region, subdomain, ns.reject)
+    # the MAIL FROM attributes and the DNS records don't depend on each other
+    graph = Step_Graph()
+    graph.add(
+        "mail_from_attributes",
+        lambda: aws_set_mail_from_domain(
+            domain, region, subdomain, ns.reject, ns.ses_backend
+        ),
+    )
     if not ns.aws_only:
         token_name = ns.token_name
         assert (
             type(token_name) is str
         ), "Please use `--token_name` to specify the token name which is in `CLOUDFLARE_API_TOKEN.json`."
-        create_mail_from_dns_record(path_src, domain, region, token_name, subdomain)
+        graph.add(
+            "mail_from_dns",
+            lambda: create_mail_from_dns_record(
+                path_src, domain, region, token_name, subdomain
+            ),
+        )
+    return _run_graph(graph)
 
 
 @_ses_auth.arg_group("Common arguments")
@@ -141,7 +252,7 @@ def inbound_smtp(ns):
         type(token_name) is str
     ), "Please use `--token_name` to specify the token name which is in `CLOUDFLARE_API_TOKEN.json`."
 
-    create_inbound_mx_dns_record(path_src, domain, region, token_name, ns.subdomain)
+    return create_inbound_mx_dns_record(path_src, domain, region, token_name, ns.subdomain)
 
 
 @_ses_auth.arg_group("Common arguments")
@@ -167,14 +278,404 @@ def dmarc(ns):
         type(token_name) is str
     ), "Please use `--token_name` to specify the token name which is in `CLOUDFLARE_API_TOKEN.json`."
 
-    create_dmarc_dns_record(path_src, domain, token_name, ns.local_part, ns.subdomain)
+    return create_dmarc_dns_record(
+        path_src, domain, token_name, ns.local_part, ns.subdomain
+    )
+
+
+@_ses_auth.sub_command_arg(
+    "domain",
+    nargs="+",
+    help="Which domain names you want to generate DKIM key pairs for.",
+)
+@_ses_auth.sub_command_arg(
+    "--key_size",
+    help="RSA key size in bits. Default is 2048.",
+    type=int,
+    choices=(1024, 2048),
+    default=2048,
+)
+@_ses_auth.sub_command_arg(
+    "--workers",
+    help="Number of processes generating key pairs. Default is the number of CPUs.",
+    type=int,
+)
+@_ses_auth.sub_command_arg(
+    "--overwrite",
+    help="Replace existing key pairs.",
+    action="store_true",
+)
+@_ses_auth.sub_command(
+    help="Generating DKIM key pairs for BYODKIM.",
+    description="Generating `private.key` and `public.key` in the directory named as "
+    "each domain name, instead of running `openssl`.",
+)
+def keygen(ns):
+    from py_ses_auth.keygen import keygen_domains
+
+    assert ns.workers is None or ns.workers > 0, "`--workers` must be positive."
+    _assert_cryptography()
+    public_keys = keygen_domains(path_cwd, ns.domain, ns.key_size, ns.workers, ns.overwrite)
+    for domain in ns.domain:
+        if domain in public_keys:
+            output.info("generate key pair of {}".format(domain), domain=domain)
+        else:
+            output.info("skip {}, key pair exists.".format(domain), domain=domain)
+
+
+def _assert_cryptography():
+    try:
+        import cryptography
+    except ImportError:
+        assert False, "Please install Python module `cryptography` to generate key pairs."
+
+
+_ses_auth.register_argument_group(
+    "Manifest arguments",
+    list_of_arg_conf=[
+        arg_meta(
+            "manifest",
+            help="CSV (with header) or JSONL file, gzipped if it ends with `.gz`, with "
+            "columns `domain`, `region`, `selector`, `token_name`, `subdomain` and "
+            "`local_part`. It is read as domains are processed.",
+        ),
+        arg_meta(
+            "--workers",
+            help="Number of domains processed concurrently. Default is 8.",
+            type=int,
+            default=8,
+        ),
+        arg_meta("--region", help="Default AWS region for rows which don't specify it."),
+        arg_meta(
+            "--token_name",
+            help="Default Cloudflare API token name for rows which don't specify it. "
+            "Several names separated by commas, or `*` for all, spread requests over those tokens.",
+        ),
+        arg_meta(
+            "--selector", help="Default DKIM selector for rows which don't specify it."
+        ),
+        arg_meta(
+            "--subdomain",
+            help="Default 'Mail From' subdomain name for rows which don't specify it.",
+        ),
+        arg_meta(
+            "--local_part",
+            help="Default Local-part of DMARC report email for rows which don't specify it.",
+        ),
+    ],
+)
+
+
+def _read_manifest_rows(ns):
+    from py_ses_auth.fleet import read_manifest
+
+    path_manifest = Path(ns.manifest)
+    assert path_manifest.exists(), "`{}` don't exist.".format(path_manifest)
+    assert ns.workers > 0, "`--workers` must be positive."
+
+    defaults = dict(
+        region=ns.region,
+        selector=ns.selector,
+        token_name=ns.token_name,
+        subdomain=ns.subdomain,
+        local_part=ns.local_part,
+    )
+    return read_manifest(path_manifest, defaults)
+
+
+def _print_fleet_report(ns, results):
+    from py_ses_auth.fleet import Fleet_Report, print_report
+
+    with Fleet_Report(ns.report and Path(ns.report)) as report:
+        report.extend(results)
+    print_report(report)
+
+
+@_ses_auth.arg_group("Manifest arguments")
+@_ses_auth.arg_group("AWS SES backend arguments")
+@_ses_auth.sub_command_arg(
+    "--batch",
+    help="Create all DNS records of a domain in one request, by the DNS records batch "
+    "endpoint (`records`) or the zone import endpoint (`import`).",
+    choices=("records", "import"),
+)
+@_ses_auth.sub_command_arg(
+    "--keygen",
+    help="Generate key pairs of this size (1024 or 2048) for domains which have none, "
+    "before onboarding.",
+    type=int,
+    choices=(1024, 2048),
+)
+@_ses_auth.sub_command_arg(
+    "--report",
+    help="JSONL (if it ends with `.jsonl`) or CSV file, gzipped if it ends with `.gz`, "
+    "which the result of each domain is written to as it completes. "
+    "Only failed domains are printed then.",
+)
+@_ses_auth.sub_command(
+    help="Onboarding many domains listed in a manifest.",
+    description="Running BYODKIM, 'Mail From' domain, inbound SMTP and DMARC set up "
+    "for every domain of a manifest through a bounded worker pool.",
+)
+def fleet(ns):
+    from py_ses_auth.fleet import iter_onboard_fleet
+
+    if ns.keygen:
+        _assert_cryptography()
+    rows = _read_manifest_rows(ns)
+    _print_fleet_report(
+        ns,
+        iter_onboard_fleet(path_cwd, rows, ns.workers, ns.batch, ns.ses_backend, ns.keygen),
+    )
+
+
+@_ses_auth.arg_group("Manifest arguments")
+@_ses_auth.sub_command_arg(
+    "--report",
+    help="JSONL (if it ends with `.jsonl`) or CSV file, gzipped if it ends with `.gz`, "
+    "which the result of each domain is written to as it completes. "
+    "Only failed domains are printed then.",
+)
+@_ses_auth.sub_command(
+    help="Showing which DNS records of domains in a manifest would be created or updated.",
+    description="Diffing the DNS records of every domain of a manifest against "
+    "the live zone, without any change.",
+)
+def plan(ns):
+    from py_ses_auth.fleet import iter_plan_fleet
+
+    rows = _read_manifest_rows(ns)
+    _print_fleet_report(ns, iter_plan_fleet(path_cwd, rows, ns.workers))
+
+
+@_ses_auth.arg_group("Manifest arguments")
+@_ses_auth.sub_command_arg(
+    "--report",
+    help="JSONL (if it ends with `.jsonl`) or CSV file, gzipped if it ends with `.gz`, "
+    "which the result of each domain is written to as it completes. "
+    "Only failed domains are printed then.",
+)
+@_ses_auth.sub_command(
+    help="Creating or updating only the DNS records which differ from the live zone.",
+    description="Diffing the DNS records of every domain of a manifest against "
+    "the live zone, then applying only the differences.",
+)
+def apply(ns):
+    from py_ses_auth.fleet import iter_plan_fleet
+
+    rows = _read_manifest_rows(ns)
+    _print_fleet_report(ns, iter_plan_fleet(path_cwd, rows, ns.workers, apply=True))
+
+
+@_ses_auth.arg_group("Manifest arguments")
+@_ses_auth.sub_command_arg(
+    "--nameserver",
+    help="Nameserver to query, as `address` or `address:port`, can be repeated. "
+    "Default is the nameservers of the system.",
+    action="append",
+)
+@_ses_auth.sub_command_arg(
+    "--timeout",
+    help="Seconds to keep polling domains which haven't converged. Default is 900.",
+    type=float,
+    default=900,
+)
+@_ses_auth.sub_command_arg(
+    "--concurrency",
+    help="Maximum number of DNS queries in flight. Default is 256.",
+    type=int,
+    default=256,
+)
+@_ses_auth.arg_group("AWS SES backend arguments")
+@_ses_auth.sub_command_arg(
+    "--dns_only",
+    help="Only check DNS records, not the verification status in AWS SES.",
+    action="store_true",
+)
+@_ses_auth.sub_command(
+    help="Polling DNS propagation and AWS SES verification of domains in a manifest.",
+    description="Resolving the DNS records of every domain of a manifest and querying "
+    "its AWS SES identity, with backoff, until each domain converges.",
+)
+def verify(ns):
+    try:
+        import dns
+    except ImportError:
+        assert False, "Please install Python module `dnspython` to verify domains."
+    from py_ses_auth.fleet import print_summary
+    from py_ses_auth.verify import verify_fleet
+
+    assert ns.concurrency > 0, "`--concurrency` must be positive."
+    rows = _read_manifest_rows(ns)
+    results = verify_fleet(
+        path_cwd,
+        rows,
+        ns.nameserver,
+        ns.timeout,
+        ns.concurrency,
+        False if ns.dns_only else ns.ses_backend,
+        ns.workers,
+    )
+    print_summary(results)
+
+
+@_ses_auth.arg_group("Manifest arguments")
+@_ses_auth.sub_command_arg(
+    "--old_selector",
+    help="Selector to retire, for domains whose current selector isn't in the journal.",
+)
+@_ses_auth.sub_command_arg(
+    "--grace",
+    help="Hours to keep the TXT records of old selectors after switching AWS SES to "
+    "the new selector. Default is 72.",
+    type=float,
+    default=72,
+)
+@_ses_auth.sub_command_arg(
+    "--window",
+    help="Seconds this run may take, domains not done yet are resumed by the next "
+    "run. Default is 900.",
+    type=float,
+    default=900,
+)
+@_ses_auth.sub_command_arg(
+    "--key_size",
+    help="RSA key size in bits of the new key pairs. Default is 2048.",
+    type=int,
+    choices=(1024, 2048),
+    default=2048,
+)
+@_ses_auth.sub_command_arg(
+    "--nameserver",
+    help="Nameserver to query, as `address` or `address:port`, can be repeated. "
+    "Default is the nameservers of the system.",
+    action="append",
+)
+@_ses_auth.sub_command_arg(
+    "--concurrency",
+    help="Maximum number of DNS queries in flight. Default is 256.",
+    type=int,
+    default=256,
+)
+@_ses_auth.arg_group("AWS SES backend arguments")
+@_ses_auth.sub_command(
+    help="Rotating the BYODKIM keys of domains in a manifest to a new selector.",
+    description="Publishing the TXT record of a new key pair for the `selector` of "
+    "every domain of a manifest, switching AWS SES to it once the record resolves, "
+    "and deleting the records of the old selectors after a grace period. "
+    "Progress is kept in the `--journal`, run the command again to resume.",
+)
+def rotate(ns):
+    try:
+        import dns
+    except ImportError:
+        assert False, "Please install Python module `dnspython` to rotate keys."
+    from py_ses_auth.rotation import print_rotation_summary, rotate_fleet
+
+    journal = get_journal()
+    assert journal is not None, "Please use `--journal` to keep track of the rotation."
+    assert ns.concurrency > 0, "`--concurrency` must be positive."
+    assert ns.grace >= 0, "`--grace` can't be negative."
+    _assert_cryptography()
+    rows = _read_manifest_rows(ns)
+    results = rotate_fleet(
+        path_cwd,
+        rows,
+        journal,
+        ns.workers,
+        ns.key_size,
+        ns.grace * 3600,
+        ns.window,
+        ns.nameserver,
+        ns.concurrency,
+        ns.ses_backend,
+        ns.old_selector,
+    )
+    print_rotation_summary(results)
+
+
+@_ses_auth.arg_group("Manifest arguments")
+@_ses_auth.sub_command_arg(
+    "--output",
+    help="JSONL file which drift is written to. Default is `drift.jsonl`.",
+    default="drift.jsonl",
+)
+@_ses_auth.sub_command(
+    help="Finding drift between the DNS records of domains in a manifest and their zones.",
+    description="Listing each zone once and comparing it with the DNS records the CLI "
+    "would create and the records logged in `dns_record_info.json`, without any change.",
+)
+def audit(ns):
+    from py_ses_auth.audit import iter_audit_fleet
+    from py_ses_auth.fleet import Fleet_Report, print_report
+
+    rows = _read_manifest_rows(ns)
+    drifts = 0
+    report = Fleet_Report()
+    with Path(ns.output).open("w", encoding="utf-8") as drift_file:
+        for result in iter_audit_fleet(path_cwd, rows, drift_file, ns.workers):
+            drifts += result["drifts"]
+            report.add(result)
+    print_report(report)
+    output.result("{} drift(s) written to `{}`.".format(drifts, ns.output))
+
+
+@_ses_auth.sub_command_arg(
+    "--listen",
+    help="`host:port`, or the path of a Unix socket, the API listens on. "
+    "Default is `127.0.0.1:8087`.",
+    default="127.0.0.1:8087",
+)
+@_ses_auth.sub_command_arg(
+    "--allow_remote",
+    help="Listen on a `--listen` host which isn't a loopback address. The API has no "
+    "authentication, anyone who reaches it runs jobs with the tokens of this host.",
+    action="store_true",
+)
+@_ses_auth.sub_command_arg(
+    "--workers",
+    help="Number of jobs run at once. Default is 8.",
+    type=int,
+    default=8,
+)
+@_ses_auth.sub_command(
+    help="Running a service which queues `byodkim`, `mail_from_domain`, `inbound_smtp` "
+    "and `dmarc` jobs through a local HTTP API.",
+    description="Running sub commands posted to `/jobs` on a pool of workers in one "
+    "process, which keeps Cloudflare sessions, AWS SES clients and zone caches open "
+    "between jobs. The output of a job is streamed by `/jobs/<id>/stream`.",
+)
+def serve(ns):
+    import signal
+    import threading
+    from py_ses_auth.service import Onboarding_Service, start_server
+
+    assert ns.workers > 0, "`--workers` must be positive."
+
+    service = Onboarding_Service(_ses_auth, ns.workers)
+    server = start_server(service, ns.listen, ns.allow_remote)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(
+            signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start()
+        )
+    service.start()
+    output.info("Listening on {}".format(ns.listen))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
 
 
 def main():
     try:
         _ses_auth.handle_args()
     except AssertionError as err:
-        print(err.args[0])
+        output.error(err.args[0])
+    finally:
+        close_record_logs()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,80 @@
+from pathlib import Path
+import json
+import sys
+import pytest
+
+path_repo = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(path_repo))
+sys.path.insert(0, str(path_repo / "benchmarks"))
+
+from py_ses_auth import cloudflare_api, rate_limit, token_pool
+from py_ses_auth.cloudflare_api import Cloudflare_API
+from py_ses_auth.cloudflare_async import Async_Cloudflare_API
+from py_ses_auth.config_store import Config_Store
+from py_ses_auth.rate_limit import Retry_Policy, counters
+from py_ses_auth.zone_cache import Zone_Cache
+
+
+@pytest.fixture
+def mock_cloudflare(monkeypatch):
+    """
+    A `Mock_Cloudflare` served in process, with `Cloudflare_API` pointed at it, short
+    retry delays and new token buckets. Yield `(mock, endpoint)`.
+    """
+    from mock_cloudflare import Mock_Cloudflare, start_in_process
+
+    mock = Mock_Cloudflare({"example.com": "zone-1", "example.org": "zone-2"})
+    server = start_in_process(mock)
+    endpoint = "http://127.0.0.1:{}/client/v4/".format(server.server_port)
+    monkeypatch.setattr(Cloudflare_API, "endpoint", endpoint)
+    monkeypatch.setattr(Async_Cloudflare_API, "endpoint", endpoint)
+    monkeypatch.setattr(Cloudflare_API, "retry_policy", Retry_Policy(base_delay=0.01))
+    # token buckets start full in every test
+    monkeypatch.setattr(rate_limit, "_buckets", {})
+    counters.reset()
+    yield mock, endpoint
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def stub_dns():
+    """
+    A `Stub_DNS` served in process, yield `(stub, nameserver)`.
+    """
+    pytest.importorskip("dns")
+    from stub_dns import Stub_DNS, start_in_process
+
+    stub = Stub_DNS()
+    server = start_in_process(stub)
+    yield stub, "127.0.0.1:{}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cloudflare_config(tmp_path, monkeypatch):
+    """
+    Write `CLOUDFLARE_API_TOKEN.json` (tokens `t1` to `t3`) and `CLOUDFLARE_ZONE.json`
+    (the zones of `mock_cloudflare`) to `tmp_path` and read them, and the zone cache,
+    there instead of in the current directory. Return `tmp_path`.
+    """
+    tokens = {"t1": "token-1", "t2": "token-2", "t3": "token-3"}
+    zones = {"example.com": "zone-1", "example.org": "zone-2"}
+    for name, data in (
+        ("CLOUDFLARE_API_TOKEN.json", tokens),
+        ("CLOUDFLARE_ZONE.json", zones),
+    ):
+        (tmp_path / name).write_text(json.dumps(data))
+    api_token_store = Config_Store(tmp_path / "CLOUDFLARE_API_TOKEN.json", use_cache=False)
+    monkeypatch.setattr(cloudflare_api, "api_token_store", api_token_store)
+    monkeypatch.setattr(token_pool, "api_token_store", api_token_store)
+    monkeypatch.setattr(
+        cloudflare_api,
+        "cloudflare_zone_store",
+        Config_Store(tmp_path / "CLOUDFLARE_ZONE.json", use_cache=False),
+    )
+    zone_cache = Zone_Cache(tmp_path / ".cloudflare_zone_cache.json")
+    monkeypatch.setattr(cloudflare_api, "zone_cache", zone_cache)
+    monkeypatch.setattr(token_pool, "zone_cache", zone_cache)
+    return tmp_path
@@ -0,0 +1,103 @@
+import io
+import json
+import pytest
+
+pytest.importorskip("requests")
+
+from py_ses_auth import domain_dns_payloads
+from py_ses_auth.audit import audit_fleet, iter_audit_fleet
+
+
+def _row(domain: str) -> dict:
+    return dict(domain=domain, region="us-east-1", token_name="t1", local_part="dmarc")
+
+
+def _publish(mock, zone_id: str, row: dict, path_src):
+    for payload in domain_dns_payloads(
+        path_src, row["domain"], row["region"], local_part=row["local_part"]
+    ):
+        mock.new_record(zone_id, payload)
+
+
+def test_drifts(mock_cloudflare, cloudflare_config):
+    mock, _ = mock_cloudflare
+    rows = [_row("a.example.com"), _row("b.example.com")]
+    for row in rows:
+        (cloudflare_config / row["domain"]).mkdir()
+    _publish(mock, "zone-1", rows[0], cloudflare_config)
+    mock.new_record(
+        "zone-1",
+        {"type": "TXT", "name": "_dmarc.b.example.com", "content": '"v=DMARC1;p=none"'},
+    )
+    drift_file = io.StringIO()
+    results = audit_fleet(cloudflare_config, rows, drift_file, workers=2)
+    drifts = [json.loads(line) for line in drift_file.getvalue().splitlines()]
+    assert sorted((d["drift"], d["type"], d["name"]) for d in drifts) == [
+        ("mismatch", "TXT", "_dmarc.b.example.com"),
+        ("missing", "MX", "b.example.com."),
+    ]
+    assert {r["domain"]: r["drifts"] for r in results} == {
+        "a.example.com": 0,
+        "b.example.com": 2,
+    }
+
+
+def test_zones_released_as_manifest_streams(mock_cloudflare, cloudflare_config):
+    mock, _ = mock_cloudflare
+    workers = 1
+    max_zone_domains = 4
+    drift_file = io.StringIO()
+    read = []
+
+    def rows():
+        # 10 domains of each zone, one zone after the other, all of them missing
+        for zone in ("example.com", "example.org"):
+            for i in range(10):
+                row = _row("d{}.{}".format(i, zone))
+                (cloudflare_config / row["domain"]).mkdir()
+                read.append(row["domain"])
+                yield row
+
+    results = iter_audit_fleet(
+        cloudflare_config, rows(), drift_file, workers, max_zone_domains
+    )
+    first = next(results)
+    # at most `workers` zone audits are queued, so results come while the manifest
+    # is read, and their drifts are written already
+    assert len(read) <= 2 * max_zone_domains + 2 * workers
+    assert first["domain"] in drift_file.getvalue()
+    results = [first] + list(results)
+    assert sorted(r["domain"] for r in results) == sorted(read)
+    assert all(r["drifts"] == 2 for r in results)
+    # each zone is audited in chunks of at most `max_zone_domains` domains
+    assert mock.counts["GET"] == 6
+
+
+def test_record_recreated_by_apply_not_deleted(mock_cloudflare, cloudflare_config):
+    from py_ses_auth.fleet import plan_domain
+    from py_ses_auth.record_log import close_record_logs
+
+    mock, _ = mock_cloudflare
+    row = _row("a.example.com")
+    (cloudflare_config / row["domain"]).mkdir()
+    assert plan_domain(cloudflare_config, row, apply=True)["success"]
+    zone = mock.records["zone-1"]
+    dmarc_id = next(i for i, r in zone.items() if r["name"].startswith("_dmarc."))
+    del zone[dmarc_id]
+    close_record_logs()
+
+    # deleted outside of the CLI
+    drift_file = io.StringIO()
+    audit_fleet(cloudflare_config, [row], drift_file, workers=1)
+    drifts = [json.loads(line) for line in drift_file.getvalue().splitlines()]
+    assert [(d["drift"], d["name"]) for d in drifts] == [
+        ("deleted", "_dmarc.a.example.com")
+    ]
+
+    # re-created under a new id, the log still has the deleted one
+    assert plan_domain(cloudflare_config, row, apply=True)["success"]
+    close_record_logs()
+    drift_file = io.StringIO()
+    results = audit_fleet(cloudflare_config, [row], drift_file, workers=1)
+    assert drift_file.getvalue() == ""
+    assert results[0]["drifts"] == 0
@@ -0,0 +1,124 @@
+import json
+import pytest
+
+pytest.importorskip("requests")
+
+from py_ses_auth.cloudflare_api import bind_zone_fragment
+from py_ses_auth.fleet import onboard_fleet
+from py_ses_auth.record_log import Record_Log, close_record_logs
+from py_ses_auth.ses_backend import Fake_Backend
+
+row = dict(
+    domain="example.com",
+    region="us-east-1",
+    token_name="t1",
+    selector="s1",
+    subdomain="mail",
+    local_part="dmarc",
+)
+
+
+def test_bind_zone_fragment():
+    long_value = "p=" + "A" * 400
+    fragment = bind_zone_fragment(
+        [
+            {"type": "TXT", "name": "s1._domainkey.example.com", "content": long_value},
+            {
+                "type": "MX",
+                "name": "example.com.",
+                "content": "inbound-smtp.us-east-1.amazonaws.com",
+                "ttl": 1,
+                "priority": 10,
+            },
+            {"type": "TXT", "name": "_dmarc.example.com", "content": '"v=DMARC1"'},
+        ]
+    )
+    assert fragment.splitlines() == [
+        's1._domainkey.example.com.\t1\tIN\tTXT\t"{}" "{}"'.format(
+            long_value[:255], long_value[255:]
+        ),
+        "example.com.\t1\tIN\tMX\t10 inbound-smtp.us-east-1.amazonaws.com.",
+        '_dmarc.example.com.\t1\tIN\tTXT\t"v=DMARC1"',
+    ]
+
+
+@pytest.fixture
+def fleet(mock_cloudflare, cloudflare_config):
+    mock, _ = mock_cloudflare
+    mock.capture = True
+    path_src = cloudflare_config / "example.com"
+    path_src.mkdir()
+    for kind in ("public", "private"):
+        (path_src / "{}.key".format(kind)).write_text(
+            "-----BEGIN KEY-----\n{}KEY\n-----END KEY-----\n".format(kind.upper())
+        )
+
+    def onboard(batch: str) -> dict:
+        (result,) = onboard_fleet(
+            cloudflare_config, [row], workers=2, batch=batch, ses_backend=Fake_Backend()
+        )
+        return result
+
+    yield mock, path_src, onboard
+    close_record_logs()
+
+
+_names = [
+    "s1._domainkey.example.com",
+    "mail.example.com",
+    "mail.example.com",
+    "example.com",
+    "_dmarc.example.com",
+]
+
+
+def _posts(mock) -> list:
+    return [r for r in mock.captured if r[0] == "POST"]
+
+
+def test_fleet_batch_records(fleet):
+    mock, path_src, onboard = fleet
+    assert onboard("records")["success"]
+
+    # all the records are created by one request to the batch endpoint
+    ((_, path, content_type, body),) = _posts(mock)
+    assert path.endswith("/zones/zone-1/dns_records/batch")
+    assert content_type == "application/json"
+    payload = json.loads(body)
+    assert list(payload) == ["posts"]
+    assert [p["name"].rstrip(".") for p in payload["posts"]] == _names
+    assert payload["posts"][0]["content"] == "p=PUBLICKEY"
+    assert sorted(r["name"] for r in mock.records["zone-1"].values()) == sorted(_names)
+
+    # each created record is still logged
+    ids = sorted(mock.records["zone-1"])
+    assert sorted(r["id"] for r in Record_Log(path_src).records()) == ids
+    close_record_logs()
+    logged = json.loads((path_src / Record_Log.legacy_name).read_text())
+    assert sorted(r["id"] for r in logged["Cloudflare"]) == ids
+
+
+def test_fleet_batch_import(fleet):
+    mock, path_src, onboard = fleet
+    assert onboard("import")["success"]
+
+    # all the records are uploaded as one BIND zone fragment
+    ((_, path, content_type, body),) = _posts(mock)
+    assert path.endswith("/zones/zone-1/dns_records/import")
+    assert content_type.startswith("multipart/form-data; boundary=")
+    fragment = [line.decode() for line in body.splitlines() if line.count(b"\tIN\t") == 1]
+    assert [line.split("\t")[0] for line in fragment] == [n + "." for n in _names]
+    assert fragment[0].endswith('\tTXT\t"p=PUBLICKEY"')
+    assert b'name="proxied"\r\n\r\nfalse' in body
+
+    # the endpoint doesn't return the records, so nothing is logged
+    assert list(Record_Log(path_src).records()) == []
+
+
+def test_batch_failure_logs_nothing(fleet):
+    mock, path_src, onboard = fleet
+    mock.fail(400, method="POST", code=1004)
+    result = onboard("records")
+    assert not result["success"]
+    assert result["failed_step"] == "dns_batch"
+    assert list(Record_Log(path_src).records()) == []
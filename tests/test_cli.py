@@ -0,0 +1,18 @@
+import pytest
+
+from ses_auth import _ses_auth
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["byodkim", "example.com", "--region", "us-east-1", "--aws_only"],
+        ["mail_from_domain", "mail", "example.com", "--region", "us-east-1", "--aws_only"],
+        ["inbound_smtp", "example.com", "--region", "us-east-1", "--aws_only"],
+        ["dmarc", "dmarc", "example.com", "--region", "us-east-1", "--aws_only"],
+    ],
+)
+def test_common_arguments_accepted_by_every_domain_command(args):
+    _ses_auth._build_sub_parser(args[0])
+    ns = _ses_auth.parse_args(args + ["--token_name", "t1"])
+    assert (ns.domain, ns.region, ns.aws_only) == ("example.com", "us-east-1", True)
@@ -0,0 +1,92 @@
+import uuid
+import pytest
+
+pytest.importorskip("requests")
+
+from py_ses_auth.cloudflare_api import Cloudflare_API
+from py_ses_auth.rate_limit import counters
+
+
+def _api(zone_identifier: str = "zone-1") -> Cloudflare_API:
+    # a token of its own, so that the token bucket isn't shared between tests
+    return Cloudflare_API(uuid.uuid4().hex, zone_identifier)
+
+
+def _payload(name: str) -> dict:
+    return {"type": "TXT", "name": name, "content": "v=spf1 -all", "ttl": 1}
+
+
+def test_post_retried_after_429(mock_cloudflare):
+    mock, _ = mock_cloudflare
+    mock.fail(429, method="POST", times=1, headers=[("Retry-After", "0")])
+    with _api() as api:
+        response = api.create_dns_record(_payload("a.example.com"))
+    assert response.status_code == 200
+    assert mock.counts["POST"] == 2
+    assert counters.snapshot() == {"requests": 2, "throttled": 1, "retried": 1}
+
+
+def test_post_not_retried_after_server_error(mock_cloudflare):
+    mock, _ = mock_cloudflare
+    mock.fail(502, method="POST", times=1)
+    with _api() as api:
+        response = api.create_dns_record(_payload("a.example.com"))
+    # the record may have been created, it is left to the caller to check
+    assert response.status_code == 502
+    assert mock.counts["POST"] == 1
+
+
+def test_get_retried_after_server_error(mock_cloudflare):
+    mock, _ = mock_cloudflare
+    mock.new_record("zone-1", _payload("a.example.com"))
+    mock.fail(502, method="GET", times=2)
+    with _api() as api:
+        records = api.find_dns_records("TXT")
+    assert [r["name"] for r in records] == ["a.example.com"]
+    assert mock.counts["GET"] == 3
+
+
+def test_post_retried_after_connect_error(mock_cloudflare, monkeypatch):
+    import requests
+
+    mock, _ = mock_cloudflare
+    api = _api()
+    send = api.session.request
+    calls = []
+
+    def request(method, url, **kwargs):
+        calls.append(kwargs.get("timeout"))
+        if len(calls) == 1:
+            raise requests.ConnectTimeout("connect timeout")
+        return send(method, url, **kwargs)
+
+    monkeypatch.setattr(api.session, "request", request)
+    with api:
+        response = api.create_dns_record(_payload("a.example.com"))
+    assert response.status_code == 200
+    assert calls == [Cloudflare_API.timeout] * 2
+
+
+def test_post_not_retried_after_read_timeout(mock_cloudflare, monkeypatch):
+    import requests
+
+    api = _api()
+
+    def request(method, url, **kwargs):
+        raise requests.ReadTimeout("read timeout")
+
+    monkeypatch.setattr(api.session, "request", request)
+    with api, pytest.raises(requests.ReadTimeout):
+        api.create_dns_record(_payload("a.example.com"))
+    assert counters.snapshot()["requests"] == 1
+
+
+def test_zone_resolved_without_zone_file(mock_cloudflare, cloudflare_config):
+    mock, _ = mock_cloudflare
+    (cloudflare_config / "CLOUDFLARE_ZONE.json").unlink()
+    with _api(None) as api:
+        assert api.resolve_zone_id("a.example.com") == "zone-1"
+        assert api.resolve_zone_id("b.example.org") == "zone-2"
+    # the zones are listed once, then read from the zone cache
+    assert mock.counts["GET"] == 1
+    assert (cloudflare_config / ".cloudflare_zone_cache.json").exists()
@@ -0,0 +1,81 @@
+import asyncio
+import uuid
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from py_ses_auth.cloudflare_api import Cloudflare_API_Error
+from py_ses_auth.cloudflare_async import Async_Cloudflare_API
+from py_ses_auth.rate_limit import counters
+
+
+def _payload(name: str) -> dict:
+    return {"type": "TXT", "name": name, "content": "v=spf1 -all", "ttl": 1}
+
+
+def _run(mock_cloudflare, fn, concurrency=4):
+    _, endpoint = mock_cloudflare
+
+    async def main():
+        # a token of its own, so that the token bucket isn't shared between tests
+        api = Async_Cloudflare_API(uuid.uuid4().hex, "zone-1", concurrency)
+        api.endpoint = endpoint
+        async with api:
+            return await fn(api)
+
+    return asyncio.run(main())
+
+
+def test_create_dns_records(mock_cloudflare):
+    mock, _ = mock_cloudflare
+    created = []
+    names = ["r{}.example.com".format(i) for i in range(20)]
+
+    async def create(api):
+        return await api.create_dns_records(
+            [_payload(name) for name in names], created.append
+        )
+
+    assert _run(mock_cloudflare, create) is True
+    assert len(created) == 20
+    assert sorted(r["name"] for r in mock.records["zone-1"].values()) == sorted(names)
+
+
+def test_retry_after_429(mock_cloudflare):
+    mock, _ = mock_cloudflare
+    mock.fail(429, method="POST", times=2, headers=[("Retry-After", "0")])
+
+    async def create(api):
+        return await api.create_dns_records([_payload("a.example.com")], None)
+
+    _run(mock_cloudflare, create)
+    assert mock.counts["POST"] == 3
+    assert mock.counts["429"] == 2
+    assert len(mock.records["zone-1"]) == 1
+    assert counters.snapshot() == {"requests": 3, "throttled": 2, "retried": 2}
+
+
+def test_list_dns_records_pages(mock_cloudflare):
+    mock, _ = mock_cloudflare
+    for i in range(5):
+        mock.new_record("zone-1", _payload("r{}.example.com".format(i)))
+
+    async def list_records(api):
+        return await api.list_dns_records(per_page=2)
+
+    records = _run(mock_cloudflare, list_records)
+    assert len(records) == 5
+    assert mock.counts["GET"] == 3
+
+
+def test_list_dns_records_failing_page(mock_cloudflare):
+    mock, _ = mock_cloudflare
+    for i in range(5):
+        mock.new_record("zone-1", _payload("r{}.example.com".format(i)))
+    mock.fail(403, method="GET", page=2, code=9109)
+
+    async def list_records(api):
+        return await api.list_dns_records(per_page=2)
+
+    with pytest.raises(Cloudflare_API_Error):
+        _run(mock_cloudflare, list_records)
@@ -0,0 +1,77 @@
+import csv
+import gzip
+import json
+import time
+import pytest
+
+pytest.importorskip("requests")
+
+from py_ses_auth.fleet import Fleet_Report, _iter_fleet
+
+
+def test_manifest_pulled_at_most_twice_workers_ahead(cloudflare_config):
+    workers = 3
+    pulled = []
+    consumed = []
+    ahead = []
+
+    def rows():
+        for i in range(50):
+            # rows read but whose result wasn't yielded yet
+            ahead.append(len(pulled) - len(consumed))
+            pulled.append(i)
+            yield {"domain": "d{}.example.com".format(i), "token_name": "t1"}
+
+    def job(row, cf_api):
+        time.sleep(0.01)
+        return row["domain"]
+
+    for domain in _iter_fleet(rows(), workers, job):
+        consumed.append(domain)
+    assert len(consumed) == 50
+    assert max(ahead) <= 2 * workers
+    # the pool is kept busy
+    assert max(ahead) > workers
+
+
+_results = [
+    dict(domain="a.example.com", success=True, failed_step=None, error=None),
+    dict(domain="b.example.com", success=False, failed_step="dkim", error='a "b", c'),
+    dict(domain="c.example.com", success=True, failed_step=None, error=None),
+]
+
+
+def _read_report(path) -> list:
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rt", encoding="utf-8", newline="") as f:
+        if ".jsonl" in path.suffixes:
+            return [json.loads(line) for line in f]
+        return [
+            dict(
+                r,
+                success=r["success"] == "True",
+                failed_step=r["failed_step"] or None,
+                error=r["error"] or None,
+            )
+            for r in csv.DictReader(f)
+        ]
+
+
+@pytest.mark.parametrize(
+    "name", ["report.csv", "report.csv.gz", "report.jsonl", "report.jsonl.gz"]
+)
+def test_report_file(tmp_path, name):
+    path = tmp_path / name
+    with Fleet_Report(path) as report:
+        report.extend(_results)
+    assert _read_report(path) == _results
+    assert (report.succeeded, report.failed) == (2, 1)
+    # only failures are kept in memory
+    assert [r.to_dict() for r in report.results] == [_results[1]]
+
+
+def test_report_in_memory():
+    report = Fleet_Report()
+    report.extend(_results)
+    assert [r.to_dict() for r in report.results] == _results
+    assert report.results[1]["failed_step"] == "dkim"
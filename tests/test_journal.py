@@ -0,0 +1,67 @@
+import asyncio
+import pytest
+
+pytest.importorskip("requests")
+
+from py_ses_auth import async_create_dns_records, create_mail_from_dns_record
+from py_ses_auth.journal import Job_Journal, set_journal
+from py_ses_auth.record_log import close_record_logs
+
+
+@pytest.fixture
+def journal(cloudflare_config):
+    with Job_Journal(cloudflare_config / "journal.db") as journal:
+        set_journal(journal)
+        yield journal
+        set_journal(None)
+    close_record_logs()
+
+
+def _records(mock) -> list:
+    return sorted((r["type"], r["name"]) for r in mock.records.get("zone-1", {}).values())
+
+
+def test_resume_creates_only_missing_records(mock_cloudflare, cloudflare_config, journal):
+    mock, _ = mock_cloudflare
+    path_src = cloudflare_config / "example.com"
+    path_src.mkdir()
+    # the MX record is created, the TXT record fails
+    mock.fail(400, method="POST", times=1, skip=1, code=1004)
+    args = (path_src, "example.com", "us-east-1", "t1", "mail")
+    assert not create_mail_from_dns_record(*args)
+    assert _records(mock) == [("MX", "mail.example.com")]
+    assert [step for step, _, _ in journal.steps("example.com")] == ["dns_record"]
+
+    assert create_mail_from_dns_record(*args)
+    assert mock.counts["POST"] == 3
+    assert _records(mock) == [("MX", "mail.example.com"), ("TXT", "mail.example.com")]
+
+    # the step is done, nothing is sent again
+    assert create_mail_from_dns_record(*args)
+    assert mock.counts["POST"] == 3
+
+
+def test_async_resume_creates_only_missing_records(
+    mock_cloudflare, cloudflare_config, journal
+):
+    pytest.importorskip("aiohttp")
+    from py_ses_auth import domain_dns_payloads
+
+    mock, _ = mock_cloudflare
+    path_src = cloudflare_config / "example.com"
+    path_src.mkdir()
+    payloads = domain_dns_payloads(
+        path_src, "example.com", "us-east-1", subdomain_name="mail", local_part="dmarc"
+    )
+    mock.fail(400, method="POST", times=1, skip=2, code=1004)
+
+    def create():
+        return asyncio.run(
+            async_create_dns_records(path_src, "example.com", payloads, "t1")
+        )
+
+    assert not create()
+    assert len(_records(mock)) == len(payloads) - 1
+    assert create()
+    assert len(_records(mock)) == len(payloads)
+    assert mock.counts["POST"] == len(payloads) + 1
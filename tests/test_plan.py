@@ -0,0 +1,82 @@
+import pytest
+
+pytest.importorskip("requests")
+
+from py_ses_auth.fleet import plan_domain
+from py_ses_auth.record_log import close_record_logs
+
+row = dict(
+    domain="example.com",
+    region="us-east-1",
+    token_name="t1",
+    subdomain="mail",
+    local_part="dmarc",
+)
+
+
+@pytest.fixture
+def zone(mock_cloudflare, cloudflare_config):
+    mock, _ = mock_cloudflare
+    (cloudflare_config / "example.com").mkdir()
+    # the SPF record is up to date, the MAIL FROM MX is of another region, the
+    # inbound MX and the DMARC record are missing
+    mock.new_record(
+        "zone-1",
+        {
+            "type": "TXT",
+            "name": "mail.example.com",
+            "content": '"v=spf1 include:amazonses.com ~all"',
+        },
+    )
+    mx = mock.new_record(
+        "zone-1",
+        {
+            "type": "MX",
+            "name": "mail.example.com",
+            "content": "feedback-smtp.eu-west-1.amazonses.com",
+            "priority": 10,
+        },
+    )
+    yield mock, mx
+    close_record_logs()
+
+
+def _plan(capsys, cloudflare_config, apply=False) -> list:
+    capsys.readouterr()
+    assert plan_domain(cloudflare_config, row, apply=apply)["success"]
+    # "  <symbol> <type> | <name> | <content>"
+    lines = [line for line in capsys.readouterr().out.splitlines() if line[:2] == "  "]
+    return sorted(
+        (symbol, record_type, name.rstrip("."))
+        for symbol, record_type, _, name, _ in (line.split(None, 4) for line in lines)
+    )
+
+
+def test_plan(zone, capsys, cloudflare_config):
+    mock, _ = zone
+    assert _plan(capsys, cloudflare_config) == [
+        ("+", "MX", "example.com"),
+        ("+", "TXT", "_dmarc.example.com"),
+        ("=", "TXT", "mail.example.com"),
+        ("~", "MX", "mail.example.com"),
+    ]
+    # a plan changes nothing
+    assert set(mock.counts) == {"GET"}
+
+
+def test_apply_only_sends_differences(zone, capsys, cloudflare_config):
+    mock, mx = zone
+    _plan(capsys, cloudflare_config, apply=True)
+    assert (mock.counts.get("POST"), mock.counts.get("PATCH")) == (2, 1)
+    assert "DELETE" not in mock.counts
+    # the MX record is updated in place
+    assert mock.records["zone-1"][mx["id"]]["content"] == (
+        "feedback-smtp.us-east-1.amazonses.com"
+    )
+    assert len(mock.records["zone-1"]) == 4
+
+    # converged, nothing is sent again
+    assert {symbol for symbol, _, _ in _plan(capsys, cloudflare_config, apply=True)} == {
+        "="
+    }
+    assert (mock.counts.get("POST"), mock.counts.get("PATCH")) == (2, 1)
@@ -0,0 +1,75 @@
+import shutil
+import sys
+import pytest
+
+pytest.importorskip("requests")
+
+per_thread_profiles = pytest.mark.skipif(
+    sys.version_info >= (3, 12),
+    reason="one cProfile profiler at a time on Python 3.12+, no per domain profile",
+)
+
+domains = ("a.example.com", "b.example.com")
+
+
+@pytest.fixture
+def run_cli(mock_cloudflare, cloudflare_config, monkeypatch):
+    import ses_auth
+
+    monkeypatch.setattr(ses_auth, "path_cwd", cloudflare_config)
+    manifest = cloudflare_config / "domains.csv"
+    manifest.write_text("domain\n" + "\n".join(domains) + "\n")
+    for domain in domains:
+        (cloudflare_config / domain).mkdir()
+
+    def run_cli(*args, options=()):
+        path_profile = cloudflare_config / "profiles"
+        ses_auth._ses_auth.handle_args(
+            ["--quiet", "--profile", str(path_profile)]
+            + list(options)
+            + [args[0], str(manifest)]
+            + ["--region", "us-east-1", "--token_name", "t1", "--local_part", "dmarc"]
+            + list(args[1:])
+        )
+        return sorted(path.name for path in path_profile.iterdir())
+
+    return run_cli
+
+
+@per_thread_profiles
+@pytest.mark.parametrize("command", ["plan", "apply"])
+def test_plan_profiled_per_domain(run_cli, command):
+    assert run_cli(command) == sorted(
+        ["{}.pstats".format(command)]
+        + ["{}.{}.pstats".format(command, domain) for domain in domains]
+    )
+
+
+@per_thread_profiles
+def test_audit_profiled_per_domain_and_zone(run_cli, cloudflare_config):
+    profiles = run_cli("audit", "--output", str(cloudflare_config / "drifts.jsonl"))
+    assert profiles == sorted(
+        ["audit.pstats", "audit.zone-1.pstats"]
+        + ["audit.{}.pstats".format(domain) for domain in domains]
+    )
+
+
+def test_pstats_per_domain_sampled_without_per_thread_profiles(
+    run_cli, mock_cloudflare, cloudflare_config, monkeypatch, capsys
+):
+    from py_ses_auth import profiling
+
+    mock, _ = mock_cloudflare
+    # long enough for the steps of every domain to be sampled
+    mock.latency = 0.05
+    monkeypatch.setattr(profiling, "_per_thread_profiles", False)
+    assert run_cli("plan") == sorted(
+        ["plan.folded"] + ["plan.{}.folded".format(domain) for domain in domains]
+    )
+    assert "Per domain `pstats` profiles need Python < 3.12" in capsys.readouterr().out
+
+    # the merged profile doesn't need a profiler per thread
+    shutil.rmtree(cloudflare_config / "profiles")
+    profiles = run_cli("plan", options=["--profile_aggregate"])
+    assert profiles == ["plan.pstats"]
+    assert "Per domain" not in capsys.readouterr().out
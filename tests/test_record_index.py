@@ -0,0 +1,96 @@
+import threading
+import pytest
+
+pytest.importorskip("requests")
+
+from py_ses_auth.cloudflare_api import Cloudflare_API
+from py_ses_auth.fleet import plan_domain
+from py_ses_auth.record_index import Record_Index, set_record_index
+from py_ses_auth.record_log import close_record_logs
+
+
+@pytest.fixture
+def record_index(cloudflare_config):
+    with Record_Index(cloudflare_config / "records.db") as record_index:
+        set_record_index(record_index)
+        yield record_index
+        set_record_index(None)
+    close_record_logs()
+
+
+def _txt(name: str, content: str) -> dict:
+    return {"type": "TXT", "name": name, "content": content, "ttl": 1}
+
+
+def test_plan_sees_records_deleted_outside(
+    mock_cloudflare, cloudflare_config, record_index
+):
+    mock, _ = mock_cloudflare
+    row = dict(
+        domain="example.com", region="us-east-1", token_name="t1", local_part="dmarc"
+    )
+    (cloudflare_config / "example.com").mkdir()
+    assert plan_domain(cloudflare_config, row, apply=True)["success"]
+    created = mock.counts["POST"]
+    assert created > 0
+
+    # deleted in the dashboard, while the mirror was synced less than `max_age` ago
+    zone = mock.records["zone-1"]
+    del zone[next(iter(zone))]
+    assert plan_domain(cloudflare_config, row, apply=True)["success"]
+    assert mock.counts["POST"] == created + 1
+    assert len(zone) == created
+
+
+def test_find_syncs_the_mirror(
+    mock_cloudflare, cloudflare_config, record_index, monkeypatch
+):
+    mock, _ = mock_cloudflare
+    dns_editor = Cloudflare_API("token-1", "zone-1")
+    record = mock.new_record("zone-1", _txt("a.example.com", "old"))
+    assert [r["id"] for r in dns_editor.find_dns_records("TXT", "a.example.com")] == [
+        record["id"]
+    ]
+
+    # modified records are listed once the mirror is older than `max_age`
+    monkeypatch.setattr(Record_Index, "max_age", 0)
+    added = mock.new_record("zone-1", _txt("b.example.com", "new"))
+    added["modified_on"] = "9999-12-31T00:00:00Z"
+    assert [r["id"] for r in dns_editor.find_dns_records("TXT", "b.example.com")] == [
+        added["id"]
+    ]
+
+    # deleted records only once the last full listing is older than `full_max_age`
+    del mock.records["zone-1"][record["id"]]
+    assert dns_editor.find_dns_records("TXT", "a.example.com")
+    monkeypatch.setattr(Record_Index, "full_max_age", 0)
+    assert dns_editor.find_dns_records("TXT", "a.example.com") == []
+    dns_editor.close()
+
+
+@pytest.mark.parametrize("full", [False, True])
+def test_concurrent_syncs_list_zone_once(mock_cloudflare, record_index, full):
+    mock, _ = mock_cloudflare
+    mock.new_record("zone-1", _txt("a.example.com", "a"))
+    mock.latency = 0.2
+    barrier = threading.Barrier(4)
+    counts = []
+
+    def sync():
+        dns_editor = Cloudflare_API("token-1", "zone-1")
+        barrier.wait()
+        counts.append(record_index.sync(dns_editor, full=full))
+
+    threads = [threading.Thread(target=sync) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # the workers which waited for the first listing don't list the zone again
+    assert mock.counts["GET"] == 1
+    assert sorted(counts) == [0, 0, 0, 1]
+
+    # a full sync requested afterwards lists it again
+    mock.latency = 0
+    assert record_index.sync(Cloudflare_API("token-1", "zone-1"), full=True) == 1
+    assert mock.counts["GET"] == 2
@@ -0,0 +1,103 @@
+import json
+import multiprocessing
+import threading
+
+from py_ses_auth.record_log import Record_Log, close_record_log, get_record_log
+
+
+def _record(i: int, name: str = "a.example.com", record_type: str = "TXT") -> dict:
+    return {"id": "id-{}".format(i), "type": record_type, "name": name, "content": str(i)}
+
+
+def test_append_and_find(tmp_path):
+    log = Record_Log(tmp_path)
+    log.append(_record(1))
+    log.append(_record(2, "MAIL.example.com.", "MX"))
+    lines = (tmp_path / Record_Log.name).read_text().splitlines()
+    assert [json.loads(line)["id"] for line in lines] == ["id-1", "id-2"]
+
+    assert log.get("id-2")["type"] == "MX"
+    assert [r["id"] for r in log.find("MX", "mail.example.com")] == ["id-2"]
+    assert [r["id"] for r in log.find("TXT")] == ["id-1"]
+    # records appended once the index is built are indexed too
+    log.append(_record(3))
+    assert [r["id"] for r in log.find(name="a.example.com")] == ["id-1", "id-3"]
+    log.close()
+
+
+def test_partial_line_skipped(tmp_path):
+    (tmp_path / Record_Log.name).write_text(
+        json.dumps(_record(1)) + "\n" + '{"id": "id-2", "ty'
+    )
+    assert [r["id"] for r in Record_Log(tmp_path).records()] == ["id-1"]
+
+
+def test_compact_merges_into_legacy_file(tmp_path):
+    # trailing bytes left by the former in-place rewrites are ignored
+    (tmp_path / Record_Log.legacy_name).write_text(
+        json.dumps({"Cloudflare": [_record(1)]}, indent=4) + "\n]}"
+    )
+    log = get_record_log(tmp_path)
+    log.append(_record(2))
+    log.append(_record(3))
+    close_record_log(tmp_path)
+
+    legacy = json.loads((tmp_path / Record_Log.legacy_name).read_text())
+    assert [r["id"] for r in legacy["Cloudflare"]] == ["id-1", "id-2", "id-3"]
+    assert (tmp_path / Record_Log.name).read_text() == ""
+    assert not list(tmp_path.glob("*.tmp"))
+
+    # compacting again keeps the records, appending after it adds to them
+    log = Record_Log(tmp_path)
+    log.compact()
+    log.append(_record(4))
+    log.compact()
+    log.close()
+    legacy = json.loads((tmp_path / Record_Log.legacy_name).read_text())
+    assert [r["id"] for r in legacy["Cloudflare"]] == ["id-1", "id-2", "id-3", "id-4"]
+    assert [r["id"] for r in Record_Log(tmp_path).records()] == [
+        "id-1",
+        "id-2",
+        "id-3",
+        "id-4",
+    ]
+
+
+def _append_records(log: Record_Log, start: int, count: int):
+    # long lines, so that unlocked writes would interleave
+    for i in range(start, start + count):
+        log.append(dict(_record(i), content="x" * 8192))
+
+
+def _append_in_process(path_src, start: int, count: int):
+    log = Record_Log(path_src, fsync_every=1000)
+    _append_records(log, start, count)
+    log.close()
+
+
+def test_concurrent_appends(tmp_path):
+    count = 200
+    processes = [
+        multiprocessing.Process(
+            target=_append_in_process, args=(tmp_path, i * count, count)
+        )
+        for i in range(3)
+    ]
+    for process in processes:
+        process.start()
+    # threads of this process share one log
+    log = Record_Log(tmp_path)
+    threads = [
+        threading.Thread(target=_append_records, args=(log, (3 + i) * count, count))
+        for i in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads + processes:
+        thread.join()
+    log.close()
+    assert all(process.exitcode == 0 for process in processes)
+
+    lines = (tmp_path / Record_Log.name).read_text().splitlines()
+    ids = sorted(int(json.loads(line)["id"][3:]) for line in lines)
+    assert ids == list(range(5 * count))
@@ -0,0 +1,97 @@
+import pytest
+
+pytest.importorskip("dns")
+pytest.importorskip("cryptography")
+pytest.importorskip("requests")
+
+from py_ses_auth.journal import Job_Journal
+from py_ses_auth.record_log import close_record_logs
+from py_ses_auth.rotation import rotate_fleet
+from py_ses_auth.ses_backend import Fake_Backend
+
+row = dict(domain="example.com", region="us-east-1", token_name="t1", selector="new")
+
+
+@pytest.fixture
+def rotation(mock_cloudflare, cloudflare_config, stub_dns):
+    mock, _ = mock_cloudflare
+    stub, nameserver = stub_dns
+    (cloudflare_config / "example.com").mkdir()
+    mock.new_record("zone-1", _txt("old._domainkey.example.com", "p=OLD"))
+    mock.new_record("zone-1", _txt("other._domainkey.example.com", "p=OTHER"))
+    backend = Fake_Backend()
+    backend.create_email_identity("us-east-1", {"EmailIdentity": "example.com"})
+    journal = Job_Journal(cloudflare_config / "journal.db")
+
+    def rotate(window: float, grace: float = 3600) -> dict:
+        (result,) = rotate_fleet(
+            cloudflare_config,
+            [row],
+            journal,
+            workers=1,
+            key_size=1024,
+            grace=grace,
+            window=window,
+            nameservers=[nameserver],
+            ses_backend=backend,
+            old_selector="old",
+            base_delay=0.05,
+            max_delay=0.1,
+        )
+        return result
+
+    yield mock, stub, backend, rotate
+    journal.close()
+    close_record_logs()
+
+
+def _txt(name: str, content: str) -> dict:
+    return {"type": "TXT", "name": name, "content": content, "ttl": 1}
+
+
+def _names(mock) -> list:
+    return sorted(r["name"] for r in mock.records["zone-1"].values())
+
+
+def _propagate(mock, stub):
+    for record in mock.records["zone-1"].values():
+        if record["name"] == "new._domainkey.example.com":
+            stub.add(record["name"], "TXT", '"{}"'.format(record["content"]))
+
+
+def test_rotation_phases(rotation, cloudflare_config):
+    mock, stub, backend, rotate = rotation
+
+    # the window ends while the new record isn't visible yet
+    result = rotate(window=0.5)
+    assert (result["success"], result["phase"]) == (True, "visible")
+    assert mock.counts["POST"] == 1
+    assert "new._domainkey.example.com" in _names(mock)
+    assert (cloudflare_config / "example.com/keys/new/private.key").exists()
+    assert not backend.calls[1:]
+
+    # resumed from the journal, not published again, old selector kept during `grace`
+    _propagate(mock, stub)
+    result = rotate(window=10)
+    assert (result["success"], result["phase"]) == (True, "retire")
+    assert mock.counts["POST"] == 1
+    assert "DELETE" not in mock.counts
+    assert [call[0] for call in backend.calls[1:]] == [
+        "put_email_identity_dkim_signing_attributes"
+    ]
+    assert backend.calls[1][2]["SigningAttributes"]["DomainSigningSelector"] == "new"
+    assert "old._domainkey.example.com" in _names(mock)
+
+    # only the old selector is retired once `grace` passed
+    result = rotate(window=10, grace=0)
+    assert (result["success"], result["phase"]) == (True, "done")
+    assert mock.counts["DELETE"] == 1
+    assert _names(mock) == ["new._domainkey.example.com", "other._domainkey.example.com"]
+    assert (cloudflare_config / "example.com/private.key").read_bytes() == (
+        cloudflare_config / "example.com/keys/new/private.key"
+    ).read_bytes()
+
+    # nothing left to do
+    counts = dict(mock.counts)
+    assert rotate(window=10, grace=0)["phase"] == "done"
+    assert mock.counts == counts
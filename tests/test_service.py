@@ -0,0 +1,90 @@
+import json
+import stat
+import urllib.request
+import pytest
+
+pytest.importorskip("requests")
+
+from py_ses_auth.service import Onboarding_Service, start_server
+from ses_auth import _ses_auth
+
+
+@pytest.fixture
+def service():
+    service = Onboarding_Service(_ses_auth, workers=1)
+    yield service
+    service.close()
+
+
+@pytest.mark.parametrize(
+    "domain", ["../etc", "a/b.example.com", "example", "a-.example.com", "a..example.com"]
+)
+def test_submit_rejects_domains_which_are_not_domain_names(service, domain):
+    with pytest.raises(AssertionError, match="is not a domain name"):
+        service.submit(["dmarc", "dmarc", domain, "--token_name", "t1"])
+    assert service.list() == []
+
+
+def test_submit_rejects_invalid_arguments(service):
+    with pytest.raises(AssertionError, match="Invalid arguments"):
+        service.submit(["dmarc", "example.com", "--unknown"])
+    with pytest.raises(AssertionError, match="Sub command"):
+        service.submit(["serve"])
+
+
+def test_remote_host_needs_allow_remote(service):
+    with pytest.raises(AssertionError, match="--allow_remote"):
+        start_server(service, "0.0.0.0:0")
+    for listen, allow_remote in (("127.0.0.1:0", False), ("0.0.0.0:0", True)):
+        start_server(service, listen, allow_remote).server_close()
+
+
+def test_unix_socket_only_accessible_by_owner(service, tmp_path):
+    path = tmp_path / "ses_auth.sock"
+    server = start_server(service, str(path))
+    try:
+        assert stat.S_IMODE(path.stat().st_mode) == 0o600
+    finally:
+        server.server_close()
+
+
+def test_http_submit_rejected(service):
+    import threading
+
+    server = start_server(service, "127.0.0.1:0")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        request = urllib.request.Request(
+            "http://127.0.0.1:{}/jobs".format(server.server_port),
+            data=json.dumps({"args": ["dmarc", "dmarc", "../x"]}).encode(),
+        )
+        with pytest.raises(urllib.error.HTTPError) as err:
+            urllib.request.urlopen(request, timeout=5)
+        assert err.value.code == 400
+        assert "is not a domain name" in json.loads(err.value.read())["error"]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_job_keeps_its_messages_with_json_log_file(service, cloudflare_config, monkeypatch):
+    import ses_auth
+    from py_ses_auth.output import output
+
+    monkeypatch.setattr(ses_auth, "path_cwd", cloudflare_config)
+    (cloudflare_config / "example.com").mkdir()
+    path_log = cloudflare_config / "log.jsonl"
+    output.configure(json_lines=True, path=path_log)
+    try:
+        job = service.submit(["dmarc", "dmarc", "example.com", "--token_name", "none"])
+        for _ in job.follow(timeout=1):
+            pass
+    finally:
+        output.configure()
+    assert job.status == "failed"
+    lines = [json.loads(line) for line in job.lines]
+    assert lines and all(line["job"] == job.id for line in lines)
+    assert {"step": "dmarc_dns", "status": "failed"}.items() <= lines[-1].items()
+    # the log file has the same messages
+    logged = [json.loads(line) for line in path_log.read_text().splitlines()]
+    assert logged == lines
@@ -0,0 +1,7 @@
+from bench_startup import budget_ms, heavy_modules, import_times
+
+
+def test_import_time_budget():
+    import_ms, modules = import_times(5)
+    assert import_ms <= budget_ms
+    assert sorted(m for m in heavy_modules if m in modules) == []
@@ -0,0 +1,78 @@
+import pytest
+
+pytest.importorskip("requests")
+
+from py_ses_auth.token_pool import get_cloudflare_api
+
+
+def _txt(i: int) -> dict:
+    return {"type": "TXT", "name": "r{}.example.com".format(i), "content": "x", "ttl": 1}
+
+
+@pytest.fixture
+def pooled_api(mock_cloudflare, cloudflare_config):
+    apis = []
+
+    def open_api(token_name: str, zone_id: str = "zone-1"):
+        api = get_cloudflare_api(token_name, zone_id)
+        apis.append(api)
+        return api
+
+    yield open_api
+    for api in apis:
+        api.close()
+
+
+def _members(api) -> dict:
+    return {member.name: member for member in api.pool.members}
+
+
+def test_failover_to_healthy_token(mock_cloudflare, pooled_api):
+    mock, _ = mock_cloudflare
+    mock.fail(401, token="token-1", code=9109)
+    mock.fail(429, token="token-2", headers=[("Retry-After", "0")])
+    api = pooled_api("t1,t2,t3")
+    for i in range(5):
+        assert api.create_dns_record(_txt(i)).status_code == 200
+    assert len(mock.records["zone-1"]) == 5
+    members = _members(api)
+    # an invalid token is set aside, a throttled one is only skipped
+    assert members["t1"].disabled
+    assert not members["t2"].disabled and not members["t2"].denied_zones
+    assert not members["t3"].disabled
+
+
+def test_all_throttled_waits_for_a_token(mock_cloudflare, pooled_api):
+    mock, _ = mock_cloudflare
+    for token in ("token-1", "token-2"):
+        mock.fail(429, method="POST", token=token, times=1, headers=[("Retry-After", "0")])
+    api = pooled_api("t1,t2")
+    assert api.create_dns_record(_txt(0)).status_code == 200
+    assert mock.counts["429"] == 2
+    assert mock.counts["POST"] == 3
+    assert not any(m.disabled or m.denied_zones for m in api.pool.members)
+
+
+def test_forbidden_zone_denied_to_token(mock_cloudflare, pooled_api):
+    mock, _ = mock_cloudflare
+    mock.fail(403, method="POST", token="token-1", code=10000)
+    api = pooled_api("t1,t2")
+    for i in range(3):
+        assert api.create_dns_record(_txt(i)).status_code == 200
+    # the first token is tried first, once
+    assert mock.counts["403"] == 1
+    members = _members(api)
+    assert members["t1"].denied_zones == {"zone-1"}
+    assert not members["t1"].disabled
+    # the token still serves the other zones
+    assert members["t1"] in api.pool.eligible("zone-2")
+
+
+def test_throttled_zone_listing_not_set_aside(mock_cloudflare, pooled_api):
+    mock, _ = mock_cloudflare
+    mock.fail(429, method="GET", token="token-1", times=1, headers=[("Retry-After", "0")])
+    api = pooled_api("t1,t2")
+    assert api.create_dns_record(_txt(0)).status_code == 200
+    members = _members(api)
+    assert not members["t1"].disabled
+    assert members["t1"] in api.pool.eligible("zone-1")
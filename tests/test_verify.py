@@ -0,0 +1,116 @@
+import pytest
+
+pytest.importorskip("dns")
+
+from py_ses_auth import domain_dns_payloads
+from py_ses_auth.ses_backend import Fake_Backend
+from py_ses_auth.verify import DNS_Checker, verify_fleet
+
+
+def _row(domain: str) -> dict:
+    return dict(domain=domain, region="us-east-1", subdomain="mail", local_part="dmarc")
+
+
+def _publish(stub, row: dict, tmp_path, skip=()):
+    payloads = domain_dns_payloads(
+        tmp_path / row["domain"],
+        row["domain"],
+        row["region"],
+        subdomain_name=row["subdomain"],
+        local_part=row["local_part"],
+    )
+    for payload in payloads:
+        if payload["name"] in skip:
+            continue
+        if payload["type"] == "MX":
+            rdata = "{} {}.".format(payload["priority"], payload["content"])
+        else:
+            rdata = '"{}"'.format(payload["content"].strip('"'))
+        stub.add(payload["name"], payload["type"], rdata)
+
+
+def _verify(tmp_path, nameserver, rows, ses_backend=False, timeout=0.5):
+    return verify_fleet(
+        tmp_path,
+        rows,
+        [nameserver],
+        timeout,
+        ses_backend=ses_backend,
+        base_delay=0.05,
+        max_delay=0.1,
+    )
+
+
+def test_verified(stub_dns, tmp_path):
+    stub, nameserver = stub_dns
+    rows = [_row("example.com"), _row("example.org")]
+    for row in rows:
+        _publish(stub, row, tmp_path)
+    results = _verify(tmp_path, nameserver, rows)
+    assert [(r["domain"], r["success"]) for r in results] == [
+        ("example.com", True),
+        ("example.org", True),
+    ]
+    assert set(results[0]["status"].values()) == {"ok"}
+
+
+def test_mismatch_and_missing(stub_dns, tmp_path):
+    stub, nameserver = stub_dns
+    row = _row("example.com")
+    _publish(stub, row, tmp_path, skip=("_dmarc.example.com", "mail.example.com"))
+    stub.add("_dmarc.example.com", "TXT", '"v=DMARC1;p=none"')
+    (result,) = _verify(tmp_path, nameserver, [row])
+    assert result["success"] is False
+    assert result["status"]["dns TXT _dmarc.example.com"] == "mismatch"
+    assert result["status"]["dns MX mail.example.com"] == "missing"
+    assert result["status"]["dns MX example.com"] == "ok"
+    assert result["failed_step"] in (
+        "dns TXT _dmarc.example.com (mismatch)",
+        "dns MX mail.example.com (missing)",
+    )
+
+
+def test_late_propagation(stub_dns, tmp_path):
+    stub, nameserver = stub_dns
+    row = _row("example.com")
+    _publish(stub, row, tmp_path, skip=("_dmarc.example.com",))
+    stub.add("_dmarc.example.com", "TXT", '"v=DMARC1;p=quarantine"', delay=0.2)
+    (result,) = _verify(tmp_path, nameserver, [dict(row, local_part=None)], timeout=2)
+    assert result["success"] is True
+
+
+def test_ses_status(stub_dns, tmp_path):
+    stub, nameserver = stub_dns
+    row = _row("example.com")
+    _publish(stub, row, tmp_path)
+    backend = Fake_Backend(status="PENDING")
+    backend.create_email_identity("us-east-1", {"EmailIdentity": "example.com"})
+    backend.put_email_identity_mail_from_attributes(
+        "us-east-1", "example.com", "mail.example.com", "USE_DEFAULT_VALUE"
+    )
+    (result,) = _verify(tmp_path, nameserver, [row], ses_backend=backend)
+    assert result["success"] is False
+    assert result["status"]["ses us-east-1"] == "mail_from=PENDING"
+
+    backend.status = "SUCCESS"
+    (result,) = _verify(tmp_path, nameserver, [row], ses_backend=backend)
+    assert result["success"] is True
+
+
+def test_error_only_fails_its_domain(stub_dns, tmp_path, monkeypatch):
+    stub, nameserver = stub_dns
+    rows = [_row("example.com"), _row("example.org")]
+    for row in rows:
+        _publish(stub, row, tmp_path)
+    lookup = DNS_Checker.lookup
+
+    async def failing_lookup(self, record_type, name):
+        if name.endswith("example.org"):
+            raise RuntimeError("resolver failure")
+        return await lookup(self, record_type, name)
+
+    monkeypatch.setattr(DNS_Checker, "lookup", failing_lookup)
+    results = _verify(tmp_path, nameserver, rows)
+    assert results[0]["success"] is True
+    assert results[1]["success"] is False
+    assert results[1]["error"] == "RuntimeError: resolver failure"